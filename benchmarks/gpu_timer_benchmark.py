@@ -0,0 +1,77 @@
+"""Checks the GPU timer (utils/gpu_timer.py) against the CPU time of frames that wait for the GPU to finish.
+
+Draws random terrain of the given size from a camera moving round a circle (as in terrain_lod_benchmark), timing
+the terrain pass with the GPU timer. First the frames are drawn back to back, like the game does, and the table
+shows the GPU times read back and how many frames had to be dropped because the results were not ready.
+Then each frame is followed by glFinish, so the CPU frame time is an upper bound for the GPU time of the pass.
+Works with a software implementation such as Mesa llvmpipe.
+
+Run from the project root (needs a display, or e.g. xvfb-run):
+
+    python -m benchmarks.gpu_timer_benchmark [--size 512] [--frames 120]
+"""
+
+import argparse
+import time
+
+import numpy as np
+from OpenGL import GL
+
+from benchmarks.terrain_lod_benchmark import makeImageData, makeCameras, createHiddenWindow, setupDrawing
+from models.terrain import Terrain, buildTerrainMesh
+from models.terrain_tiles import TerrainTiles
+from utils import lab_utils as lu
+from utils.gpu_timer import GpuTimer
+from utils.profiler import g_profiler
+
+
+# Draws the frames with the terrain pass in a GPU timer scope, returns the GPU ms of each frame read back and the CPU
+# ms of each frame.
+def drawFrames(timer, shader, tiles, cameras, finish):
+    gpuTimes = []
+    cpuTimes = []
+    GL.glFinish()
+    for viewPosition, worldToClip in cameras:
+        start = time.perf_counter()
+        timer.beginFrame()
+        if "terrain" in timer.results:
+            gpuTimes.append(timer.results.pop("terrain"))
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+        lu.setUniform(shader, "worldToClipTransform", worldToClip)
+        with timer.scope("terrain"):
+            tiles.render(worldToClip, viewPosition)
+        if finish:
+            GL.glFinish()
+        else:
+            GL.glFlush()
+        cpuTimes.append(1000.0 * (time.perf_counter() - start))
+    return gpuTimes, cpuTimes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--frames", type=int, default=120)
+    args = parser.parse_args()
+
+    createHiddenWindow()
+    print("Renderer: %s" % GL.glGetString(GL.GL_RENDERER).decode())
+
+    mesh = buildTerrainMesh(makeImageData(args.size), args.size, args.size, Terrain.xyScale, Terrain.heightScale)
+    tiles = TerrainTiles(mesh.positions, args.size, args.size)
+    cameras = makeCameras(args.size, args.frames)
+    shader = setupDrawing(mesh, tiles)
+
+    g_profiler.setEnabled(False)
+    print("%-10s %8s %10s %10s %10s %10s" % ("frames", "results", "dropped", "gpu ms", "gpu p95", "cpu ms"))
+    for name, finish in [("unsynced", False), ("glFinish", True)]:
+        timer = GpuTimer()
+        timer.setEnabled(True)
+        gpuTimes, cpuTimes = drawFrames(timer, shader, tiles, cameras, finish)
+        gpuMean, gpuP95 = (np.mean(gpuTimes), np.percentile(gpuTimes, 95.0)) if gpuTimes else (float('nan'),) * 2
+        print("%-10s %8d %10d %10.3f %10.3f %10.3f" % (name, len(gpuTimes), timer.numDroppedFrames, gpuMean, gpuP95,
+                                                       np.mean(cpuTimes)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Micro-benchmarks of the common matrix operations, in microseconds per call.
+
+Each operation is timed three ways: with np.matrix (the way lab_utils.Mat4 used to store its data), through the
+lab_utils Mat4/Mat3 wrappers and with utils/math3d writing to preallocated arrays. The batched rows build or
+apply N transforms, one at a time for the first two and with a single call on an (N, 4, 4) stack for math3d.
+
+Run from the project root:
+
+    python -m benchmarks.math_benchmark [--repeats 20000] [--batch 1000]
+"""
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+from utils import lab_utils as lu
+from utils import math3d
+
+
+def timeCall(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+# The np.matrix versions, as the lab_utils functions were written before math3d
+def matrixRotationZ(angle):
+    return np.matrix([[math.cos(angle), -math.sin(angle), 0, 0],
+                      [math.sin(angle), math.cos(angle), 0, 0],
+                      [0, 0, 1, 0],
+                      [0, 0, 0, 1]])
+
+
+def matrixTranslation(x, y, z):
+    return np.matrix([[1, 0, 0, x],
+                      [0, 1, 0, y],
+                      [0, 0, 1, z],
+                      [0, 0, 0, 1]])
+
+
+def makeCases(batch):
+    rng = np.random.default_rng(0)
+    angles = rng.uniform(0.0, 2.0 * np.pi, batch).astype(np.float32)
+    points = rng.uniform(-100.0, 100.0, (batch, 3)).astype(np.float32)
+    vector = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+
+    projection = lu.make_perspective(60.0, 1.5, 0.1, 1000.0)
+    view = lu.make_lookFrom([10.0, 20.0, 30.0], [1.0, 0.5, -0.2], [0.0, 0.0, 1.0])
+    model = lu.make_translation(1.0, 2.0, 3.0) * lu.make_rotation_z(0.5)
+    matrices = [np.matrix(m.matData, dtype=np.float64) for m in (projection, view, model)]
+    arrays = [m.matData for m in (projection, view, model)]
+
+    out4 = np.empty((4, 4), dtype=np.float32)
+    outBatch = np.empty((batch, 4, 4), dtype=np.float32)
+    outPoints = np.empty((batch, 3), dtype=np.float32)
+    outVector = np.empty(3, dtype=np.float32)
+
+    def composeInPlace():
+        math3d.multiply(arrays[0], arrays[1], out=out4)
+        math3d.multiply(out4, arrays[2], out=out4)
+
+    def matrixTransformPoints():
+        for p in points:
+            v = matrices[2].dot([p[0], p[1], p[2], 1.0])
+            np.array(v.flat, dtype=np.float32)
+
+    def wrapperTransformPoints():
+        for p in points:
+            lu.transformPoint(model, p)
+
+    def matrixBuildBatch():
+        for a, p in zip(angles, points):
+            matrixTranslation(p[0], p[1], p[2]).dot(matrixRotationZ(a))
+
+    def wrapperBuildBatch():
+        for a, p in zip(angles, points):
+            lu.make_translation(p[0], p[1], p[2]) * lu.make_rotation_z(a)
+
+    def math3dBuildBatch():
+        rotations = math3d.makeRotationZ(angles)
+        rotations[:, :3, 3] = points
+        return rotations
+
+    # (name, np.matrix, Mat4/Mat3 wrappers, math3d with preallocated output)
+    return [
+        ("compose P*V*M",
+         lambda: matrices[0].dot(matrices[1]).dot(matrices[2]),
+         lambda: projection * view * model,
+         composeInPlace),
+        ("rotate vector (z)",
+         lambda: np.array((matrixRotationZ(0.1)[:3, :3].dot(vector)).flat, dtype=np.float32),
+         lambda: lu.Mat3(lu.make_rotation_z(0.1)) * vector,
+         lambda: math3d.rotateZ(vector, 0.1, out=outVector)),
+        ("make rotation",
+         lambda: matrixRotationZ(0.1),
+         lambda: lu.make_rotation_z(0.1),
+         lambda: math3d.makeRotationZ(0.1, out=out4)),
+        ("inverse",
+         lambda: np.linalg.inv(matrices[1]),
+         lambda: lu.inverse(view),
+         lambda: math3d.inverse(arrays[1], out=out4)),
+        ("getData (upload)",
+         lambda: np.ascontiguousarray(matrices[0], dtype=np.float32),
+         lambda: projection.getData(),
+         lambda: np.ascontiguousarray(arrays[0], dtype=np.float32)),
+        ("transform %d points" % batch,
+         matrixTransformPoints,
+         wrapperTransformPoints,
+         lambda: math3d.transformPoints(arrays[2], points, out=outPoints)),
+        ("build %d transforms" % batch,
+         matrixBuildBatch,
+         wrapperBuildBatch,
+         lambda: math3d.multiply(math3dBuildBatch(), arrays[2], out=outBatch)),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=20000, help="calls per single matrix operation")
+    parser.add_argument("--batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    print("%-24s %12s %12s %12s" % ("operation", "np.matrix", "Mat4", "math3d"))
+    for name, *fns in makeCases(args.batch):
+        # The batched operations are a lot slower per call
+        repeats = args.repeats if "%d" % args.batch not in name else max(1, args.repeats // args.batch)
+        times = [1.0e6 * timeCall(fn, repeats) for fn in fns]
+        print("%-24s %12.2f %12.2f %12.2f" % (name, *times))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""CPU time per frame to compute the per-object transforms (model to clip, model to view and normal) for N objects.
+
+Compares computing them one object at a time as setCommonUniforms used to (Mat4 products and a matrix inverse for
+the normal transform), one object at a time through ViewParams (cached view-projection and the closed-form normal
+transform) and all together with ViewParams.prepareObjectTransforms. The objects are rigid with uniform scale,
+like the racer, except for the --non-rigid fraction, which are scaled non-uniformly.
+
+Run from the project root:
+
+    python -m benchmarks.object_transforms_benchmark [--counts 1 10 100 1000] [--non-rigid 0.1]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from utils import lab_utils as lu
+from utils.helper import ViewParams
+
+
+def makeView():
+    view = ViewParams()
+    view.viewToClipTransform = lu.make_perspective(60.0, 16.0 / 9.0, 0.2, 2000.0)
+    view.worldToViewTransform = lu.make_lookAt([100.0, 100.0, 100.0], [0.0, 0.0, 0.0], [0.0, 0.0, 1.0])
+    view.updateTransforms([0.0, 0.0, 1000.0])
+    return view
+
+
+def makeModelTransforms(count, nonRigidFraction, seed=0):
+    rng = np.random.default_rng(seed)
+    transforms = []
+    for i in range(count):
+        m = lu.make_translation(*rng.uniform(-500.0, 500.0, 3)) * lu.make_rotation_z(rng.uniform(0.0, 6.28))
+        if i < count * nonRigidFraction:
+            m = m * lu.make_scale(1.0, 2.0, 0.5)
+        else:
+            m = m * lu.make_scale(1.5, 1.5, 1.5)
+        transforms.append(m)
+    return transforms
+
+
+def timeFrames(frame, numFrames):
+    start = time.perf_counter()
+    for _ in range(numFrames):
+        frame()
+    return (time.perf_counter() - start) / numFrames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--non-rigid", type=float, default=0.1, help="fraction of objects with non-uniform scale")
+    parser.add_argument("--frames", type=int, default=50)
+    args = parser.parse_args()
+
+    print("%-8s %14s %14s %14s" % ("objects", "Mat4 ms", "ViewParams ms", "batched ms"))
+    for count in args.counts:
+        transforms = makeModelTransforms(count, args.non_rigid)
+
+        def legacyFrame():
+            view = makeView()
+            for m in transforms:
+                view.viewToClipTransform * view.worldToViewTransform * m
+                modelToView = view.worldToViewTransform * m
+                lu.inverse(lu.transpose(lu.Mat3(modelToView)))
+
+        def viewParamsFrame():
+            view = makeView()
+            for m in transforms:
+                view.getObjectTransforms(m)
+
+        def batchedFrame():
+            view = makeView()
+            view.prepareObjectTransforms(transforms)
+            for m in transforms:
+                view.getObjectTransforms(m)
+
+        times = [1000.0 * timeFrames(frame, args.frames) for frame in (legacyFrame, viewParamsFrame, batchedFrame)]
+        print("%-8d %14.3f %14.3f %14.3f" % (count, *times))
+
+
+if __name__ == "__main__":
+    main()
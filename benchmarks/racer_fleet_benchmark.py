@@ -0,0 +1,72 @@
+"""Time per simulation step of N racers, updated one by one (Racer) or all together (RacerFleet).
+
+Uses a random map, all racers driving at full speed with some steering. The per-object Racer loop is only timed
+up to --racer-max racers since it scales linearly; the fleet update also includes the AI (ai_inputs).
+
+Run from the project root:
+
+    python -m benchmarks.racer_fleet_benchmark [--counts 1 100 1000 10000] [--racer-max 1000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from models.racer import Racer
+from models.racer_fleet import RacerFleet
+from models.terrain import Terrain
+from models.terrain_query import TerrainQuery
+
+
+def makeTerrain(size, seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+    terrain = Terrain()
+    terrain.imageWidth = terrain.imageHeight = size
+    terrain.imageData = pixels.tobytes()
+    terrain.query = TerrainQuery(terrain.imageData, size, size, terrain.xyScale, terrain.heightScale)
+    terrain.startLocations = list(rng.uniform(-size, size, (64, 3)).astype(np.float32))
+    return terrain
+
+
+def timeSteps(step, numSteps):
+    start = time.perf_counter()
+    for _ in range(numSteps):
+        step()
+    return (time.perf_counter() - start) / numSteps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 100, 1000, 10000])
+    parser.add_argument("--racer-max", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=60)
+    args = parser.parse_args()
+
+    terrain = makeTerrain(512)
+    dt = 1.0 / 60.0
+    keys = {"UP": True, "LEFT": True}
+
+    print("%-8s %16s %16s %10s" % ("racers", "Racer ms/step", "fleet ms/step", "speedup"))
+    for count in args.counts:
+        fleet = RacerFleet(terrain, count)
+        fleetTime = timeSteps(lambda: fleet.update(dt, *fleet.ai_inputs()), args.steps)
+
+        racerTime = float('nan')
+        if count <= args.racer_max:
+            racers = []
+            for i in range(count):
+                racer = Racer()
+                racer.setup(terrain, i % len(terrain.startLocations))
+                racers.append(racer)
+
+            def stepRacers():
+                for racer in racers:
+                    racer.update(dt, keys)
+            racerTime = timeSteps(stepRacers, max(1, args.steps // 10))
+        print("%-8d %16.3f %16.3f %10.1f" % (count, 1000.0 * racerTime, 1000.0 * fleetTime, racerTime / fleetTime))
+
+
+if __name__ == "__main__":
+    main()
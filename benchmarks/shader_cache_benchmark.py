@@ -0,0 +1,56 @@
+"""Times building the default ObjModel shader for a number of models, compiling it for each (as ObjModel used to)
+against getting it from the shader cache (utils/shader_cache.py), both with no saved binary (the first run) and
+with the binary saved by the previous pass (later runs).
+
+Run from the project root (needs a display, or e.g. xvfb-run):
+
+    python -m benchmarks.shader_cache_benchmark [--models 50] [--cache-dir cache/shaders_benchmark]
+"""
+
+import argparse
+import shutil
+import time
+
+from OpenGL import GL
+
+from benchmarks.terrain_lod_benchmark import createHiddenWindow
+from utils import lab_utils as lu
+from utils.ObjModel import ObjModel
+from utils.shader_cache import ShaderCache
+
+
+# Builds the default shader once per model, with buildShader (a function with the lab_utils.buildShader arguments)
+def buildShaders(buildShader, numModels):
+    vertexShader, fragmentShader = ObjModel.getDefaultShaderSources()
+    start = time.perf_counter()
+    for _ in range(numModels):
+        buildShader(vertexShader, fragmentShader, ObjModel.getDefaultAttributeBindings())
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", type=int, default=50)
+    parser.add_argument("--cache-dir", default="cache/shaders_benchmark")
+    args = parser.parse_args()
+
+    createHiddenWindow()
+    print("Renderer: %s" % GL.glGetString(GL.GL_RENDERER).decode())
+    shutil.rmtree(args.cache_dir, ignore_errors=True)
+
+    # Times are for building the shader for all the models, and per model
+    print("%-16s %10s %10s %10s %10s" % ("build", "total ms", "ms/model", "compiled", "binaries"))
+    elapsed = buildShaders(lu.buildShader, args.models)
+    print("%-16s %10.1f %10.3f %10d %10d" % ("each model", 1000.0 * elapsed, 1000.0 * elapsed / args.models,
+                                             args.models, 0))
+    for name in ["cache, cold", "cache, binary"]:
+        cache = ShaderCache()
+        cache.cacheDir = args.cache_dir
+        elapsed = buildShaders(cache.buildShader, args.models)
+        print("%-16s %10.1f %10.3f %10d %10d" % (name, 1000.0 * elapsed, 1000.0 * elapsed / args.models,
+                                                 cache.numCompiled, cache.numBinariesLoaded))
+    shutil.rmtree(args.cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Triangles per frame and frame time of the tiled terrain against heightmap size, with and without level of detail.
+
+A camera is moved around a circle over random (smooth) terrain, looking towards the middle of the map, much like
+the follow camera. For each size, the table shows the triangles submitted per frame when drawing everything,
+with frustum culling and with culling plus level of detail, and the CPU time spent choosing the tiles and levels.
+
+Run from the project root:
+
+    python -m benchmarks.terrain_lod_benchmark [--sizes 256 512 1024 2048] [--gl]
+
+With --gl a hidden GLFW window is created and the time to draw (and glFinish) a frame is included.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from models.terrain import Terrain, buildTerrainMesh, TERRAIN_VERTEX_FORMAT
+from models.terrain_tiles import TerrainTiles
+from utils import lab_utils as lu
+
+
+BENCHMARK_VERTEX_SHADER = """
+#version 330
+in vec3 positionIn;
+uniform mat4 worldToClipTransform;
+void main()
+{
+    gl_Position = worldToClipTransform * vec4(positionIn, 1.0);
+}
+"""
+BENCHMARK_FRAGMENT_SHADER = """
+#version 330
+out vec4 fragmentColor;
+void main()
+{
+    fragmentColor = vec4(1.0);
+}
+"""
+
+
+# Smooth random heights, made by upsampling a coarse grid of random values
+def makeImageData(size, seed=0):
+    rng = np.random.default_rng(seed)
+    coarse = rng.random((size // 32 + 2, size // 32 + 2))
+    t = np.arange(size) / 32.0
+    i = t.astype(int)
+    f = t - i
+    rows = coarse[i] * (1.0 - f)[:, None] + coarse[i + 1] * f[:, None]
+    heights = rows[:, i] * (1.0 - f) + rows[:, i + 1] * f
+    pixels = np.zeros((size, size, 4), dtype=np.uint8)
+    pixels[:, :, 0] = heights * 255.0
+    return pixels.tobytes()
+
+
+# Returns (viewPosition, worldToClipTransform) for each frame of a camera circling the map
+def makeCameras(size, numFrames):
+    halfSize = size * Terrain.xyScale / 2.0
+    projection = lu.make_perspective(60.0, 16.0 / 9.0, 0.2, 2000.0)
+    cameras = []
+    for angle in np.linspace(0.0, 2.0 * np.pi, numFrames, endpoint=False):
+        eye = np.array([np.cos(angle), np.sin(angle), 0.0]) * halfSize * 0.5
+        eye[2] = Terrain.heightScale + 25.0
+        target = np.array([0.0, 0.0, Terrain.heightScale * 0.5])
+        cameras.append((eye, projection * lu.make_lookAt(eye, target, [0.0, 0.0, 1.0])))
+    return cameras
+
+
+# Runs the culling and level selection for each camera, returns (triangles, seconds) per frame
+def selectTiles(tiles, cameras, cull, lod):
+    tiles.lodEnabled = lod
+    triangles = 0
+    start = time.perf_counter()
+    for viewPosition, worldToClip in cameras:
+        if cull:
+            visible = np.flatnonzero(tiles.findVisibleTiles(worldToClip))
+        else:
+            visible = np.arange(tiles.numTiles)
+        if lod:
+            levels, masks = tiles.selectLevels(viewPosition)
+            levels, masks = levels[visible], masks[visible]
+        else:
+            levels = masks = np.zeros(len(visible), dtype=np.int32)
+        triangles += int(tiles.patternCounts[tiles.tileSizeIndices[visible], levels, masks].sum()) // 3
+    return triangles / len(cameras), (time.perf_counter() - start) / len(cameras)
+
+
+def createHiddenWindow():
+    import glfw
+
+    if not glfw.init():
+        raise RuntimeError("failed to initialise GLFW")
+    glfw.window_hint(glfw.VISIBLE, False)
+    glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
+    glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
+    glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+    glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, True)
+    window = glfw.create_window(1280, 720, "terrain lod benchmark", None, None)
+    glfw.make_context_current(window)
+    return window
+
+
+# Uploads the terrain and binds a minimal shader for timeFrames. Needs a current GL context.
+def setupDrawing(mesh, tiles):
+    from OpenGL import GL
+
+    shader = lu.buildShader([BENCHMARK_VERTEX_SHADER], [BENCHMARK_FRAGMENT_SHADER], {"positionIn": 0})
+    vertexArrayObject = GL.glGenVertexArrays(1)
+    TERRAIN_VERTEX_FORMAT.createVertexBuffer(vertexArrayObject, {"position": mesh.positions, "normal": mesh.normals})
+    tiles.createIndexBuffer(vertexArrayObject)
+    GL.glEnable(GL.GL_DEPTH_TEST)
+    GL.glEnable(GL.GL_CULL_FACE)
+    GL.glViewport(0, 0, 1280, 720)
+    GL.glUseProgram(shader)
+    GL.glBindVertexArray(vertexArrayObject)
+    return shader
+
+
+# Draws the terrain for each camera, returns the average seconds per frame.
+def timeFrames(shader, tiles, cameras, cull, lod):
+    from OpenGL import GL
+
+    tiles.lodEnabled = lod
+    GL.glFinish()
+    start = time.perf_counter()
+    for viewPosition, worldToClip in cameras:
+        GL.glClear(GL.GL_COLOR_BUFFER_BIT | GL.GL_DEPTH_BUFFER_BIT)
+        lu.setUniform(shader, "worldToClipTransform", worldToClip)
+        tiles.render(worldToClip if cull else None, viewPosition)
+        GL.glFinish()
+    return (time.perf_counter() - start) / len(cameras)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 512, 1024, 2048])
+    parser.add_argument("--frames", type=int, default=32)
+    parser.add_argument("--gl", action="store_true", help="also time drawing the frames (needs a display)")
+    args = parser.parse_args()
+
+    if args.gl:
+        createHiddenWindow()
+
+    modes = [("all", False, False), ("culled", True, False), ("culled+lod", True, True)]
+    print("%-6s %-12s %12s %12s %12s" % ("size", "mode", "tris/frame", "cpu ms", "frame ms" if args.gl else ""))
+    for size in args.sizes:
+        mesh = buildTerrainMesh(makeImageData(size), size, size, Terrain.xyScale, Terrain.heightScale)
+        tiles = TerrainTiles(mesh.positions, size, size)
+        cameras = makeCameras(size, args.frames)
+        shader = setupDrawing(mesh, tiles) if args.gl else None
+        for name, cull, lod in modes:
+            triangles, cpuTime = selectTiles(tiles, cameras, cull, lod)
+            frameTime = "%12.2f" % (1000.0 * timeFrames(shader, tiles, cameras, cull, lod)) if args.gl else ""
+            print("%-6d %-12s %12d %12.3f %s" % (size, name, triangles, 1000.0 * cpuTime, frameTime))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compare the load time of the vectorized terrain mesh builder against the original per-pixel loops.
+
+Run from the project root:
+
+    python -m benchmarks.terrain_mesh_benchmark [--sizes 128 512 2048] [--reference-max 512]
+
+The per-pixel reference is very slow for large maps, so by default it is only timed (and checked
+against the vectorized output) up to --reference-max pixels.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from models.terrain import Terrain, buildTerrainMesh, buildTerrainMeshLoops
+
+
+def makeImageData(size, seed=0):
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (size, size, 4), dtype=np.uint8)
+    # sprinkle some start/tree/rock markers in the green channel
+    pixels[:, :, 1] = rng.choice(np.array([0, 64, 128, 255], dtype=np.uint8), (size, size), p=[0.97, 0.01, 0.015, 0.005])
+    return pixels.tobytes()
+
+
+def timeIt(fn, repeats):
+    best = float('inf')
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def checkSame(mesh, reference):
+    assert np.allclose(mesh.positions, np.array(reference.positions), atol=1e-4)
+    assert np.allclose(mesh.normals, np.array(reference.normals), atol=1e-5)
+    assert np.array_equal(mesh.indices, np.array(reference.indices, dtype=np.uint32))
+    for name in ["startLocations", "treeLocations", "rockLocations"]:
+        assert np.allclose(np.array(getattr(mesh, name)).reshape(-1, 3),
+                           np.array(getattr(reference, name)).reshape(-1, 3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[128, 512, 2048])
+    parser.add_argument("--reference-max", type=int, default=512,
+                        help="largest size to run the per-pixel reference for")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print("%8s %14s %14s %10s" % ("size", "vectorized(s)", "loops(s)", "speedup"))
+    for size in args.sizes:
+        imageData = makeImageData(size)
+        build = lambda: buildTerrainMesh(imageData, size, size, Terrain.xyScale, Terrain.heightScale)
+        vecTime, mesh = timeIt(build, args.repeats)
+
+        if size <= args.reference_max:
+            buildRef = lambda: buildTerrainMeshLoops(imageData, size, size, Terrain.xyScale, Terrain.heightScale)
+            refTime, reference = timeIt(buildRef, 1)
+            checkSame(mesh, reference)
+            print("%8d %14.4f %14.4f %9.1fx" % (size, vecTime, refTime, refTime / vecTime))
+        else:
+            print("%8d %14.4f %14s %10s" % (size, vecTime, "-", "-"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Compares decoding the texture images one after the other with decoding them on the pool of worker threads used by
+the texture manager (utils/texture_manager.py).
+
+Only the decoding is timed, the GL upload always happens on the main thread. Each image is decoded --repeat times
+so that the run is long enough to measure.
+
+Run from the project root:
+
+    python -m benchmarks.texture_decode_benchmark [--workers 1 2 4 8] [--repeat 4] [files ...]
+"""
+
+import argparse
+import glob
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.texture_cache import decodeImage
+
+
+def decodeSequential(fileNames):
+    for fileName in fileNames:
+        decodeImage(fileName)
+
+
+def decodeParallel(fileNames, numWorkers):
+    with ThreadPoolExecutor(numWorkers) as executor:
+        list(executor.map(decodeImage, fileNames))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--repeat", type=int, default=4)
+    args = parser.parse_args()
+
+    fileNames = (args.files or sorted(glob.glob("data/*.png"))) * args.repeat
+    if not fileNames:
+        parser.error("no image files given, and none found in data/")
+
+    # Warm up, so that the first run does not pay for opening the files and loading the decoders
+    decodeSequential(fileNames[:len(fileNames) // args.repeat])
+
+    start = time.perf_counter()
+    decodeSequential(fileNames)
+    sequentialTime = time.perf_counter() - start
+
+    print("%-12s %10s %8s" % ("decode", "ms", "speedup"))
+    print("%-12s %10.1f %8.2f" % ("sequential", 1000.0 * sequentialTime, 1.0))
+    for numWorkers in args.workers:
+        start = time.perf_counter()
+        decodeParallel(fileNames, numWorkers)
+        parallelTime = time.perf_counter() - start
+        print("%-12s %10.1f %8.2f" % ("%d threads" % numWorkers, 1000.0 * parallelTime, sequentialTime / parallelTime))
+
+
+if __name__ == "__main__":
+    main()
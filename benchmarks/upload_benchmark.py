@@ -0,0 +1,88 @@
+"""Micro-benchmark of the cost of preparing (and optionally uploading) vertex data per million floats.
+
+Compares the old upload path (flatten() into a python list, then a (c_float * n) ctypes array) with
+lab_utils.uploadBufferData, which hands contiguous numpy arrays straight to glBufferData.
+
+Run from the project root:
+
+    python -m benchmarks.upload_benchmark [--floats 3000000] [--gl]
+
+With --gl a hidden GLFW window is created and the glBufferData call is included in the timings.
+"""
+
+import argparse
+import time
+from ctypes import c_float
+
+import numpy as np
+
+from utils import lab_utils as lu
+
+
+def oldUpload(data, upload):
+    flatData = lu.flatten(data)
+    dataBuffer = (c_float * len(flatData))(*flatData)
+    if upload:
+        upload(dataBuffer, len(flatData) * 4)
+
+
+def newUpload(data, upload):
+    array = lu.asContiguousArray(data, np.float32)
+    if upload:
+        upload(array, array.nbytes)
+
+
+def createHiddenContext():
+    import glfw
+    from OpenGL import GL
+
+    if not glfw.init():
+        raise RuntimeError("failed to initialise GLFW")
+    glfw.window_hint(glfw.VISIBLE, False)
+    glfw.window_hint(glfw.CONTEXT_VERSION_MAJOR, 3)
+    glfw.window_hint(glfw.CONTEXT_VERSION_MINOR, 3)
+    glfw.window_hint(glfw.OPENGL_PROFILE, glfw.OPENGL_CORE_PROFILE)
+    glfw.window_hint(glfw.OPENGL_FORWARD_COMPAT, True)
+    window = glfw.create_window(64, 64, "upload benchmark", None, None)
+    glfw.make_context_current(window)
+
+    buffer = GL.glGenBuffers(1)
+    GL.glBindBuffer(GL.GL_ARRAY_BUFFER, buffer)
+
+    def upload(data, nbytes):
+        GL.glBufferData(GL.GL_ARRAY_BUFFER, nbytes, data, GL.GL_STATIC_DRAW)
+        GL.glFinish()
+    return upload
+
+
+def timePerMillion(fn, data, upload, numFloats, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn(data, upload)
+        best = min(best, time.perf_counter() - start)
+    return best * 1.0e6 / numFloats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--floats", type=int, default=3000000)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--gl", action="store_true", help="include glBufferData (needs a display)")
+    args = parser.parse_args()
+
+    upload = createHiddenContext() if args.gl else None
+
+    array = np.random.default_rng(0).random((args.floats // 3, 3), dtype=np.float32)
+    vectorList = list(array)
+    numFloats = array.size
+
+    print("%-26s %16s" % ("input / path", "ms per M floats"))
+    for name, data in [("list of vec3", vectorList), ("numpy (N, 3)", array), ("memoryview", memoryview(array))]:
+        if name != "memoryview":
+            print("%-26s %16.3f" % (name + " / old", 1000.0 * timePerMillion(oldUpload, data, upload, numFloats, 1)))
+        print("%-26s %16.3f" % (name + " / new", 1000.0 * timePerMillion(newUpload, data, upload, numFloats, args.repeats)))
+
+
+if __name__ == "__main__":
+    main()
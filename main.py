@@ -1,16 +1,41 @@
 """The entry point of the whole project"""
 
+import argparse
 import warnings  # we use 'warnings' to remove this warning that ImGui[glfw] gives
 
-from models.world import World
-from models.game import MegaRacer
+from utils.profiler import g_startupProfiler
 
 warnings.simplefilter(action='ignore', category=FutureWarning)
 
+parser = argparse.ArgumentParser(description="The Mega-racer world")
+parser.add_argument("--record", metavar="FILE",
+                    help="save the input to FILE, to play back with 'python -m models.simulation --input FILE'")
+parser.add_argument("--ai-racers", type=int, default=0, metavar="N", help="number of AI racers to add")
+parser.add_argument("--profile", metavar="FILE",
+                    help="enable the profiler and save the frame times to FILE (.csv or .json) at exit")
+parser.add_argument("--profile-startup", action="store_true",
+                    help="print the time taken by the imports and each phase of the setup before the first frame")
+args = parser.parse_args()
+
+# The whole startup is timed as one frame of the startup profiler, which ends when the game is about to draw the first
+# frame (see MegaRacer.run)
+g_startupProfiler.setEnabled(args.profile_startup)
+g_startupProfiler.beginFrame()
+
+# The heavy modules (OpenGL, ImGui, GLFW, PIL) are only imported once the arguments are known to be good
+with g_startupProfiler.scope("import"):
+    with g_startupProfiler.scope("models.world"):
+        from models.world import World
+    with g_startupProfiler.scope("models.game"):
+        from models.game import MegaRacer
+
 # Setup the world model used for rendering
-world = World()
+with g_startupProfiler.scope("World"):
+    world = World()
 
 # Setup and run the game
-game = MegaRacer(world)
-game.setup()
+game = MegaRacer(world, record_file=args.record, num_ai_racers=args.ai_racers, profile_file=args.profile,
+                 profile_startup=args.profile_startup)
+with g_startupProfiler.scope("setup"):
+    game.setup()
 game.run()
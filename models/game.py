@@ -1,5 +1,7 @@
 """Initialise the GLFW windows and world UI"""
 
+import os
+
 import glfw
 
 import imgui
@@ -9,31 +11,94 @@ from imgui.integrations.glfw import GlfwRenderer as ImGuiGlfwRenderer
 
 from models.terrain import Terrain
 from models.racer import Racer
+from models.racer_fleet import RacerFleet
+from models.props import InstancedProps, makeRandomInstanceTransforms
 from models.world import World
-from utils.helper import renderFrame, update, RenderingSystem
+from models.simulation import Simulation, InputRecorder, update_world
+from utils.helper import renderFrame, draw_ui, RenderingSystem
 from glfw_helper.mappings import GLFW_KEYMAP, GLFW_MOUSE_MAP
 from glfw_helper.initialiser import initialise_glfw
+from utils.ObjModel import ObjModel
+from utils.lazy_import import LazyModule
+from utils.profiler import g_profiler, g_startupProfiler
+from utils.gpu_timer import g_gpuTimer
+from utils.texture_manager import g_textureManager
+from utils.shader_cache import g_shaderCache
 
 
 START_WIDTH = 1280
 START_HEIGHT = 720
 
+# Props placed at the terrain tree and rock locations, skipped if the model is not there.
+# (model file, min scale, max scale, random seed)
+TREE_PROPS = ('data/trees/birch_01_d.obj', 0.8, 1.3, 1)
+ROCK_PROPS = ('data/rocks/rock_01.obj', 0.5, 1.5, 2)
+
 
 class MegaRacer:
-    def __init__(self, world: World):
+    def __init__(self, world: World, record_file=None, num_ai_racers=0, profile_file=None, profile_startup=False):
         self.world = world
         self.rendering_system = None  # Can't set it up first until setup() is called
         self.window = None
+        # If set, the input of each simulation step is saved to this file when the game ends (see models/simulation.py)
+        self.record_file = record_file
+        self.num_ai_racers = num_ai_racers
+        # If set, the profiler is enabled from the start and its history is exported to this file (.csv or .json) at
+        # the end
+        self.profile_file = profile_file
+        # If set, the startup profile (see utils/profiler.py g_startupProfiler) is printed before the first frame, and
+        # the vertex counts of the models as they are loaded
+        self.profile_startup = profile_startup
+        ObjModel.verbose = profile_startup
 
     def setup(self):
         """Setup the GLFW library, OpenGL library and the rendering system"""
-        self.window = initialise_glfw()
-        self.__setup_rendering_system()
+        with g_startupProfiler.scope("window"):
+            self.window = initialise_glfw()
+        with g_startupProfiler.scope("renderingSystem"):
+            self.__setup_rendering_system()
 
     def __setup_rendering_system(self):
         self.rendering_system = RenderingSystem(self.world)
         self.rendering_system.setupObjModelShader()
 
+    def __load_world(self):
+        """Load the terrain, racers and props into the world object"""
+        world = self.world
+        with g_startupProfiler.scope("terrain"):
+            world.terrain = Terrain()
+            world.terrain.load("data/track_01_128.png", self.rendering_system)
+
+        with g_startupProfiler.scope("racer"):
+            world.racer = Racer()
+            world.racer.load("data/racer_02.obj", world.terrain)
+
+        if self.num_ai_racers:
+            with g_startupProfiler.scope("fleet"):
+                world.fleet = RacerFleet(world.terrain, self.num_ai_racers)
+                world.fleet.load(world.racer.model)
+
+        with g_startupProfiler.scope("props"):
+            world.props = []
+            self.__load_props(TREE_PROPS, world.terrain.treeLocations)
+            self.__load_props(ROCK_PROPS, world.terrain.rockLocations)
+
+    def __print_startup_profile(self):
+        g_startupProfiler.endFrame()
+        g_startupProfiler.printLastFrame("startup")
+        # These are included in the times of the phases that first used them
+        print("%-40s %9s" % ("imported on first use", "ms"))
+        for name, seconds in LazyModule.loadTimes.items():
+            print("%-40s %9.1f" % ("  " + name, 1000.0 * seconds))
+
+    def __load_props(self, props_info, locations):
+        model_file, min_scale, max_scale, seed = props_info
+        if not len(locations) or not os.path.exists(model_file):
+            return
+        props = InstancedProps(ObjModel(model_file))
+        props.setInstances(makeRandomInstanceTransforms(locations, min_scale, max_scale, seed))
+        self.world.props.append(props)
+
     def run(self):
         """Run the main game loop logic"""
         # Shorten the variables
@@ -41,29 +106,42 @@ class MegaRacer:
         rendering_system = self.rendering_system
         window = self.window
 
-        impl = ImGuiGlfwRenderer(window)
+        with g_startupProfiler.scope("load"):
+            with g_startupProfiler.scope("imgui"):
+                impl = ImGuiGlfwRenderer(window)
+            self.__load_world()
 
-        # set the variables from the world object
-        world.terrain = Terrain()
-        world.terrain.load("data/track_01_128.png", rendering_system)
+        # The world is updated with a fixed timestep, independent of the frame rate
+        simulation = Simulation(world)
+        recorder = InputRecorder() if self.record_file else None
+        if recorder:
+            simulation.step_listeners.append(recorder.record)
+        # Place the camera and set up the lighting for the first frame, before any steps are taken
+        update_world(world, 0.0, {})
 
-        world.racer = Racer()
-        world.racer.load("data/racer_02.obj", world.terrain)
+        if self.profile_file:
+            g_profiler.setEnabled(True)
+        if self.profile_startup:
+            self.__print_startup_profile()
 
         current_time = glfw.get_time()
         prev_mouse_x, prev_mouse_y = glfw.get_cursor_pos(window)
 
         while not glfw.window_should_close(window):
+            g_profiler.beginFrame()
+            g_gpuTimer.setEnabled(g_profiler.enabled)
+            g_gpuTimer.beginFrame()
             prev_time = current_time
             current_time = glfw.get_time()
             dt = current_time - prev_time
 
-            key_state_map = {}
-            for item_name, item_id in GLFW_KEYMAP.items():
-                key_state_map[item_name] = glfw.get_key(window, item_id) == glfw.PRESS
+            with g_profiler.scope("input"):
+                key_state_map = {}
+                for item_name, item_id in GLFW_KEYMAP.items():
+                    key_state_map[item_name] = glfw.get_key(window, item_id) == glfw.PRESS
 
-            for item_name, item_id in GLFW_MOUSE_MAP.items():
-                key_state_map[item_name] = glfw.get_mouse_button(window, item_id) == glfw.PRESS
+                for item_name, item_id in GLFW_MOUSE_MAP.items():
+                    key_state_map[item_name] = glfw.get_mouse_button(window, item_id) == glfw.PRESS
 
             imgui.new_frame()
             imgui.set_next_window_size(430.0, 450.0, imgui.FIRST_USE_EVER)
@@ -77,22 +155,50 @@ class MegaRacer:
             im_io = imgui.get_io()
             if im_io.want_capture_mouse:
                 mouse_delta = [0, 0]
-            update(world, rendering_system, dt, key_state_map, mouse_delta)
+            with g_profiler.scope("update"):
+                g_profiler.count("simulationSteps", simulation.advance(dt, key_state_map))
+            with g_profiler.scope("ui"):
+                draw_ui(world, rendering_system)
+                if imgui.tree_node("Profiler"):
+                    g_profiler.drawUi()
+                    imgui.tree_pop()
+                if imgui.tree_node("Textures"):
+                    g_textureManager.drawUi()
+                    imgui.tree_pop()
+                if imgui.tree_node("Shaders"):
+                    g_shaderCache.drawUi()
+                    imgui.tree_pop()
 
             width, height = glfw.get_framebuffer_size(window)
 
-            renderFrame(world, rendering_system, width, height)
+            with g_profiler.scope("renderFrame"):
+                renderFrame(world, rendering_system, width, height)
 
             # mgui.show_test_window()
 
             imgui.end()
-            imgui.render()
+            with g_profiler.scope("imgui.render"), g_gpuTimer.scope("imgui"):
+                imgui.render()
+                impl.render(imgui.get_draw_data())
             # Swap front and back buffers
-            glfw.swap_buffers(window)
+            with g_profiler.scope("swap_buffers"):
+                glfw.swap_buffers(window)
 
             # Poll for and process events
-            glfw.poll_events()
-            impl.process_inputs()
+            with g_profiler.scope("poll_events"):
+                glfw.poll_events()
+                impl.process_inputs()
+            g_profiler.endFrame()
+
+        if recorder:
+            recorder.save(self.record_file)
+            print("Saved %d steps of input to '%s'" % (simulation.num_steps, self.record_file))
+        if self.profile_file:
+            if self.profile_file.endswith(".csv"):
+                g_profiler.exportCsv(self.profile_file)
+            else:
+                g_profiler.exportJson(self.profile_file)
+            print("Saved the profile of the last %d frames to '%s'" % (len(g_profiler.frameNumbers), self.profile_file))
 
         # This is the end of the game. Do some cleanup
         glfw.destroy_window(window)
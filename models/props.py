@@ -0,0 +1,99 @@
+"""Instanced rendering of props (trees, rocks, ...) placed on the terrain.
+
+All the instances of a prop share one ObjModel and are drawn with a single instanced draw call per material
+batch. The model to world transform of each instance is stored in an instance buffer, which is read as a
+mat4 vertex attribute that advances once per instance.
+"""
+
+import ctypes
+
+import numpy as np
+from OpenGL.GL import *
+
+from utils import lab_utils as lu
+from utils.ObjModel import ObjModel
+
+
+# The instance transform is a mat4 attribute, which takes up four consecutive attribute locations (one per column),
+# placed after the attributes used by ObjModel.
+AA_InstanceTransform = ObjModel.AA_Bitangent + 1
+
+
+# Builds an (N, 4, 4) array of model to world transforms (row major, like lu.Mat4) for N locations. The models are
+# assumed to be y-up, like the racer (see Racer.render), and are stood up along the world z axis, rotated by the
+# yaw angles (in radians) about the z axis and uniformly scaled.
+def makeInstanceTransforms(locations, yawAngles, scales):
+    locations = np.asarray(locations, dtype=np.float32).reshape(-1, 3)
+    c = np.cos(yawAngles) * scales
+    s = np.sin(yawAngles) * scales
+
+    transforms = np.zeros((len(locations), 4, 4), dtype=np.float32)
+    # the columns are the model x, y and z axes in world space, same as lu.make_mat4_from_zAxis with the heading
+    # (cos, sin, 0) and up (0, 0, 1).
+    transforms[:, 0, 0] = -s
+    transforms[:, 1, 0] = c
+    transforms[:, 2, 1] = scales
+    transforms[:, 0, 2] = c
+    transforms[:, 1, 2] = s
+    transforms[:, :3, 3] = locations
+    transforms[:, 3, 3] = 1.0
+    return transforms
+
+
+# Makes transforms with a random yaw and a random scale in [minScale, maxScale] for each location. The seed makes sure
+# the props end up the same each time the map is loaded.
+def makeRandomInstanceTransforms(locations, minScale=1.0, maxScale=1.0, seed=0):
+    rng = np.random.default_rng(seed)
+    n = len(locations)
+    return makeInstanceTransforms(locations, rng.uniform(0.0, 2.0 * np.pi, n), rng.uniform(minScale, maxScale, n))
+
+
+class InstancedProps:
+    model = None
+    numInstances = 0
+
+    def __init__(self, model):
+        self.model = model
+
+        # The instances need a VAO of their own, sharing the vertex and index buffers of the model and adding the
+        # instance buffer.
+        self.vertexArrayObject = glGenVertexArrays(1)
+        glBindVertexArray(self.vertexArrayObject)
+        glBindBuffer(GL_ARRAY_BUFFER, model.vertexBuffer)
+        model.vertexFormat.setAttribPointers()
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, model.indexBuffer)
+
+        self.instanceBuffer = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.instanceBuffer)
+        for column in range(4):
+            location = AA_InstanceTransform + column
+            glVertexAttribPointer(location, 4, GL_FLOAT, GL_FALSE, 64, ctypes.c_void_p(16 * column))
+            glVertexAttribDivisor(location, 1)
+            glEnableVertexAttribArray(location)
+
+        glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+
+    # Uploads the (N, 4, 4) model to world transforms, replacing any previous instances. Use GL_STREAM_DRAW for
+    # instances that are updated every frame.
+    def setInstances(self, transforms, usage=GL_STATIC_DRAW):
+        # GLSL expects the matrix columns one after the other
+        columnMajor = np.ascontiguousarray(np.transpose(transforms, (0, 2, 1)), dtype=np.float32)
+        lu.uploadBufferData(GL_ARRAY_BUFFER, self.instanceBuffer, columnMajor, usage=usage)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.numInstances = len(columnMajor)
+
+    def render(self, view, renderingSystem, renderFlags=ObjModel.RF_All):
+        if not self.numInstances:
+            return
+        glUseProgram(renderingSystem.instancedObjModelShader)
+        glBindVertexArray(self.vertexArrayObject)
+        self.model.renderChunks(self.model.getChunks(renderFlags), self.numInstances)
+        glBindVertexArray(0)
+        glUseProgram(0)
+
+    def getAttributeBindings():
+        bindings = ObjModel.getDefaultAttributeBindings()
+        bindings["instanceTransformAttribute"] = AA_InstanceTransform
+        return bindings
@@ -1,9 +1,21 @@
-import imgui
-
 from utils import lab_utils as lu
+from utils import math3d
 from utils.lab_utils import vec3, make_mat4_from_zAxis
+from utils.lazy_import import lazyModule
 from models.terrain import TerrainInfo
-from utils.ObjModel import ObjModel
+
+# Only needed to draw the racer, the simulation does without (see models/simulation.py)
+imgui = lazyModule("imgui")
+obj_model = lazyModule("utils.ObjModel")
+
+
+# The racer blends towards its targets by a fixed fraction per frame at BLEND_REFERENCE_FPS, this returns the fraction
+# to use for a time step of dt seconds so that the motion is the same whatever the frame rate (or simulation timestep).
+BLEND_REFERENCE_FPS = 60.0
+
+
+def blend_factor(fraction_per_frame, dt):
+    return 1.0 - (1.0 - fraction_per_frame) ** (dt * BLEND_REFERENCE_FPS)
 
 
 class ViewParams:
@@ -31,21 +43,38 @@ class Racer:
     max_speed_rough = 15.0
     z_offset = 3.0
     angular_velocity = 2.0
+    # How far to move towards the target velocity and height each (1/60th of a second) frame
+    velocity_response = 0.01
+    height_response = 0.1
 
     terrain = None
     model = None
+    # The model to world transform and the (position, heading) it was made for, see get_model_to_world_transform
+    model_to_world_transform = None
+    model_to_world_key = None
+
+    # Returns the same Mat4 until the racer moves, so the view can look up the transforms it prepared for it
+    def get_model_to_world_transform(self):
+        key = (self.position.tobytes(), self.heading.tobytes())
+        if key != self.model_to_world_key:
+            self.model_to_world_transform = make_mat4_from_zAxis(self.position, self.heading, [0.0, 0.0, 1.0])
+            self.model_to_world_key = key
+        return self.model_to_world_transform
 
     def render(self, view, rendering_system):
-        rendering_system.drawObjModel(self.model,
-                                      make_mat4_from_zAxis(self.position,
-                                                           self.heading,
-                                                           [0.0, 0.0, 1.0]),
-                                      view)
+        rendering_system.drawObjModel(self.model, self.get_model_to_world_transform(), view)
 
     def load(self, model_name, terrain):
+        self.setup(terrain)
+        self.model = obj_model.ObjModel(model_name)
+
+    # Places the racer at the start of the terrain, without loading the model (e.g., for headless simulation).
+    def setup(self, terrain, start_index=0):
         self.terrain = terrain
-        self.position = terrain.startLocations[0]
-        self.model = ObjModel(model_name)
+        self.position = terrain.startLocations[start_index].copy()
+        self.velocity = vec3(0, 0, 0)
+        self.heading = vec3(1, 0, 0)
+        self.speed = 0.0
 
     def update(self, dt, key_state_map):
         info = self.terrain.getInfoAt(self.position)
@@ -53,30 +82,30 @@ class Racer:
         max_speed = self.max_speed_road if info.material == TerrainInfo.M_Road else self.max_speed_rough
 
         target_velocity = vec3(0.0)
-        if key_state_map["UP"]:
+        if key_state_map.get("UP"):
             target_velocity = self.heading * max_speed
-        if key_state_map["DOWN"]:
+        if key_state_map.get("DOWN"):
             target_velocity = self.heading * -max_speed
 
-        # Linearly interpolate towards the target velocity.
-        # This means it is tied to the frame rate, which is kind of bad.
-        self.velocity = lu.mix(self.velocity, target_velocity, 0.01)
+        # Interpolate towards the target velocity, scaled by the time step so it does not depend on the frame rate.
+        self.velocity = lu.mix(self.velocity, target_velocity, blend_factor(self.velocity_response, dt))
 
         self.speed = lu.length(self.velocity)
 
-        rotation_matrix = lu.Mat4()
-        if key_state_map["LEFT"]:
-            rotation_matrix = lu.make_rotation_z(dt * self.angular_velocity)
-        if key_state_map["RIGHT"]:
-            rotation_matrix = lu.make_rotation_z(dt * -self.angular_velocity)
+        steering = 0.0
+        if key_state_map.get("LEFT"):
+            steering = 1.0
+        if key_state_map.get("RIGHT"):
+            steering = -1.0
 
-        self.heading = lu.Mat3(rotation_matrix) * self.heading
+        if steering:
+            self.heading = math3d.rotateZ(self.heading, dt * steering * self.angular_velocity)
 
         # get height of ground at this point.
 
         self.position += self.velocity * dt
 
-        self.position[2] = lu.mix(self.position[2], info.height + self.z_offset, 0.1)
+        self.position[2] = lu.mix(self.position[2], info.height + self.z_offset, blend_factor(self.height_response, dt))
 
     def draw_ui(self):
         imgui.label_text("Speed", "%0.1fm/s" % self.speed)
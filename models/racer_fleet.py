@@ -0,0 +1,128 @@
+"""Many racers (e.g., AI or replays) simulated together, stored as a structure of arrays.
+
+The state of all the racers is kept in contiguous (N, 3) arrays, and one call to update advances them all with
+whole-array operations: one batched terrain lookup for the heights and materials (see TerrainQuery.sample),
+then the same velocity blending, steering and height following as Racer.update. They are drawn with a single
+instanced draw call per material of the racer model (see models/props.py).
+
+Both keep their state in float32, but the intermediate results are rounded differently: the batched
+TerrainQuery.sample against the scalar getInfoAt, the whole-array rotation of the headings against math3d.rotateZ,
+and the in-place blending against lu.mix. So a fleet of one given the same input as a Racer drifts away from it, by
+up to about 1e-4 (metres) over 500 steps at 60Hz, and about 2e-3 over 2000 steps.
+"""
+
+import numpy as np
+
+from models.racer import Racer, blend_factor
+from models.terrain import TerrainInfo
+from utils import math3d
+from utils.lazy_import import lazyModule
+
+# Only needed to draw the fleet, the simulation does without (see models/simulation.py)
+GL = lazyModule("OpenGL.GL")
+imgui = lazyModule("imgui")
+props = lazyModule("models.props")
+
+
+# Converts a key state map per racer (e.g., from RecordedInput) to (throttle, steering) arrays for RacerFleet.update,
+# pressing both directions does the same as in Racer.update.
+def key_inputs(key_state_maps):
+    throttle = np.array([-1.0 if k.get("DOWN") else 1.0 if k.get("UP") else 0.0 for k in key_state_maps], dtype=np.float32)
+    steering = np.array([-1.0 if k.get("RIGHT") else 1.0 if k.get("LEFT") else 0.0 for k in key_state_maps], dtype=np.float32)
+    return throttle, steering
+
+
+class RacerFleet:
+    # Same handling as the player racer
+    max_speed_road = Racer.max_speed_road
+    max_speed_rough = Racer.max_speed_rough
+    z_offset = Racer.z_offset
+    angular_velocity = Racer.angular_velocity
+    velocity_response = Racer.velocity_response
+    height_response = Racer.height_response
+
+    # Racers that do not fit on the start locations are lined up behind them, this far apart
+    start_spacing = 10.0
+    # The AI looks for the road at two points this far ahead, to either side of the heading
+    ai_look_ahead = 20.0
+    ai_look_angle = 0.5
+
+    terrain = None
+    props = None
+
+    def __init__(self, terrain, count):
+        self.terrain = terrain
+        self.count = count
+        self.positions = np.zeros((count, 3), dtype=np.float32)
+        self.velocities = np.zeros((count, 3), dtype=np.float32)
+        self.headings = np.zeros((count, 3), dtype=np.float32)
+        self.speeds = np.zeros(count, dtype=np.float32)
+        self.reset()
+
+    # Puts all the racers on the start locations, heading along x (like Racer.setup)
+    def reset(self):
+        start_locations = np.asarray(self.terrain.startLocations, dtype=np.float32).reshape(-1, 3)
+        if self.count and not len(start_locations):
+            raise ValueError("the terrain has no start locations to place the %d racers on" % self.count)
+        index = np.arange(self.count)
+        self.positions[:] = start_locations[index % len(start_locations)]
+        self.positions[:, 0] -= (index // len(start_locations)) * self.start_spacing
+        self.velocities[:] = 0.0
+        self.headings[:] = [1.0, 0.0, 0.0]
+        self.speeds[:] = 0.0
+
+    # Advances all the racers by dt. throttle and steering are (N, ) arrays in [-1, 1], where a throttle of 1 is
+    # the same as holding UP, -1 DOWN, and a steering of 1 is LEFT and -1 RIGHT.
+    def update(self, dt, throttle, steering):
+        heights, materials = self.terrain.query.sample(self.positions)
+        max_speeds = np.where(materials == TerrainInfo.M_Road, self.max_speed_road, self.max_speed_rough)
+
+        target_velocities = self.headings * (throttle * max_speeds)[:, None]
+        t = blend_factor(self.velocity_response, dt)
+        self.velocities *= (1.0 - t)
+        self.velocities += target_velocities * t
+
+        self.speeds = np.linalg.norm(self.velocities, axis=1)
+
+        # Rotate the headings about the z axis
+        math3d.rotateZ(self.headings, steering * (dt * self.angular_velocity), out=self.headings)
+
+        self.positions += self.velocities * dt
+
+        t = blend_factor(self.height_response, dt)
+        self.positions[:, 2] = self.positions[:, 2] * (1.0 - t) + (heights + self.z_offset) * t
+
+    # A simple AI that drives at full speed, and steers towards the side where the road is, by looking at the material
+    # of two points ahead of each racer. Returns (throttle, steering).
+    def ai_inputs(self):
+        c = np.cos(self.ai_look_angle)
+        s = np.sin(self.ai_look_angle)
+        hx = self.headings[:, 0]
+        hy = self.headings[:, 1]
+        left = self.positions[:, :2] + np.stack([c * hx - s * hy, s * hx + c * hy], axis=1) * self.ai_look_ahead
+        right = self.positions[:, :2] + np.stack([c * hx + s * hy, -s * hx + c * hy], axis=1) * self.ai_look_ahead
+        materials = self.terrain.query.getMaterials(np.concatenate([left, right]))
+        left_on_road = materials[:self.count] == TerrainInfo.M_Road
+        right_on_road = materials[self.count:] == TerrainInfo.M_Road
+
+        throttle = np.ones(self.count, dtype=np.float32)
+        steering = left_on_road.astype(np.float32) - right_on_road.astype(np.float32)
+        return throttle, steering
+
+    # Returns the (N, 4, 4) model to world transforms, the same as Racer.render uses
+    def make_transforms(self):
+        yaw_angles = np.arctan2(self.headings[:, 1], self.headings[:, 0])
+        return props.makeInstanceTransforms(self.positions, yaw_angles, np.ones(self.count, dtype=np.float32))
+
+    # Draws the fleet with the model, which is usually the one already loaded by the player racer (world.racer.model),
+    # so the vertex and index buffers are shared rather than loaded again
+    def load(self, model):
+        self.props = props.InstancedProps(model)
+
+    def render(self, view, rendering_system):
+        self.props.setInstances(self.make_transforms(), GL.GL_STREAM_DRAW)
+        self.props.render(view, rendering_system)
+
+    def draw_ui(self):
+        imgui.label_text("Racers", "%d" % self.count)
+        imgui.label_text("MeanSpeed", "%0.1fm/s" % (float(self.speeds.mean()) if self.count else 0.0))
@@ -0,0 +1,221 @@
+"""Fixed-timestep simulation of the world, which can run headless (without a window or OpenGL).
+
+The game logic (sun, racer and follow camera) is advanced in steps of a fixed length, so that the result only
+depends on the sequence of inputs and not on the frame rate. The game loop feeds the time of each frame to
+Simulation.advance, which takes as many steps as fit in the elapsed time. A headless run instead takes the
+input for each step from a script or from a recording of a real game (see InputRecorder).
+
+Run a headless simulation from the project root:
+
+    python -m models.simulation [--map data/track_01_128.png] [--input recording.json] [--seconds 60] [--runs 10]
+
+Without --input, the racer just drives forward while turning left now and then.
+"""
+
+import argparse
+import json
+import math
+import time
+
+from utils import lab_utils as lu
+from utils.lab_utils import vec3
+
+from models.racer import Racer
+from models.terrain import Terrain
+from models.world import World
+
+
+SIMULATION_TIMESTEP = 1.0 / 60.0
+# The most steps advance will take for one frame, if the frame rate drops too low the simulation slows down instead
+# of taking ever more steps per frame.
+MAX_STEPS_PER_FRAME = 10
+
+# The keys the simulation reads
+RACER_KEYS = ["UP", "DOWN", "LEFT", "RIGHT"]
+
+
+def sample_key_frames(t, kfs):
+    # 1. find correct interval
+    if t <= kfs[0][0]:
+        return kfs[0][1]
+
+    if t >= kfs[-1][0]:
+        return kfs[-1][1]
+
+    for i1 in range(1, len(kfs)):
+        if t < kfs[i1][0]:
+            i0 = i1 - 1
+            t0 = kfs[i0][0]
+            t1 = kfs[i1][0]
+            # linear interpolation from one to the other
+            return lu.mix(kfs[i0][1], kfs[i1][1], (t - t0) / (t1 - t0))
+
+    # we should not get here, unless the key values are malformed (i.e., not strictly increasing)
+    assert False
+    # but if we do, we return a value that is obviously no good (rahter than say zero that might pass unnoticed for much longer)
+    return None
+
+
+# Advances the game logic of the world by dt seconds. Does not draw any UI or touch OpenGL.
+def update_world(world: World, dt, key_state_map):
+    if world.should_update_sun:
+        world.sun_angle += dt * 0.25
+        world.sun_angle = world.sun_angle % (2.0 * math.pi)
+
+    world.sun_position = lu.Mat3(lu.make_rotation_x(world.sun_angle)) * world.sun_start_position
+
+    world.sunlight_color = sample_key_frames(lu.dot(lu.normalize(world.sun_position), vec3(0.0, 0.0, 1.0)), world.sun_keyframes)
+    world.global_ambient_light = sample_key_frames(lu.dot(lu.normalize(world.sun_position), vec3(0.0, 0.0, 1.0)), world.ambient_keyframes)
+
+    world.racer.update(dt, key_state_map)
+    if world.fleet:
+        world.fleet.update(dt, *world.fleet.ai_inputs())
+
+    world.view_position = world.racer.position - \
+                          (world.racer.heading * world.follow_cam_offset) + \
+                          [0, 0, world.follow_cam_offset]
+    world.view_target = world.racer.position + vec3(0, 0, world.follow_cam_look_offset)
+
+
+def make_key_state_map(pressed_keys):
+    return {key: key in pressed_keys for key in RACER_KEYS}
+
+
+class Simulation:
+    def __init__(self, world: World, timestep=SIMULATION_TIMESTEP):
+        self.world = world
+        self.timestep = timestep
+        self.time = 0.0
+        self.num_steps = 0
+        # Time that has passed but not been simulated yet
+        self.accumulator = 0.0
+        # Called with the key state map of each step, e.g., InputRecorder.record
+        self.step_listeners = []
+
+    def step(self, key_state_map):
+        for listener in self.step_listeners:
+            listener(key_state_map)
+        update_world(self.world, self.timestep, key_state_map)
+        self.time += self.timestep
+        self.num_steps += 1
+
+    # Takes as many steps as fit in the frame time plus what was left over from earlier frames, all with the same
+    # input. Returns the number of steps taken.
+    def advance(self, frame_dt, key_state_map):
+        self.accumulator += frame_dt
+        num_steps = int(self.accumulator / self.timestep)
+        if num_steps > MAX_STEPS_PER_FRAME:
+            num_steps = MAX_STEPS_PER_FRAME
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= num_steps * self.timestep
+        for _ in range(num_steps):
+            self.step(key_state_map)
+        return num_steps
+
+    # Runs num_steps steps, taking the input for each from input_source.key_state_map(step_index)
+    def run(self, input_source, num_steps):
+        for _ in range(num_steps):
+            self.step(input_source.key_state_map(self.num_steps))
+
+
+# Input given as a list of (start time, end time, pressed keys), times in seconds. Keys not covered by any entry
+# are up. If loop_length is given the script repeats after that many seconds.
+class ScriptedInput:
+    def __init__(self, script, loop_length=None, timestep=SIMULATION_TIMESTEP):
+        self.script = script
+        self.loop_length = loop_length
+        self.timestep = timestep
+
+    def key_state_map(self, step_index):
+        t = step_index * self.timestep
+        if self.loop_length:
+            t = t % self.loop_length
+        pressed = set()
+        for start, end, keys in self.script:
+            if start <= t < end:
+                pressed.update(keys)
+        return make_key_state_map(pressed)
+
+
+# Plays back the key state of each step from a recording, the keys are all up after the end of the recording.
+class RecordedInput:
+    def __init__(self, steps):
+        # list of [number of steps, pressed keys]
+        self.maps = []
+        for num_steps, keys in steps:
+            self.maps += [make_key_state_map(keys)] * num_steps
+        self.up = make_key_state_map([])
+
+    def key_state_map(self, step_index):
+        return self.maps[step_index] if step_index < len(self.maps) else self.up
+
+    def __len__(self):
+        return len(self.maps)
+
+    def load(file_name):
+        with open(file_name) as in_file:
+            recording = json.load(in_file)
+        assert abs(recording["timestep"] - SIMULATION_TIMESTEP) < 1.0e-9, "recording uses a different timestep"
+        return RecordedInput(recording["steps"])
+
+
+# Records the keys pressed in each step of a simulation, as runs of steps with the same keys.
+class InputRecorder:
+    def __init__(self):
+        self.steps = []
+
+    def record(self, key_state_map):
+        keys = sorted(key for key in RACER_KEYS if key_state_map.get(key))
+        if self.steps and self.steps[-1][1] == keys:
+            self.steps[-1][0] += 1
+        else:
+            self.steps.append([1, keys])
+
+    def save(self, file_name):
+        with open(file_name, "w") as out_file:
+            json.dump({"timestep": SIMULATION_TIMESTEP, "steps": self.steps}, out_file)
+
+
+# Sets up a world with a terrain (mesh data only) and a racer without a model, nothing that needs OpenGL.
+def make_headless_world(map_name):
+    world = World()
+    world.terrain = Terrain()
+    world.terrain.loadMesh(map_name)
+    world.racer = Racer()
+    world.racer.setup(world.terrain)
+    return world
+
+
+# Full throttle, turning left for one second in every ten
+DEFAULT_SCRIPT = [(0.0, 10.0, ["UP"]), (5.0, 6.0, ["LEFT"])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--map", default="data/track_01_128.png")
+    parser.add_argument("--input", help="a recording saved by the game (see main.py --record)")
+    parser.add_argument("--seconds", type=float, default=60.0, help="simulated time per run")
+    parser.add_argument("--runs", type=int, default=1)
+    args = parser.parse_args()
+
+    input_source = RecordedInput.load(args.input) if args.input else ScriptedInput(DEFAULT_SCRIPT, loop_length=10.0)
+    num_steps = int(round(args.seconds / SIMULATION_TIMESTEP))
+
+    start = time.perf_counter()
+    world = make_headless_world(args.map)
+    print("Loaded '%s' in %0.2fs" % (args.map, time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for _ in range(args.runs):
+        world.racer.setup(world.terrain)
+        simulation = Simulation(world)
+        simulation.run(input_source, num_steps)
+    elapsed = time.perf_counter() - start
+    print("Simulated %d x %0.1fs (%d steps) in %0.2fs, %0.0fx real time" % (
+        args.runs, args.seconds, args.runs * num_steps, elapsed, args.runs * args.seconds / max(elapsed, 1.0e-9)))
+    print("Final position: %s, speed %0.2fm/s" % (world.racer.position, world.racer.speed))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,332 @@
 import os
 
-import imgui
-from OpenGL.GL import *
-from PIL import Image
+import numpy as np
 
 from utils import lab_utils as lu
+from utils import binary_cache
 from utils.lab_utils import vec3, vec2
-from utils.ObjModel import ObjModel
+from utils.lazy_import import lazyModule
+from utils.profiler import g_profiler
+from utils.vertex_format import VertexFormat, VertexAttribute
+from models import terrain_query
+from models.terrain_query import TerrainQuery
+
+# The queries (loadMesh, getInfoAt, ...) do not need these, they are imported when the terrain is first loaded for
+# rendering or decoded from the image
+GL = lazyModule("OpenGL.GL")
+imgui = lazyModule("imgui")
+Image = lazyModule("PIL.Image")
+shader_cache = lazyModule("utils.shader_cache")
+texture_manager = lazyModule("utils.texture_manager")
+terrain_tiles = lazyModule("models.terrain_tiles")
 
 
 TERRAIN_VERTEX_SHADER_PATH = 'shaders/terrain/vertexShader.glsl'
 TERRAIN_FRAGMENT_SHADER_PATH = 'shaders/terrain/fragmentShader.glsl'
 
+# Processed terrain meshes are cached here, see loadTerrainMeshCached
+TERRAIN_CACHE_DIR = 'cache/terrain'
+# Bump this when the output of buildTerrainMesh changes, to invalidate all the existing cache entries
+TERRAIN_CACHE_VERSION = 1
+TERRAIN_CACHE_MAGIC = b'MRTERRN1'
+
+TERRAIN_VERTEX_FORMAT = VertexFormat([
+    VertexAttribute("position", 0, 3),
+    VertexAttribute("normal", 1, 3),
+])
+
 
 # returned by getInfoAt to provide easy access to height and material type on the terrain for use
 # by the world logic.
 class TerrainInfo:
-    M_Road = 0
-    M_Rough = 1
+    M_Road = terrain_query.M_Road
+    M_Rough = terrain_query.M_Rough
     height = 0.0
     material = 0
 
 
+# The geometry generated from a terrain map image, as produced by buildTerrainMesh. Positions and normals
+# are (N, 3) float32 arrays with one vertex per pixel (row-major), indices a flat uint32 array of triangles.
+class TerrainMesh:
+    positions = None
+    normals = None
+    indices = None
+    startLocations = []
+    treeLocations = []
+    rockLocations = []
+
+
+# Builds the terrain vertices, normals and triangle indices from RGBA image data using whole-array numpy
+# operations. The red channel gives the height, and the green channel marks start (255), tree (128) and
+# rock (64) locations. Produces the same output as buildTerrainMeshLoops (the original per-pixel version),
+# but scales to large heightmaps.
+def buildTerrainMesh(imageData, imageWidth, imageHeight, xyScale, heightScale):
+    pixels = np.frombuffer(imageData, dtype=np.uint8).reshape(imageHeight, imageWidth, 4)
+
+    xyOffset = -vec2(float(imageWidth), float(imageHeight)) * xyScale / 2.0
+    jj, ii = np.mgrid[0:imageHeight, 0:imageWidth].astype(np.float32)
+
+    # Calculate vertex positions, laid out as a (height, width, 3) grid
+    grid = np.empty((imageHeight, imageWidth, 3), dtype=np.float32)
+    grid[:, :, 0] = ii * np.float32(xyScale) + xyOffset[0]
+    grid[:, :, 1] = jj * np.float32(xyScale) + xyOffset[1]
+    grid[:, :, 2] = pixels[:, :, 0] / 255.0 * heightScale
+
+    # build vertex normals from the central differences along the axes and the diagonals,
+    # the border vertices just point straight up.
+    normals = np.zeros_like(grid)
+    normals[:, :, 2] = 1.0
+    if imageWidth > 2 and imageHeight > 2:
+        dx = grid[1:-1, :-2] - grid[1:-1, 2:]
+        dy = grid[:-2, 1:-1] - grid[2:, 1:-1]
+        dxy = grid[:-2, :-2] - grid[2:, 2:]
+        dyx = grid[:-2, 2:] - grid[2:, :-2]
+        nP = _normalizeRows(np.cross(dx, dy))
+        nD = _normalizeRows(np.cross(dxy, dyx))
+        normals[1:-1, 1:-1] = _normalizeRows(nP + nD)
+
+    # join verts with quads that is: 2 triangles @ 3 vertices, with one less in each direction.
+    corners = (np.arange(imageHeight - 1, dtype=np.uint32)[:, None] * imageWidth +
+               np.arange(imageWidth - 1, dtype=np.uint32)[None, :]).ravel()
+    quads = np.empty((len(corners), 6), dtype=np.uint32)
+    quads[:, 0] = corners
+    quads[:, 1] = corners + 1
+    quads[:, 2] = corners + imageWidth
+    quads[:, 3] = corners + imageWidth
+    quads[:, 4] = corners + 1
+    quads[:, 5] = corners + imageWidth + 1
+
+    mesh = TerrainMesh()
+    mesh.positions = grid.reshape(-1, 3)
+    mesh.normals = normals.reshape(-1, 3)
+    mesh.indices = quads.ravel()
+
+    green = pixels[:, :, 1].ravel()
+    mesh.startLocations = list(mesh.positions[green == 255])
+    mesh.treeLocations = list(mesh.positions[green == 128])
+    mesh.rockLocations = list(mesh.positions[green == 64])
+    return mesh
+
+
+def _normalizeRows(v):
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+
+# Reads the terrain map image and returns (imageWidth, imageHeight, imageData) with the pixels as
+# bottom-up RGBA bytes, which is the layout that the terrain mesh and getInfoAt expect.
+def readTerrainImage(imageName):
+    with Image.open(imageName) as im:
+        imageData = im.tobytes("raw", "RGBX" if im.mode == 'RGB' else "RGBA", 0, -1)
+        return im.size[0], im.size[1], imageData
+
+
+# Loads the terrain mesh for the map image, using a binary cache of the processed arrays in cacheDir.
+# The cache entry is keyed by the content of the image and the scale parameters, so any change to
+# these (or to TERRAIN_CACHE_VERSION) rejects the old entry and rebuilds it. On a cache hit the arrays are
+# memory-mapped from the file and the image is not even decoded.
+# Returns (mesh, imageWidth, imageHeight, imageData).
+def loadTerrainMeshCached(imageName, xyScale, heightScale, cacheDir=TERRAIN_CACHE_DIR):
+    key = binary_cache.hashFileContents(imageName, float(xyScale), float(heightScale), TERRAIN_CACHE_VERSION)
+    baseName = os.path.splitext(os.path.basename(imageName))[0]
+    cacheFileName = os.path.join(cacheDir, "%s_%s.bin" % (baseName, key[:16]))
+
+    if os.path.exists(cacheFileName):
+        try:
+            meta, arrays = binary_cache.readArrays(cacheFileName, TERRAIN_CACHE_MAGIC)
+            if meta.get("key") == key:
+                mesh = TerrainMesh()
+                mesh.positions = arrays["positions"]
+                mesh.normals = arrays["normals"]
+                mesh.indices = arrays["indices"]
+                # These are copied since the racers take ownership of (and modify) the start locations
+                mesh.startLocations = list(np.array(arrays["startLocations"]))
+                mesh.treeLocations = list(np.array(arrays["treeLocations"]))
+                mesh.rockLocations = list(np.array(arrays["rockLocations"]))
+                return mesh, meta["imageWidth"], meta["imageHeight"], arrays["imageData"]
+        except (binary_cache.CacheFormatError, KeyError, OSError, ValueError) as e:
+            print("WARNING: ignoring bad terrain cache file '%s': %s" % (cacheFileName, e))
+
+    imageWidth, imageHeight, imageData = readTerrainImage(imageName)
+    mesh = buildTerrainMesh(imageData, imageWidth, imageHeight, xyScale, heightScale)
+
+    # Remove stale entries for the same map, they can never be hit again.
+    binary_cache.removeStaleFiles(cacheDir, baseName, TERRAIN_CACHE_MAGIC, imageName, cacheFileName)
+
+    meta = {"key": key, "image": imageName, "imageWidth": imageWidth, "imageHeight": imageHeight}
+    arrays = {
+        "positions": mesh.positions,
+        "normals": mesh.normals,
+        "indices": mesh.indices,
+        "startLocations": np.array(mesh.startLocations, dtype=np.float32).reshape(-1, 3),
+        "treeLocations": np.array(mesh.treeLocations, dtype=np.float32).reshape(-1, 3),
+        "rockLocations": np.array(mesh.rockLocations, dtype=np.float32).reshape(-1, 3),
+        "imageData": np.frombuffer(imageData, dtype=np.uint8),
+    }
+    try:
+        binary_cache.writeArrays(cacheFileName, TERRAIN_CACHE_MAGIC, meta, arrays)
+    except OSError as e:
+        print("WARNING: failed to write terrain cache file '%s': %s" % (cacheFileName, e))
+    return mesh, imageWidth, imageHeight, imageData
+
+
+# The original per-pixel implementation of the terrain mesh generation, kept as a reference to validate
+# buildTerrainMesh against (see benchmarks/terrain_mesh_benchmark.py). Returns lists of vec3 and indices.
+def buildTerrainMeshLoops(imageData, imageWidth, imageHeight, xyScale, heightScale):
+    mesh = TerrainMesh()
+    mesh.startLocations = []
+    mesh.treeLocations = []
+    mesh.rockLocations = []
+
+    xyOffset = -vec2(float(imageWidth), float(imageHeight)) * xyScale / 2.0;
+
+    # Calculate vertex positions
+    terrainVerts = []
+    for j in range(imageHeight):
+        for i in range(imageWidth):
+            offset = (j * imageWidth + i) * 4
+            # copy pixel 4 channels
+            imagePixel = imageData[offset:offset + 4];
+            # Normalize the red channel from [0,255] to [0.0, 1.0]
+            red = float(imagePixel[0]) / 255.0;
+
+            xyPos = vec2(i, j) * xyScale + xyOffset;
+            zPos = red * heightScale
+            pt = vec3(xyPos[0], xyPos[1], zPos)
+            terrainVerts.append(pt)
+
+            green = imagePixel[1]
+            if green == 255:
+                mesh.startLocations.append(pt)
+            if green == 128:
+                mesh.treeLocations.append(pt)
+            if green == 64:
+                mesh.rockLocations.append(pt)
+
+    # build vertex normals...
+    terrainNormals = [vec3(0.0, 0.0, 1.0)] * imageWidth * imageHeight;
+    for j in range(1, imageHeight - 1):
+        for i in range(1, imageWidth - 1):
+            v = terrainVerts[j * imageWidth + i];
+            vxP = terrainVerts[j * imageWidth + i - 1];
+            vxN = terrainVerts[j * imageWidth + i + 1];
+            dx = vxP - vxN;
+
+            vyP = terrainVerts[(j - 1) * imageWidth + i];
+            vyN = terrainVerts[(j + 1) * imageWidth + i];
+            dy = vyP - vyN;
+
+            nP = lu.normalize(lu.cross(dx, dy));
+
+            vdxyP = terrainVerts[(j - 1) * imageWidth + i - 1];
+            vdxyN = terrainVerts[(j + 1) * imageWidth + i + 1];
+            dxy = vdxyP - vdxyN;
+
+            vdyxP = terrainVerts[(j - 1) * imageWidth + i + 1];
+            vdyxN = terrainVerts[(j + 1) * imageWidth + i - 1];
+            dyx = vdyxP - vdyxN;
+
+            nD = lu.normalize(lu.cross(dxy, dyx));
+
+            terrainNormals[j * imageWidth + i] = lu.normalize(nP + nD);
+
+    # join verts with quads that is: 2 triangles @ 3 vertices, with one less in each direction.
+    terrainInds = [0] * 2 * 3 * (imageWidth - 1) * (imageHeight - 1)
+    for j in range(0, imageHeight - 1):
+        for i in range(0, imageWidth - 1):
+            # Vertex indices to the four corners of the quad.
+            qInds = [
+                j * imageWidth + i,
+                j * imageWidth + i + 1,
+                (j + 1) * imageWidth + i,
+                (j + 1) * imageWidth + i + 1,
+            ]
+            outOffset = 3 * 2 * (j * (imageWidth - 1) + i);
+            points = [
+                terrainVerts[qInds[0]],
+                terrainVerts[qInds[1]],
+                terrainVerts[qInds[2]],
+                terrainVerts[qInds[3]],
+            ]
+            # output first triangle:
+            terrainInds[outOffset + 0] = qInds[0];
+            terrainInds[outOffset + 1] = qInds[1];
+            terrainInds[outOffset + 2] = qInds[2];
+            # second triangle
+            terrainInds[outOffset + 3] = qInds[2];
+            terrainInds[outOffset + 4] = qInds[1];
+            terrainInds[outOffset + 5] = qInds[3];
+
+    mesh.positions = terrainVerts
+    mesh.normals = terrainNormals
+    mesh.indices = terrainInds
+    return mesh
+
+
+# The per-texel data of the map that the weights of the material layers are computed from (see computeSplatMap).
+# height is the terrain height in [0, 1], normals the (height, width, 3) vertex normals and pixels the
+# (height, width, 4) RGBA map data, all bottom-up like the map texture.
+class SplatInputs:
+    def __init__(self, mesh, imageData, imageWidth, imageHeight, heightScale):
+        self.height = mesh.positions[:, 2].reshape(imageHeight, imageWidth) / heightScale
+        self.normals = mesh.normals.reshape(imageHeight, imageWidth, 3)
+        self.pixels = np.frombuffer(imageData, dtype=np.uint8).reshape(imageHeight, imageWidth, 4)
+
+
+# A material of the terrain, i.e., a layer of the terrain material texture array. getWeight is called with the
+# SplatInputs and returns the weight of the layer at each texel of the map, 0 where the layer is absent. The base
+# layer (the first) has no getWeight, it is what the other layers are blended over.
+class TerrainMaterialLayer:
+    def __init__(self, name, textureFile, getWeight=None):
+        self.name = name
+        self.textureFile = textureFile
+        self.getWeight = getWeight
+
+
+# High rock covers the terrain above 0.8 of the height scale, more so the higher it is
+def getHighRockWeight(inputs):
+    return np.where(inputs.height > 0.8, inputs.height, 0.0)
+
+
+# Steep slopes, where the normal is far from vertical, show a little of the slope rock
+def getSlopeWeight(inputs):
+    normals = inputs.normals
+    cosine = normals[..., 0] * normals[..., 0] + normals[..., 2] * normals[..., 2]
+    return np.where(cosine < 0.6, 0.3 * cosine, 0.0)
+
+
+# The road is marked in the blue channel of the map
+def getPavingWeight(inputs):
+    blue = inputs.pixels[..., 2] / 255.0
+    return np.where(blue > 0.1, blue, 0.0)
+
+
+# Computes the splat map of the terrain from the map data: each texel holds the index of the layer that is blended
+# over the base layer (in the red channel, read unfiltered by the shader) and the weight of the blend (green,
+# filtered). Where several layers have weight, the one that comes last in the list wins. Returns bottom-up RGBA
+# bytes the size of the map.
+def computeSplatMap(materialLayers, inputs):
+    imageHeight, imageWidth = inputs.height.shape
+    splat = np.zeros((imageHeight, imageWidth, 4), dtype=np.uint8)
+    splat[..., 3] = 255
+    for index, layer in enumerate(materialLayers):
+        if layer.getWeight is None:
+            continue
+        weight = layer.getWeight(inputs)
+        present = weight > 0.0
+        splat[..., 0][present] = index
+        splat[..., 1][present] = np.clip(np.rint(weight[present] * 255.0), 0, 255)
+
+    # The weight fades out towards the texels next to a layer, which must then have the index of the layer too (of
+    # the neighbour with the largest weight), or the blend would stop dead half way to them.
+    padded = np.pad(splat, ((1, 1), (1, 1), (0, 0)))
+    neighbours = np.stack([padded[1 + dy:1 + dy + imageHeight, 1 + dx:1 + dx + imageWidth]
+                           for dy in (-1, 0, 1) for dx in (-1, 0, 1) if dy or dx])
+    strongest = np.take_along_axis(neighbours[..., 0], np.argmax(neighbours[..., 1], axis=0)[None], axis=0)[0]
+    absent = splat[..., 1] == 0
+    splat[..., 0][absent] = strongest[absent]
+    return splat.tobytes()
+
+
 # This class looks after loading & generating the terrain geometry as well as rendering.
 # It also provides access to the terrain height and type at different points.
 class Terrain:
@@ -33,6 +338,15 @@ class Terrain:
     imageHeight = 0
     shader = None
     renderWireFrame = False
+    # The terrain vertices are in world space
+    modelToWorldTransform = lu.Mat4()
+    # Set to False to draw all the terrain tiles, to compare with the culled result
+    cullTiles = True
+    tiles = None
+    # Height and material lookups for the game logic (see models/terrain_query.py)
+    query = None
+    # Directory to cache the processed terrain mesh in, set to None to always rebuild it from the image
+    meshCacheDir = TERRAIN_CACHE_DIR
 
     # Lists of locations generated from the map texture green channel (see the 'load' method)
     # you can add any other meaning of other values as you see fit.
@@ -44,23 +358,27 @@ class Terrain:
     # Same for rocks
     rockLocations = []
 
+    # The material layers, in the order of the layers of the texture array. The textures must all be the same size.
+    # A new material is added with a texture and a function giving its weight from the map data (see
+    # computeSplatMap), the shader does not change.
+    materialLayers = [
+        TerrainMaterialLayer("grass", 'data/grass2.png'),
+        TerrainMaterialLayer("highRock", 'data/rock 2.png', getHighRockWeight),
+        TerrainMaterialLayer("slope", 'data/rock 5.png', getSlopeWeight),
+        TerrainMaterialLayer("paving", 'data/paving 5.png', getPavingWeight),
+    ]
+
     # Texture unit allocations:
-    TU_Grass = 0
-    TU_rock_high = 1
-    TU_slope = 2
-    TU_paving = 3
-    TU_mapData = 4
+    TU_Materials = 0
+    TU_Splat = 1
 
-    texture_id_grass = None
-    texture_id_rock_high = None
-    texture_id_slope = None
-    texture_id_paving = None
-    texture_id_mapData = None
+    materialTextureId = None
+    splatTextureId = None
 
 
     def render(self, view, renderingSystem):
-        glUseProgram(self.shader)
-        renderingSystem.setCommonUniforms(self.shader, view, lu.Mat4())
+        GL.glUseProgram(self.shader)
+        renderingSystem.setCommonUniforms(self.shader, view, self.modelToWorldTransform)
 
         lu.setUniform(self.shader, "terrainHeightScale", self.heightScale)
         lu.setUniform(self.shader, "terrainTextureXyScale", self.textureXyScale)
@@ -69,138 +387,56 @@ class Terrain:
         xyOffset = -(vec2(self.imageWidth, self.imageHeight) + vec2(1.0)) * self.xyScale / 2.0
         lu.setUniform(self.shader, "xyOffset", xyOffset)
 
-        # TODO 1.4: Bind the grass texture to the right texture unit, hint: lu.bindTexture
-        # texture_id_grass = glGenTextures(1)
-        glActiveTexture(GL_TEXTURE0 + self.TU_Grass)
-        glBindTexture(GL_TEXTURE_2D, self.texture_id_grass)
-
-        # Bind other textures
-        glActiveTexture(GL_TEXTURE0 + self.TU_rock_high)
-        glBindTexture(GL_TEXTURE_2D, self.texture_id_rock_high)
-        glActiveTexture(GL_TEXTURE0 + self.TU_slope)
-        glBindTexture(GL_TEXTURE_2D, self.texture_id_slope)
-        glActiveTexture(GL_TEXTURE0 + self.TU_paving)
-        glBindTexture(GL_TEXTURE_2D, self.texture_id_paving)
-        glActiveTexture(GL_TEXTURE0 + self.TU_mapData)
-        glBindTexture(GL_TEXTURE_2D, self.texture_id_mapData)
-
-
+        # All the materials are layers of one texture array, blended as given by the splat map
+        GL.glActiveTexture(GL.GL_TEXTURE0 + self.TU_Materials)
+        GL.glBindTexture(GL.GL_TEXTURE_2D_ARRAY, self.materialTextureId)
+        GL.glActiveTexture(GL.GL_TEXTURE0 + self.TU_Splat)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.splatTextureId)
 
         if self.renderWireFrame:
-            glPolygonMode(GL_FRONT_AND_BACK, GL_LINE)
-            glLineWidth(1.0)
-        glBindVertexArray(self.vertexArrayObject)
-        glDrawElements(GL_TRIANGLES, len(self.terrainInds), GL_UNSIGNED_INT, None)
+            GL.glPolygonMode(GL.GL_FRONT_AND_BACK, GL.GL_LINE)
+            GL.glLineWidth(1.0)
+        GL.glBindVertexArray(self.vertexArrayObject)
+        # The terrain is not transformed (model space is world space), so the frustum is that of the view
+        worldToClipTransform = view.viewToClipTransform * view.worldToViewTransform if self.cullTiles else None
+        with g_profiler.scope("tiles"):
+            self.tiles.render(worldToClipTransform, renderingSystem.world.view_position)
+        if self.tiles.numVisibleTiles:
+            g_profiler.count("drawCalls")
+        g_profiler.count("terrainTiles", self.tiles.numVisibleTiles)
+        g_profiler.count("terrainTriangles", self.tiles.numTrianglesSubmitted)
 
         if self.renderWireFrame:
-            glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
-        glBindVertexArray(0)
-
-        glUniform1i(glGetUniformLocation(self.shader, "ourTexture"), self.TU_Grass)
-        glUniform1i(glGetUniformLocation(self.shader, "rockHighTexture"), self.TU_rock_high)
-        glUniform1i(glGetUniformLocation(self.shader, "slopeTexture"), self.TU_slope)
-        glUniform1i(glGetUniformLocation(self.shader, "pavingTexture"), self.TU_paving)
-        glUniform1i(glGetUniformLocation(self.shader, "mapData"), self.TU_mapData)
+            GL.glPolygonMode(GL.GL_FRONT_AND_BACK, GL.GL_FILL)
+        GL.glBindVertexArray(0)
 
         # unbinds the program
-        glUseProgram(0)
+        GL.glUseProgram(0)
 
     def load(self, imageName, renderingSystem):
-        with Image.open(imageName)  as im:
-            self.imageWidth = im.size[0]
-            self.imageHeight = im.size[1]
-            self.imageData = im.tobytes("raw", "RGBX" if im.mode == 'RGB' else "RGBA", 0, -1)
-
-            xyOffset = -vec2(float(self.imageWidth), float(self.imageHeight)) * self.xyScale / 2.0;
-
-            # Calculate vertex positions
-            terrainVerts = []
-            for j in range(self.imageHeight):
-                for i in range(self.imageWidth):
-                    offset = (j * self.imageWidth + i) * 4
-                    # copy pixel 4 channels
-                    imagePixel = self.imageData[offset:offset + 4];
-                    # Normalize the red channel from [0,255] to [0.0, 1.0]
-                    red = float(imagePixel[0]) / 255.0;
-
-                    xyPos = vec2(i, j) * self.xyScale + xyOffset;
-                    zPos = red * self.heightScale
-                    pt = vec3(xyPos[0], xyPos[1], zPos)
-                    terrainVerts.append(pt)
-
-                    green = imagePixel[1]
-                    if green == 255:
-                        self.startLocations.append(pt)
-                    if green == 128:
-                        self.treeLocations.append(pt)
-                    if green == 64:
-                        self.rockLocations.append(pt)
-
-            # build vertex normals...
-            terrainNormals = [vec3(0.0, 0.0, 1.0)] * self.imageWidth * self.imageHeight;
-            for j in range(1, self.imageHeight - 1):
-                for i in range(1, self.imageWidth - 1):
-                    v = terrainVerts[j * self.imageWidth + i];
-                    vxP = terrainVerts[j * self.imageWidth + i - 1];
-                    vxN = terrainVerts[j * self.imageWidth + i + 1];
-                    dx = vxP - vxN;
-
-                    vyP = terrainVerts[(j - 1) * self.imageWidth + i];
-                    vyN = terrainVerts[(j + 1) * self.imageWidth + i];
-                    dy = vyP - vyN;
-
-                    nP = lu.normalize(lu.cross(dx, dy));
-
-                    vdxyP = terrainVerts[(j - 1) * self.imageWidth + i - 1];
-                    vdxyN = terrainVerts[(j + 1) * self.imageWidth + i + 1];
-                    dxy = vdxyP - vdxyN;
-
-                    vdyxP = terrainVerts[(j - 1) * self.imageWidth + i + 1];
-                    vdyxN = terrainVerts[(j + 1) * self.imageWidth + i - 1];
-                    dyx = vdyxP - vdyxN;
-
-                    nD = lu.normalize(lu.cross(dxy, dyx));
-
-                    terrainNormals[j * self.imageWidth + i] = lu.normalize(nP + nD);
-
-            # join verts with quads that is: 2 triangles @ 3 vertices, with one less in each direction.
-            terrainInds = [0] * 2 * 3 * (self.imageWidth - 1) * (self.imageHeight - 1)
-            for j in range(0, self.imageHeight - 1):
-                for i in range(0, self.imageWidth - 1):
-                    # Vertex indices to the four corners of the quad.
-                    qInds = [
-                        j * self.imageWidth + i,
-                        j * self.imageWidth + i + 1,
-                        (j + 1) * self.imageWidth + i,
-                        (j + 1) * self.imageWidth + i + 1,
-                    ]
-                    outOffset = 3 * 2 * (j * (self.imageWidth - 1) + i);
-                    points = [
-                        terrainVerts[qInds[0]],
-                        terrainVerts[qInds[1]],
-                        terrainVerts[qInds[2]],
-                        terrainVerts[qInds[3]],
-                    ]
-                    # output first triangle:
-                    terrainInds[outOffset + 0] = qInds[0];
-                    terrainInds[outOffset + 1] = qInds[1];
-                    terrainInds[outOffset + 2] = qInds[2];
-                    # second triangle
-                    terrainInds[outOffset + 3] = qInds[2];
-                    terrainInds[outOffset + 4] = qInds[1];
-                    terrainInds[outOffset + 5] = qInds[3];
-
-            self.terrainInds = terrainInds
-
-            # This creates a Vertex Array Object (VAO) to store each vertex attribute call.
-            # This is so that we only need to configure the Vertex Attribute Pointers
-            #   only once, and whenever we want to draw a certain object, we can just
-            #   bind the corresponding VAO
-            self.vertexArrayObject = glGenVertexArrays(1)
-
-            self.vertexDataBuffer = lu.createAndAddVertexArrayData(self.vertexArrayObject, terrainVerts, 0)
-            self.normalDataBuffer = lu.createAndAddVertexArrayData(self.vertexArrayObject, terrainNormals, 1)
-            self.indexDataBuffer = lu.createAndAddIndexArray(self.vertexArrayObject, terrainInds)
+        textureManager = texture_manager.g_textureManager
+        # Start decoding the textures on the worker threads, they are picked up at the end
+        materials = textureManager.requestArray([layer.textureFile for layer in self.materialLayers], True)
+
+        mesh = self.loadMesh(imageName)
+        terrainVerts = mesh.positions
+        terrainNormals = mesh.normals
+
+        # The terrain is drawn tile by tile, each with its own range of the index buffer (see models/terrain_tiles.py)
+        self.tiles = terrain_tiles.TerrainTiles(terrainVerts, self.imageWidth, self.imageHeight)
+
+        # This creates a Vertex Array Object (VAO) to store each vertex attribute call.
+        # This is so that we only need to configure the Vertex Attribute Pointers
+        #   only once, and whenever we want to draw a certain object, we can just
+        #   bind the corresponding VAO
+        self.vertexArrayObject = GL.glGenVertexArrays(1)
+
+        # Positions and normals are interleaved in a single vertex buffer
+        self.vertexDataBuffer = TERRAIN_VERTEX_FORMAT.createVertexBuffer(self.vertexArrayObject, {
+            "position": terrainVerts,
+            "normal": terrainNormals,
+        })
+        self.indexDataBuffer = self.tiles.createIndexBuffer(self.vertexArrayObject)
 
         # Get the vertexShader and fragmentShader from the files
         with open(TERRAIN_VERTEX_SHADER_PATH) as file:
@@ -212,33 +448,49 @@ class Terrain:
         # This is basically the only standard way to 'include' or 'import' code into more than one shader. The variable renderingSystem.commonFragmentShaderCode
         # contains code that we wish to use in all the fragment shaders, for example code to transform the colour output to srgb.
         # It is also a nice place to put code to compute lighting and other effects that should be the same accross the terrain and racer for example.
-        self.shader = lu.buildShader([vertexShader],
-                                     ["#version 330\n", renderingSystem.commonFragmentShaderCode, fragmentShader],
-                                     {"positionIn": 0, "normalIn": 1})
-
-        # TODO 1.4: Load texture and configure the sampler
-        texture_file = 'data/grass2.png'
-        base_path, filename = os.path.split(texture_file)
-        self.texture_id_grass = ObjModel.loadTexture(filename, base_path, True)
-
-        texture_file = 'data/rock 2.png'
-        base_path, filename = os.path.split(texture_file)
-        self.texture_id_rock_high = ObjModel.loadTexture(filename, base_path, True)
-
-        texture_file = 'data/rock 5.png'
-        base_path, filename = os.path.split(texture_file)
-        self.texture_id_slope = ObjModel.loadTexture(filename, base_path, True)
-
-        texture_file = 'data/paving 5.png'
-        base_path, filename = os.path.split(texture_file)
-        self.texture_id_paving = ObjModel.loadTexture(filename, base_path, True)
-
-        # Now load the special map data
-        texture_file = 'data/track_01_128.png'
-        base_path, filename = os.path.split(texture_file)
-        self.texture_id_mapData = ObjModel.loadTexture(filename, base_path, False)
-
-
+        self.shader = shader_cache.g_shaderCache.buildShader([vertexShader],
+                                                             ["#version 330\n", renderingSystem.commonFragmentShaderCode,
+                                                              fragmentShader],
+                                                             {"positionIn": 0, "normalIn": 1})
+
+        # The samplers always use the same texture units, so they only need to be set once
+        GL.glUseProgram(self.shader)
+        lu.setUniform(self.shader, "materialTextures", self.TU_Materials)
+        lu.setUniform(self.shader, "splatMap", self.TU_Splat)
+        GL.glUseProgram(0)
+
+        # The textures were decoded while the mesh was built, upload them now that they are needed
+        textureManager.finishLoading()
+        self.materialTextureId = materials.textureId
+
+        # The splat map is derived from the map data, it covers the terrain once so it is clamped rather than repeated
+        splatData = computeSplatMap(self.materialLayers,
+                                    SplatInputs(mesh, self.imageData, self.imageWidth, self.imageHeight, self.heightScale))
+        self.splatTextureId = textureManager.addImage(imageName + " (splat)", self.imageWidth, self.imageHeight,
+                                                      splatData, False).textureId
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.splatTextureId)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+        # The layer index is fetched from level 0, so the weight must come from level 0 too: the coarser mips average
+        # in the weights of neighbouring texels that belong to a different layer
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_LINEAR)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+
+    # Loads the map image and generates (or fetches from the cache) the terrain geometry, without touching
+    # OpenGL. Sets up the image data and location lists and returns the TerrainMesh.
+    def loadMesh(self, imageName):
+        if self.meshCacheDir:
+            mesh, self.imageWidth, self.imageHeight, self.imageData = \
+                loadTerrainMeshCached(imageName, self.xyScale, self.heightScale, self.meshCacheDir)
+        else:
+            self.imageWidth, self.imageHeight, self.imageData = readTerrainImage(imageName)
+            mesh = buildTerrainMesh(self.imageData, self.imageWidth, self.imageHeight, self.xyScale, self.heightScale)
+
+        self.startLocations = mesh.startLocations
+        self.treeLocations = mesh.treeLocations
+        self.rockLocations = mesh.rockLocations
+        self.query = TerrainQuery(self.imageData, self.imageWidth, self.imageHeight, self.xyScale, self.heightScale)
+        return mesh
 
     # Called by the world to drawt he UI widgets for the terrain.
     def draw_ui(self):
@@ -247,24 +499,20 @@ class Terrain:
         # _,self.heightScale = imgui.slider_float("terrainHeightScale", self.heightScale, 1.0, 100.0)
         _, self.textureXyScale = imgui.slider_float("terrainTextureXyScale", self.textureXyScale, 0.01, 10.0)
         _, self.renderWireFrame = imgui.checkbox("WireFrame", self.renderWireFrame);
+        _, self.cullTiles = imgui.checkbox("CullTiles", self.cullTiles)
+        _, self.tiles.lodEnabled = imgui.checkbox("LevelOfDetail", self.tiles.lodEnabled)
+        _, self.tiles.lodDistance = imgui.slider_float("LodDistance", self.tiles.lodDistance, 10.0, 2000.0)
+        imgui.label_text("VisibleTiles", "%d / %d" % (self.tiles.numVisibleTiles, self.tiles.numTiles))
+        imgui.label_text("TilesPerLevel", " ".join(str(n) for n in self.tiles.numVisibleTilesPerLevel))
+        imgui.label_text("Triangles", "%d" % self.tiles.numTrianglesSubmitted)
+        imgui.label_text("MaterialLayers", ", ".join(layer.name for layer in self.materialLayers))
 
     # Retrieves information about the terrain at some x/y world-space position, if you request info from outside
-    # the track it just clamps the position to the edge of the track.
+    # the track it just clamps the position to the edge of the track. The height is bi-linearly interpolated
+    # between the pixels of the map, which makes the movement of the racer smoother.
     # Returns an instance of the class TerrainInfo.
-    # An improvement that would make the movement of the racer smoother is to bi-linearly interpolate the image data.
-    # this is something that comes free with OpenGL texture sampling, but here we'd have to implement it ourselves.
+    # To look up many positions at once, use self.query.sample with an (N, 2) array instead.
     def getInfoAt(self, position):
-        # 1. convert x&y to texture scale
-        xyOffset = -vec2(self.imageWidth, self.imageHeight) * self.xyScale / 2.0
-        imageSpacePos = (vec2(position[0], position[1]) - xyOffset) / self.xyScale;
-
-        x = max(0, min(self.imageWidth - 1, int(imageSpacePos[0])))
-        y = max(0, min(self.imageHeight - 1, int(imageSpacePos[1])))
-        pixelOffset = (y * self.imageWidth + x) * 4
-        # copy pixel 4 channels
-        imagePixel = self.imageData[pixelOffset:pixelOffset + 4]
-
-        info = TerrainInfo();
-        info.height = float(imagePixel[0]) * self.heightScale / 255.0;
-        info.material = TerrainInfo.M_Road if imagePixel[2] == 255 else TerrainInfo.M_Rough
+        info = TerrainInfo()
+        info.height, info.material = self.query.sampleOne(position[0], position[1])
         return info
@@ -0,0 +1,97 @@
+"""Height, surface normal and material queries against the terrain map, for the game logic.
+
+The map image is converted once into a float32 grid of heights and a uint8 grid of materials, after which
+any number of positions can be looked up with a handful of whole-array operations. Heights and normals are
+bilinearly interpolated between the pixels, which are at the same places as the terrain mesh vertices.
+Positions outside the map are clamped to the edge. Does not use OpenGL.
+"""
+
+import math
+
+import numpy as np
+
+
+# Material types, stored in the material grid
+M_Road = 0
+M_Rough = 1
+
+
+class TerrainQuery:
+    # imageData is the bottom-up RGBA map data (see readTerrainImage), the red channel is the height and a blue
+    # channel of 255 marks the road.
+    def __init__(self, imageData, imageWidth, imageHeight, xyScale, heightScale):
+        pixels = np.frombuffer(imageData, dtype=np.uint8).reshape(imageHeight, imageWidth, 4)
+        self.imageWidth = imageWidth
+        self.imageHeight = imageHeight
+        self.xyScale = float(xyScale)
+        self.heights = pixels[:, :, 0] * np.float32(heightScale / 255.0)
+        self.materials = np.where(pixels[:, :, 2] == 255, M_Road, M_Rough).astype(np.uint8)
+        # World space position of the first pixel (see buildTerrainMesh)
+        self.xyOffset = -np.array([imageWidth, imageHeight], dtype=np.float64) * self.xyScale / 2.0
+
+    # Converts (N, 2) (or (N, 3), the z is ignored) world space positions to the pixel to the lower left of each
+    # position and the fraction of the way to the next pixel, for bilinear interpolation.
+    def _toImageSpace(self, positions):
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, np.shape(positions)[-1])
+        imageSpacePos = (positions[:, :2] - self.xyOffset) / self.xyScale
+        x0 = np.clip(np.floor(imageSpacePos[:, 0]).astype(np.intp), 0, max(0, self.imageWidth - 2))
+        y0 = np.clip(np.floor(imageSpacePos[:, 1]).astype(np.intp), 0, max(0, self.imageHeight - 2))
+        fx = np.clip(imageSpacePos[:, 0] - x0, 0.0, 1.0)
+        fy = np.clip(imageSpacePos[:, 1] - y0, 0.0, 1.0)
+        return imageSpacePos, x0, y0, fx, fy
+
+    # Returns the four heights around each position, (h00, h10, h01, h11) with h10 being one pixel along x.
+    def _corners(self, x0, y0):
+        x1 = np.minimum(x0 + 1, self.imageWidth - 1)
+        y1 = np.minimum(y0 + 1, self.imageHeight - 1)
+        h = self.heights
+        return h[y0, x0], h[y0, x1], h[y1, x0], h[y1, x1]
+
+    # The material of the pixel each position is in, like the original nearest pixel lookup
+    def _materials(self, imageSpacePos):
+        x = np.clip(imageSpacePos[:, 0].astype(np.intp), 0, self.imageWidth - 1)
+        y = np.clip(imageSpacePos[:, 1].astype(np.intp), 0, self.imageHeight - 1)
+        return self.materials[y, x]
+
+    # Returns (heights, materials) for an (N, 2) array of positions, as a float32 and a uint8 array of length N.
+    def sample(self, positions):
+        imageSpacePos, x0, y0, fx, fy = self._toImageSpace(positions)
+        h00, h10, h01, h11 = self._corners(x0, y0)
+        bottom = h00 + (h10 - h00) * fx
+        top = h01 + (h11 - h01) * fx
+        heights = (bottom + (top - bottom) * fy).astype(np.float32)
+        return heights, self._materials(imageSpacePos)
+
+    def getHeights(self, positions):
+        return self.sample(positions)[0]
+
+    def getMaterials(self, positions):
+        return self._materials(self._toImageSpace(positions)[0])
+
+    # Returns the (N, 3) unit surface normals of the bilinear height field at the positions
+    def getNormals(self, positions):
+        _, x0, y0, fx, fy = self._toImageSpace(positions)
+        h00, h10, h01, h11 = self._corners(x0, y0)
+        normals = np.empty((len(x0), 3), dtype=np.float32)
+        normals[:, 0] = -((h10 - h00) * (1.0 - fy) + (h11 - h01) * fy) / self.xyScale
+        normals[:, 1] = -((h01 - h00) * (1.0 - fx) + (h11 - h10) * fx) / self.xyScale
+        normals[:, 2] = 1.0
+        return normals / np.linalg.norm(normals, axis=1, keepdims=True)
+
+    # Single position versions, using plain python arithmetic which is much cheaper than numpy for one value.
+    # Returns (height, material).
+    def sampleOne(self, x, y):
+        u = (x - self.xyOffset[0]) / self.xyScale
+        v = (y - self.xyOffset[1]) / self.xyScale
+        x0 = min(max(int(math.floor(u)), 0), max(0, self.imageWidth - 2))
+        y0 = min(max(int(math.floor(v)), 0), max(0, self.imageHeight - 2))
+        x1 = min(x0 + 1, self.imageWidth - 1)
+        y1 = min(y0 + 1, self.imageHeight - 1)
+        fx = min(max(u - x0, 0.0), 1.0)
+        fy = min(max(v - y0, 0.0), 1.0)
+        h = self.heights
+        bottom = float(h[y0, x0]) * (1.0 - fx) + float(h[y0, x1]) * fx
+        top = float(h[y1, x0]) * (1.0 - fx) + float(h[y1, x1]) * fx
+        material = int(self.materials[min(max(int(v), 0), self.imageHeight - 1),
+                                      min(max(int(u), 0), self.imageWidth - 1)])
+        return bottom * (1.0 - fy) + top * fy, material
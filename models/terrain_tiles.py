@@ -0,0 +1,248 @@
+"""Splits the terrain grid into square tiles that can be culled against the view frustum, and drawn at a level
+of detail that depends on the distance to the viewer (geomipmapping).
+
+The terrain vertices stay in one vertex buffer (one vertex per map pixel, row-major), and each tile is drawn
+from a shared index pattern, where the indices are relative to the first vertex of the tile. The tile origin
+is passed as the base vertex of the draw, so all the tiles with the same size share the same indices. Tiles
+along the top and right edges may be smaller than the rest when the map size is not a multiple of the tile size.
+
+Level of detail 'l' uses every (2^l)th vertex in each direction. Tiles further from the viewer get coarser
+levels, and the levels of neighbouring tiles are limited to differ by at most one. Where a tile borders a
+coarser tile, its edge vertices are snapped to the vertices of the coarser edge, which closes the cracks
+(the triangles that collapse are left out). There is an index pattern for each tile size, level and mask of
+edges with coarser neighbours, all stored in the one index buffer.
+
+Each frame the bounding boxes of the tiles are tested against the frustum planes in one go (see
+lu.aabbsInFrustum), and the visible tiles are drawn with a single glMultiDrawElementsBaseVertex call.
+"""
+
+import numpy as np
+from OpenGL.GL import *
+
+from utils import lab_utils as lu
+
+
+# The number of quads along each side of a tile
+TERRAIN_TILE_SIZE = 32
+# Levels 0 to NUM_LOD_LEVELS - 1, i.e., vertex strides 1, 2, 4 and 8
+NUM_LOD_LEVELS = 4
+
+# Bits of the edge masks, set for the edges where the neighbouring tile is one level coarser
+EDGE_LEFT = 1
+EDGE_RIGHT = 2
+EDGE_BOTTOM = 4
+EDGE_TOP = 8
+
+
+# Returns the sample positions along a tile edge of the given length for the stride, the last vertex is always
+# included, even when the length is not a multiple of the stride.
+def _edgeSamples(length, stride):
+    return np.append(np.arange(0, length, stride), length)
+
+
+# Moves each of the positions down to the closest of the samples (which must include 0)
+def _snapDown(positions, samples):
+    return samples[np.searchsorted(samples, positions, side="right") - 1]
+
+
+# Returns the triangle indices for a tile of (tileWidth x tileHeight) quads at a level of detail, relative to the lower
+# left vertex of the tile, with rowPitch vertices between rows. The edges set in coarserEdges (EDGE_LEFT etc.) are
+# stitched to a neighbour one level coarser. At level 0 and without coarser edges, the triangles are the same as
+# those built by buildTerrainMesh.
+def makeTileIndices(tileWidth, tileHeight, rowPitch, level=0, coarserEdges=0):
+    stride = 1 << level
+    xs = _edgeSamples(tileWidth, stride)
+    ys = _edgeSamples(tileHeight, stride)
+    x, y = np.meshgrid(xs, ys)
+
+    # Snap the vertices along the stitched edges to the samples of the coarser level
+    if coarserEdges & (EDGE_LEFT | EDGE_RIGHT):
+        coarseYs = _edgeSamples(tileHeight, 2 * stride)
+        if coarserEdges & EDGE_LEFT:
+            y[:, 0] = _snapDown(y[:, 0], coarseYs)
+        if coarserEdges & EDGE_RIGHT:
+            y[:, -1] = _snapDown(y[:, -1], coarseYs)
+    if coarserEdges & (EDGE_BOTTOM | EDGE_TOP):
+        coarseXs = _edgeSamples(tileWidth, 2 * stride)
+        if coarserEdges & EDGE_BOTTOM:
+            x[0, :] = _snapDown(x[0, :], coarseXs)
+        if coarserEdges & EDGE_TOP:
+            x[-1, :] = _snapDown(x[-1, :], coarseXs)
+
+    vertices = (y * rowPitch + x).astype(np.uint32)
+    c = vertices[:-1, :-1].ravel()
+    right = vertices[:-1, 1:].ravel()
+    up = vertices[1:, :-1].ravel()
+    upRight = vertices[1:, 1:].ravel()
+    triangles = np.stack([np.stack([c, right, up], axis=1),
+                          np.stack([up, right, upRight], axis=1)], axis=1).reshape(-1, 3)
+
+    # Drop the triangles that collapsed when snapping
+    if coarserEdges:
+        triangles = triangles[(triangles[:, 0] != triangles[:, 1]) &
+                              (triangles[:, 1] != triangles[:, 2]) &
+                              (triangles[:, 2] != triangles[:, 0])]
+    return triangles.ravel()
+
+
+# Returns the (numTiles, ) start and end vertex of each tile along one axis with numVertices vertices. Neighbouring
+# tiles share the vertices on the edge between them.
+def _tileRanges(numVertices, tileSize):
+    starts = np.arange(0, max(1, numVertices - 1), tileSize)
+    ends = np.minimum(starts + tileSize, numVertices - 1)
+    return starts, ends
+
+
+class TerrainTiles:
+    tileSize = TERRAIN_TILE_SIZE
+    numLevels = NUM_LOD_LEVELS
+    # Tiles closer than lodDistance (in world units) to the viewer are drawn at full detail, and the level goes up by
+    # one each time the distance doubles.
+    lodEnabled = True
+    lodDistance = 250.0
+
+    numTilesX = 0
+    numTilesY = 0
+    numTiles = 0
+    # Per tile arrays, in row-major tile order
+    tileStarts = None  # (numTiles, 2) first vertex column and row
+    tileSizes = None  # (numTiles, 2) width and height in quads
+    tileSizeIndices = None  # (numTiles, ) index of the tile size in the pattern tables
+    baseVertices = None  # (numTiles, ) index of the first vertex
+    boundsMin = None  # (numTiles, 3) world space bounding box
+    boundsMax = None
+    # (numTileSizes, numLevels, 16) tables of the byte offset and index count of each pattern in the index buffer,
+    # indexed by tile size, level and edge mask.
+    patternOffsets = None
+    patternCounts = None
+    # All the index patterns
+    indices = None
+
+    # Counters for the last call to render
+    numVisibleTiles = 0
+    numTrianglesSubmitted = 0
+    numVisibleTilesPerLevel = [0] * NUM_LOD_LEVELS
+
+    # positions is the (imageWidth * imageHeight, 3) array of terrain vertices (see TerrainMesh)
+    def __init__(self, positions, imageWidth, imageHeight, tileSize=TERRAIN_TILE_SIZE, numLevels=NUM_LOD_LEVELS):
+        self.tileSize = tileSize
+        self.numLevels = numLevels
+        self.imageWidth = imageWidth
+        grid = np.asarray(positions).reshape(imageHeight, imageWidth, 3)
+
+        xStarts, xEnds = _tileRanges(imageWidth, tileSize)
+        yStarts, yEnds = _tileRanges(imageHeight, tileSize)
+        self.numTilesX = len(xStarts)
+        self.numTilesY = len(yStarts)
+        self.numTiles = self.numTilesX * self.numTilesY
+
+        tileY, tileX = np.meshgrid(np.arange(self.numTilesY), np.arange(self.numTilesX), indexing="ij")
+        tileX = tileX.ravel()
+        tileY = tileY.ravel()
+        self.tileStarts = np.stack([xStarts[tileX], yStarts[tileY]], axis=1)
+        tileEnds = np.stack([xEnds[tileX], yEnds[tileY]], axis=1)
+        self.tileSizes = tileEnds - self.tileStarts
+        self.baseVertices = (self.tileStarts[:, 1] * imageWidth + self.tileStarts[:, 0]).astype(np.int32)
+
+        # The height range of each tile, including the shared edge vertices, reduced first over the columns and then
+        # the rows of each tile.
+        heights = grid[:, :, 2]
+        colMin = np.minimum(np.minimum.reduceat(heights, xStarts, axis=1), heights[:, xEnds])
+        colMax = np.maximum(np.maximum.reduceat(heights, xStarts, axis=1), heights[:, xEnds])
+        tileMin = np.minimum(np.minimum.reduceat(colMin, yStarts, axis=0), colMin[yEnds, :])
+        tileMax = np.maximum(np.maximum.reduceat(colMax, yStarts, axis=0), colMax[yEnds, :])
+
+        self.boundsMin = np.empty((len(tileX), 3), dtype=np.float32)
+        self.boundsMax = np.empty((len(tileX), 3), dtype=np.float32)
+        self.boundsMin[:, 0] = grid[0, xStarts[tileX], 0]
+        self.boundsMax[:, 0] = grid[0, xEnds[tileX], 0]
+        self.boundsMin[:, 1] = grid[yStarts[tileY], 0, 1]
+        self.boundsMax[:, 1] = grid[yEnds[tileY], 0, 1]
+        self.boundsMin[:, 2] = tileMin.ravel()
+        self.boundsMax[:, 2] = tileMax.ravel()
+
+        self.buildIndexPatterns()
+
+    # Builds the index patterns for each distinct tile size, level and edge mask. The coarsest level never has a
+    # coarser neighbour, so it only needs the pattern without stitching.
+    def buildIndexPatterns(self):
+        tileSizes, self.tileSizeIndices = np.unique(self.tileSizes, axis=0, return_inverse=True)
+        self.tileSizeIndices = self.tileSizeIndices.ravel()
+        self.patternOffsets = np.zeros((len(tileSizes), self.numLevels, 16), dtype=np.intp)
+        self.patternCounts = np.zeros((len(tileSizes), self.numLevels, 16), dtype=np.int32)
+        patterns = []
+        offset = 0
+        for sizeIndex, (tileWidth, tileHeight) in enumerate(tileSizes):
+            for level in range(self.numLevels):
+                for mask in range(16 if level < self.numLevels - 1 else 1):
+                    pattern = makeTileIndices(tileWidth, tileHeight, self.imageWidth, level, mask)
+                    self.patternOffsets[sizeIndex, level, mask] = offset * pattern.itemsize
+                    self.patternCounts[sizeIndex, level, mask] = len(pattern)
+                    patterns.append(pattern)
+                    offset += len(pattern)
+        self.indices = np.concatenate(patterns)
+
+    # Creates the index buffer and attaches it to the vertex array object
+    def createIndexBuffer(self, vertexArrayObject):
+        return lu.createAndAddIndexArray(vertexArrayObject, self.indices)
+
+    # Returns a bool array with the tiles that are (at least partially) inside the frustum of the worldToClipTransform
+    def findVisibleTiles(self, worldToClipTransform):
+        return lu.aabbsInFrustum(lu.extractFrustumPlanes(worldToClipTransform), self.boundsMin, self.boundsMax)
+
+    # Returns the level and the mask of edges with coarser neighbours for every tile, for a viewer at viewPosition.
+    def selectLevels(self, viewPosition):
+        # Distance from the viewer to the closest point of each bounding box
+        p = np.asarray(viewPosition, dtype=np.float32)[:3]
+        distances = np.linalg.norm(np.clip(p, self.boundsMin, self.boundsMax) - p, axis=1)
+        levels = np.floor(np.log2(np.maximum(distances / self.lodDistance, 0.5))).astype(np.int32) + 1
+        levels = np.minimum(levels, self.numLevels - 1).reshape(self.numTilesY, self.numTilesX)
+
+        # Limit the difference to neighbouring tiles to one level, by refining the tiles next to much finer ones.
+        # Each pass can only lower levels, and a change spreads by one tile per pass.
+        for _ in range(self.numLevels - 1):
+            limited = levels.copy()
+            np.minimum(limited[:, 1:], levels[:, :-1] + 1, out=limited[:, 1:])
+            np.minimum(limited[:, :-1], levels[:, 1:] + 1, out=limited[:, :-1])
+            np.minimum(limited[1:, :], levels[:-1, :] + 1, out=limited[1:, :])
+            np.minimum(limited[:-1, :], levels[1:, :] + 1, out=limited[:-1, :])
+            if np.array_equal(limited, levels):
+                break
+            levels = limited
+
+        masks = np.zeros_like(levels)
+        masks[:, 1:] |= (levels[:, :-1] > levels[:, 1:]) * EDGE_LEFT
+        masks[:, :-1] |= (levels[:, 1:] > levels[:, :-1]) * EDGE_RIGHT
+        masks[1:, :] |= (levels[:-1, :] > levels[1:, :]) * EDGE_BOTTOM
+        masks[:-1, :] |= (levels[1:, :] > levels[:-1, :]) * EDGE_TOP
+        return levels.ravel(), masks.ravel()
+
+    # Draws the tiles visible from the view, or all the tiles if worldToClipTransform is None. The level of detail is
+    # picked from the distance to viewPosition, unless it is None or lodEnabled is False, in which case all the tiles
+    # are drawn at full detail. The vertex array object with the terrain vertices and index buffer must be bound.
+    def render(self, worldToClipTransform, viewPosition=None):
+        if worldToClipTransform is None:
+            visible = np.arange(self.numTiles)
+        else:
+            visible = np.flatnonzero(self.findVisibleTiles(worldToClipTransform))
+        self.numVisibleTiles = len(visible)
+        if not len(visible):
+            self.numTrianglesSubmitted = 0
+            self.numVisibleTilesPerLevel = [0] * self.numLevels
+            return
+
+        if self.lodEnabled and viewPosition is not None:
+            levels, masks = self.selectLevels(viewPosition)
+            levels = levels[visible]
+            masks = masks[visible]
+        else:
+            levels = np.zeros(len(visible), dtype=np.int32)
+            masks = levels
+        self.numVisibleTilesPerLevel = np.bincount(levels, minlength=self.numLevels).tolist()
+
+        sizeIndices = self.tileSizeIndices[visible]
+        counts = self.patternCounts[sizeIndices, levels, masks]
+        self.numTrianglesSubmitted = int(counts.sum()) // 3
+        glMultiDrawElementsBaseVertex(GL_TRIANGLES, counts, GL_UNSIGNED_INT,
+                                      self.patternOffsets[sizeIndices, levels, masks], len(visible),
+                                      np.ascontiguousarray(self.baseVertices[visible]))
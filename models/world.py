@@ -2,6 +2,7 @@ from utils.lab_utils import vec3
 
 from models.terrain import Terrain
 from models.racer import Racer
+from models.racer_fleet import RacerFleet
 
 
 class World:
@@ -28,6 +29,10 @@ class World:
 
     terrain: Terrain = None
     racer: Racer = None
+    # Optional AI racers, simulated and drawn together
+    fleet: RacerFleet = None
+    # InstancedProps placed on the terrain, e.g., trees and rocks
+    props = []
 
     #
     # Key-frames for the sun light and ambient, picked by hand-waving to look ok.
@@ -9,15 +9,15 @@ in VertexData
 };
 
 // Material properties uniform buffer, required by OBJModel.
-// 'MaterialProperties' must be bound to a uniform buffer, OBJModel::setDefaultUniformBindings is of help!
-//layout(std140) uniform MaterialProperties
-//{
-uniform vec3 material_diffuse_color;
-uniform float material_alpha;
-uniform vec3 material_specular_color;
-uniform vec3 material_emissive_color;
-uniform float material_specular_exponent;
-//};
+// 'MaterialProperties' is bound to the right uniform buffer binding point by lab_utils.buildShader
+layout(std140) uniform MaterialProperties
+{
+	vec3 material_diffuse_color;
+	float material_alpha;
+	vec3 material_specular_color;
+	vec3 material_emissive_color;
+	float material_specular_exponent;
+};
 // Textures set by OBJModel (names must be bound to the right texture unit, OBJModel::setDefaultUniformBindings helps with that.
 uniform sampler2D diffuse_texture;
 uniform sampler2D opacity_texture;
@@ -1,11 +1,26 @@
-uniform mat4 worldToViewTransform;
+// Per-frame view and lighting parameters, uploaded once per frame by RenderingSystem.updateFrameUniforms (see utils/helper.py).
+layout(std140) uniform FrameUniforms
+{
+    mat4 worldToViewTransform;
+    mat4 viewToClipTransform;
+    vec3 viewSpaceLightPosition;
+    vec3 globalAmbientLight;
+    vec3 sunLightColour;
+};
+
+// Material properties set by OBJModel, packed into a uniform buffer with one block per material.
+layout(std140) uniform MaterialProperties
+{
+    vec3 material_diffuse_color;
+    float material_alpha;
+    vec3 material_specular_color;
+    vec3 material_emissive_color;
+    float material_specular_exponent;
+};
+
 uniform mat4 viewSpaceToSmTextureSpace;
 uniform sampler2DShadow shadowMapTexture;
 
-uniform vec3 viewSpaceLightPosition;
-uniform vec3 sunLightColour;
-uniform vec3 globalAmbientLight;
-
 vec3 toSrgb(vec3 color)
 {
   return pow(color, vec3(1.0 / 2.2));
@@ -7,13 +7,6 @@ in VertexData
     vec2 v2f_texCoord;
 };
 
-// Material properties set by OBJModel.
-uniform vec3 material_diffuse_color;
-uniform float material_alpha;
-uniform vec3 material_specular_color;
-uniform vec3 material_emissive_color;
-uniform float material_specular_exponent;
-
 // Textures set by OBJModel
 uniform sampler2D diffuse_texture;
 uniform sampler2D opacity_texture;
@@ -0,0 +1,37 @@
+#version 330
+
+in vec3 positionAttribute;
+in vec3	normalAttribute;
+in vec2	texCoordAttribute;
+// Per-instance model to world transform, one column per attribute location (see models/props.py).
+in mat4 instanceTransformAttribute;
+
+// Per-frame view parameters, uploaded once per frame by RenderingSystem.updateFrameUniforms (see utils/helper.py).
+// Must match the declaration in the common fragment shader.
+layout(std140) uniform FrameUniforms
+{
+    mat4 worldToViewTransform;
+    mat4 viewToClipTransform;
+    vec3 viewSpaceLightPosition;
+    vec3 globalAmbientLight;
+    vec3 sunLightColour;
+};
+
+out VertexData
+{
+    vec3 v2f_viewSpaceNormal;
+    vec3 v2f_viewSpacePosition;
+    vec2 v2f_texCoord;
+};
+
+void main()
+{
+    mat4 modelToViewTransform = worldToViewTransform * instanceTransformAttribute;
+    vec4 viewSpacePosition = modelToViewTransform * vec4(positionAttribute, 1.0);
+    gl_Position = viewToClipTransform * viewSpacePosition;
+    // The instance transforms only contain rotation, uniform scaling and translation, so the upper 3x3 can be used
+    // to transform the normal (the scale goes away when normalizing).
+    v2f_viewSpaceNormal = normalize(mat3(modelToViewTransform) * normalAttribute);
+    v2f_viewSpacePosition = viewSpacePosition.xyz;
+    v2f_texCoord = texCoordAttribute;
+}
@@ -5,9 +5,13 @@ in vec3 positionAttribute;
 in vec3	normalAttribute;
 in vec2	texCoordAttribute;
 
-uniform mat4 modelToClipTransform;
-uniform mat4 modelToViewTransform;
-uniform mat3 modelToViewNormalTransform;
+// Per-object transforms, set by RenderingSystem.setCommonUniforms (see utils/helper.py).
+layout(std140) uniform ObjectUniforms
+{
+    mat4 modelToClipTransform;
+    mat4 modelToViewTransform;
+    mat3 modelToViewNormalTransform;
+};
 
 // Out variables decalred in a vertex shader can be accessed in the subsequent stages.
 // For a pixel shader the variable is interpolated (the type of interpolation can be modified, try placing 'flat' in front, and also in the fragment shader!).
@@ -15,11 +15,10 @@ in VertexData
 uniform float terrainHeightScale;
 uniform float terrainTextureXyScale;
 
-uniform sampler2D ourTexture;
-uniform sampler2D rockHighTexture;
-uniform sampler2D slopeTexture;
-uniform sampler2D pavingTexture;
-uniform sampler2D mapData;
+// The material layers (see Terrain.materialLayers), and the splat map that says which layer is blended over the
+// base layer (layer 0) where: the index of the layer is in the red channel and the weight in the green.
+uniform sampler2DArray materialTextures;
+uniform sampler2D splatMap;
 
 out vec4 fragmentColor;
 
@@ -29,33 +28,6 @@ void main()
     // grass and use as material colour.
     vec2 textCoord = vec2(v2f_worldSpacePosition.x * terrainTextureXyScale, v2f_worldSpacePosition.y * terrainTextureXyScale);
 
-    float height = v2f_height/terrainHeightScale;
-    float ratio = 0.0;
-
-    if ( height > 0.8)
-    {
-        ratio = height;
-    }
-
-    vec4 mixedTexture = mix(
-        texture(ourTexture, textCoord),
-        texture(rockHighTexture, textCoord),
-        ratio
-    );
-    vec3 materialColour = mixedTexture.xyz;
-
-    // Now check viewspace normal to see if the texture should be slope instead
-    float cosine = dot(v2f_normalIn, 
-            vec3(v2f_normalIn.x, 0.0, v2f_normalIn.z)
-        );
-    if (cosine < 0.6) {
-            materialColour = mix(
-            texture(ourTexture, textCoord),
-            texture(slopeTexture, textCoord),
-            0.3 * cosine
-        ).xyz;
-    }
-
     // Now pick material color based on map data
     // get normalised texture coordinates first
     vec2 normalized_text_coord = vec2(
@@ -65,26 +37,21 @@ void main()
     normalized_text_coord = (normalized_text_coord - 
         v2f_xyOffset * v2f_xyNormScale
     );
-    float blue_channel = texture(mapData, normalized_text_coord).z;
-    if (blue_channel > 0.1) {
-        materialColour = mix(
-            texture(ourTexture, textCoord),
-            texture(pavingTexture, textCoord),
-            blue_channel
-        ).xyz;
-        // materialColour = texture(pavingTexture, textCoord).xyz;
-    }
-    // vec3 materialColour = texture(ourTexture, textCoord).xyz;
 
+    // The layer index must not be filtered, so it is fetched from the nearest texel, while the weight is filtered
+    // to blend smoothly. That is four texture fetches, whatever the number of layers.
+    ivec2 splatSize = textureSize(splatMap, 0);
+    ivec2 splatTexel = clamp(ivec2(normalized_text_coord * vec2(splatSize)), ivec2(0), splatSize - 1);
+    float overlayLayer = texelFetch(splatMap, splatTexel, 0).r * 255.0;
+    float overlayWeight = texture(splatMap, normalized_text_coord).g;
+
+    vec3 materialColour = mix(
+        texture(materialTextures, vec3(textCoord, 0.0)).xyz,
+        texture(materialTextures, vec3(textCoord, overlayLayer)).xyz,
+        overlayWeight
+    );
 
     vec3 reflectedLight = computeShading(materialColour, v2f_viewSpacePosition, 
         v2f_viewSpaceNormal, viewSpaceLightPosition, sunLightColour);
     fragmentColor = vec4(toSrgb(reflectedLight), 1.0);
-
-
-    // try to output fragment color as the terrain data first
-    
-
-    // fragmentColor = vec4(texture(mapData, normalized_text_coord).xyz, 1.0);
-
-}
\ No newline at end of file
+}
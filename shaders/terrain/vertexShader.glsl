@@ -2,9 +2,13 @@
 in vec3 positionIn;
 in vec3 normalIn;
 
-uniform mat4 modelToClipTransform;
-uniform mat4 modelToViewTransform;
-uniform mat3 modelToViewNormalTransform;
+// Per-object transforms, set by RenderingSystem.setCommonUniforms (see utils/helper.py).
+layout(std140) uniform ObjectUniforms
+{
+    mat4 modelToClipTransform;
+    mat4 modelToViewTransform;
+    mat3 modelToViewNormalTransform;
+};
 
 uniform float terrainHeightScale;
 uniform float terrainTextureXyScale;
@@ -1,18 +1,30 @@
+import ctypes
 import os
-from ctypes import c_float
 
+import imgui
+import numpy as np
 from OpenGL.GL import *
-from PIL import Image
 
 from utils import lab_utils as lu
+from utils import obj_loader
+from utils.profiler import g_profiler
+from utils.shader_cache import g_shaderCache
+from utils.texture_manager import g_textureManager, TextureEntry
+from utils.uniform_buffer import UniformBlockLayout, UniformBuffer
+from utils.vertex_format import VertexFormat
 
 
 DEFAULT_VERTEX_SHADER_FILE = 'shaders/default/vertexShader.glsl'
 DEFAULT_FRAGMENT_SHADER_FILE = 'shaders/default/fragmentShader.glsl'
 
-
-def flatten(*lll):
-    return [u for ll in lll for l in ll for u in l]
+# The material properties used by the fragment shaders, must match the 'MaterialProperties' block in the shaders.
+MATERIAL_PROPERTIES_LAYOUT = UniformBlockLayout("MaterialProperties", [
+    ("vec3", "material_diffuse_color"),
+    ("float", "material_alpha"),
+    ("vec3", "material_specular_color"),
+    ("vec3", "material_emissive_color"),
+    ("float", "material_specular_exponent"),
+], lu.UBS_MaterialProperties)
 
 
 def bindTexture(texUnit, textureId, defaultTexture):
@@ -38,12 +50,14 @@ class ObjModel:
     TU_Normal = 3
     TU_Max = 4
 
-    # Load the code for default shaders
-    with open(DEFAULT_VERTEX_SHADER_FILE) as file:
-        defaultVertexShader = ''.join(file.readlines())
+    # Print the vertex counts of each model as it is loaded (the game sets this for --profile-startup)
+    verbose = False
+    # The OBJ file the model was loaded from (models made with loadObj have none)
+    fileName = "(obj data)"
 
-    with open(DEFAULT_FRAGMENT_SHADER_FILE) as file:
-        defaultFragmentShader = ''.join(file.readlines())
+    # The code of the default shaders, read by getDefaultShaderSources when the first model is created
+    defaultVertexShader = None
+    defaultFragmentShader = None
 
     def __init__(self, fileName):
         self.defaultTextureOne = glGenTextures(1);
@@ -58,65 +72,48 @@ class ObjModel:
         self.overrideDiffuseTextureWithDefault = False
         self.load(fileName)
 
-        self.defaultShader = lu.buildShader(self.defaultVertexShader, self.defaultFragmentShader,
-                                            ObjModel.getDefaultAttributeBindings())
+        # All the models share the one default shader program
+        vertexShader, fragmentShader = ObjModel.getDefaultShaderSources()
+        self.defaultShader = g_shaderCache.buildShader(vertexShader, fragmentShader,
+                                                       ObjModel.getDefaultAttributeBindings())
         glUseProgram(self.defaultShader)
         ObjModel.setDefaultUniformBindings(self.defaultShader)
         glUseProgram(0)
 
     def load(self, fileName):
+        self.fileName = fileName
         basePath, _ = os.path.split(fileName)
-        with open(fileName, "r") as inFile:
-            self.loadObj(inFile.readlines(), basePath)
+        self.loadMeshData(obj_loader.loadMesh(fileName), basePath)
+        if ObjModel.verbose:
+            print("    Loaded model '%s': %s" % (fileName, self.getVertexCountText()))
+
+    # The number of vertices and how many were saved by merging the corners that share all their attributes
+    def getVertexCountText(self):
+        return "%d vertices (%d before de-duplication, %0.1f%% saved)" % (
+            self.numVerts, self.numCornerVerts, 100.0 * (1.0 - self.numVerts / max(1, self.numCornerVerts)))
+
+    def drawUi(self):
+        imgui.label_text(os.path.basename(self.fileName), self.getVertexCountText())
 
     def loadObj(self, objLines, basePath):
-        positions = []
-        normals = []
-        uvs = []
-        materialChunks = []
+        self.loadMeshData(obj_loader.parseObj(objLines), basePath)
+
+    # Sets up the materials, chunks and vertex buffers from an ObjMeshData (see utils/obj_loader.py)
+    def loadMeshData(self, mesh, basePath):
         materials = {}
+        for materialLibrary in mesh.materialLibraries:
+            materials.update(self.loadMaterials(os.path.join(basePath, materialLibrary), basePath))
 
-        for l in objLines:
-            # 1 standardize line
-            if len(l) > 0 and l[:1] != "#":
-                tokens = l.split()
-                if len(tokens):
-                    if tokens[0] == "mtllib":
-                        assert len(tokens) >= 2
-                        materialName = " ".join(tokens[1:])
-                        materials = self.loadMaterials(os.path.join(basePath, materialName), basePath)
-                    if tokens[0] == "usemtl":
-                        assert len(tokens) >= 2
-                        materialName = " ".join(tokens[1:])
-                        if len(materialChunks) == 0 or materialChunks[-1][0] != materialName:
-                            materialChunks.append([materialName, []])
-                    elif tokens[0] == "v":
-                        assert len(tokens[1:]) >= 3
-                        positions.append([float(v) for v in tokens[1:4]])
-                    elif tokens[0] == "vn":
-                        assert len(tokens[1:]) >= 3
-                        normals.append([float(v) for v in tokens[1:4]])
-                    elif tokens[0] == "vt":
-                        assert len(tokens[1:]) >= 2
-                        uvs.append([float(v) for v in tokens[1:3]])
-                    elif tokens[0] == "f":
-                        materialChunks[-1][1] += self.parseFace(tokens[1:])
-        self.numVerts = 0
-        for mc in materialChunks:
-            self.numVerts += len(mc[1])
-
-        self.positions = [None] * self.numVerts
-        self.normals = [None] * self.numVerts
-        self.uvs = [[0.0, 0.0]] * self.numVerts
-        self.tangents = [[0.0, 1.0, 0.0]] * self.numVerts
-        self.bitangents = [[1.0, 0.0, 0.0]] * self.numVerts
-        self.chunks = []
+        self.numVerts = len(mesh.positions)
+        self.numCornerVerts = mesh.numCornerVertices
 
-        start = 0
-        end = 0
+        self.positions = mesh.positions
+        self.normals = mesh.normals
+        self.uvs = mesh.uvs
+        self.chunks = []
 
-        for matId, tris in materialChunks:
-            material = materials[matId]
+        for matId, chunkOffset, chunkCount in mesh.chunks:
+            material = materials[matId] if matId in materials else self.makeDefaultMaterial()
             renderFlags = 0
             if material["alpha"] != 1.0:
                 renderFlags |= self.RF_Transparent
@@ -124,64 +121,95 @@ class ObjModel:
                 renderFlags |= self.RF_AlphaTested
             else:
                 renderFlags |= self.RF_Opaque
-            start = end
-            end = start + int(len(tris) / 3)
-
-            chunkOffset = start * 3
-            chunkCount = len(tris)
-
-            # De-index mesh and (TODO) compute tangent frame
-            for k in range(0, len(tris), 3):
-                for j in [0, 1, 2]:
-                    p = positions[tris[k + j][0]]
-                    oo = chunkOffset + k + j
-                    self.positions[oo] = p
-                    if tris[k + j][1] != -1:
-                        self.uvs[oo] = uvs[tris[k + j][1]]
-                    self.normals[oo] = normals[tris[k + j][2]]
             self.chunks.append((material, chunkOffset, chunkCount, renderFlags))
 
+        # Pack the properties of all the materials into one uniform buffer, the 'offset' of each material is the index of
+        # its block in the buffer.
+        usedMaterials = list({id(chunk[0]): chunk[0] for chunk in self.chunks}.values())
+        self.materialUniforms = UniformBuffer(MATERIAL_PROPERTIES_LAYOUT, GL_STATIC_DRAW, max(1, len(usedMaterials)))
+        for index, material in enumerate(usedMaterials):
+            material["offset"] = index
+            for k in ["diffuse", "specular", "emissive"]:
+                self.materialUniforms.set("material_%s_color" % k, material["color"][k], index)
+            self.materialUniforms.set("material_specular_exponent", material["specularExponent"], index)
+            self.materialUniforms.set("material_alpha", material["alpha"], index)
+        self.materialUniforms.upload()
+
+        indices = self.batchChunks(mesh.indices)
+
+        # All attributes go into one interleaved vertex buffer. The tangent frame is not computed (yet), so the
+        # tangent and bitangent attributes are left out along with anything else the mesh doesn't have.
+        self.vertexFormat = VertexFormat.forArrays([
+            ("position", self.AA_Position, self.positions),
+            ("normal", self.AA_Normal, self.normals),
+            ("uv", self.AA_TexCoord, self.uvs),
+        ])
         self.vertexArrayObject = glGenVertexArrays(1)
-        glBindVertexArray(self.vertexArrayObject)
+        self.vertexBuffer = self.vertexFormat.createVertexBuffer(self.vertexArrayObject, {
+            "position": self.positions,
+            "normal": self.normals,
+            "uv": self.uvs,
+        })
 
-        def createBindVertexAttribArrayFloat(data, attribLoc):
-            bufId = glGenBuffers(1)
-            glBindBuffer(GL_ARRAY_BUFFER, bufId)
-            flatData = flatten(data)
-            data_buffer = (c_float * len(flatData))(*flatData)
-            glBufferData(GL_ARRAY_BUFFER, data_buffer, GL_STATIC_DRAW)
-            glVertexAttribPointer(attribLoc, int(len(flatData) / len(data)), GL_FLOAT, GL_FALSE, 0, None)
-            glEnableVertexAttribArray(attribLoc)
-            return bufId
-
-        self.positionBuffer = createBindVertexAttribArrayFloat(self.positions, self.AA_Position)
-        self.normalBuffer = createBindVertexAttribArrayFloat(self.normals, self.AA_Normal)
-        self.uvBuffer = createBindVertexAttribArrayFloat(self.uvs, self.AA_TexCoord)
-        self.tangentBuffer = createBindVertexAttribArrayFloat(self.tangents, self.AA_Tangent)
-        self.biTangentBuffer = createBindVertexAttribArrayFloat(self.bitangents, self.AA_Bitangent)
+        glBindVertexArray(self.vertexArrayObject)
+        # The element buffer binding is stored in the VAO, so it must stay bound until the VAO is unbound
+        self.indexType = GL_UNSIGNED_SHORT if indices.dtype == np.uint16 else GL_UNSIGNED_INT
+        self.indexBuffer = glGenBuffers(1)
+        self.indices = lu.uploadBufferData(GL_ELEMENT_ARRAY_BUFFER, self.indexBuffer, indices, indices.dtype)
 
-        glBindBuffer(GL_ARRAY_BUFFER, 0)
         glBindVertexArray(0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
 
     def parseFloats(self, tokens, minNum):
         assert len(tokens) >= minNum
         return [float(v) for v in tokens[0:minNum]]
 
-    def parseFaceIndexSet(self, s):
-        inds = s.split('/')
-        assert len(inds) == 3
-        return [int(ind) - 1 if ind != '' else -1 for ind in inds]
-
-    def parseFace(self, tokens):
-        assert len(tokens) >= 3
-        result = []
-        v0 = self.parseFaceIndexSet(tokens[0])
-        v1 = self.parseFaceIndexSet(tokens[1])
-        for t in tokens[2:]:
-            v2 = self.parseFaceIndexSet(t)
-            result += [v0, v1, v2]
-            v1 = v2
-        return result
+    # Sorts the chunks by render flags (opaque, then alpha tested, then transparent) and material, and reorders the
+    # indices to match, such that all the chunks that share a material end up next to each other and can be merged
+    # into a single draw range. Transparent chunks keep their order in the file, since the result of blending depends
+    # on the draw order, so only neighbours that already share a material are merged. Replaces self.chunks with the
+    # merged batches and returns the reordered indices.
+    def batchChunks(self, indices):
+        renderFlagOrder = {self.RF_Opaque: 0, self.RF_AlphaTested: 1, self.RF_Transparent: 2}
+        sortedChunks = sorted(self.chunks, key=lambda ch: (renderFlagOrder[ch[3]],
+                                                           ch[1] if ch[3] == self.RF_Transparent else ch[0]["offset"]))
+
+        batches = []
+        batchedIndices = []
+        offset = 0
+        for material, chunkOffset, chunkCount, renderFlags in sortedChunks:
+            batchedIndices.append(indices[chunkOffset:chunkOffset + chunkCount])
+            if batches and batches[-1][0] is material:
+                batches[-1][2] += chunkCount
+            else:
+                batches.append([material, offset, chunkCount, renderFlags])
+            offset += chunkCount
+
+        self.chunks = [tuple(b) for b in batches]
+        # The chunks to draw for each combination of render flags, filled in as they are asked for by render
+        self.chunksByRenderFlags = {}
+        return np.concatenate(batchedIndices) if batchedIndices else np.ascontiguousarray(indices)
+
+    # The material used for anything the material library does not specify
+    def makeDefaultMaterial(self):
+        return {
+            "color": {
+                "diffuse": [0.5, 0.5, 0.5],
+                "ambient": [0.5, 0.5, 0.5],
+                "specular": [0.5, 0.5, 0.5],
+                "emissive": [0.0, 0.0, 0.0]
+            },
+            "texture": {
+                "diffuse": -1,
+                "opacity": -1,
+                "specular": -1,
+                "normal": -1,
+            },
+            "alpha": 1.0,
+            "specularExponent": 22.0,
+            "offset": 0,
+        }
 
     def loadMaterials(self, materialFileName, basePath):
         materials = {}
@@ -193,23 +221,7 @@ class ObjModel:
                     if tokens[0] == "newmtl":
                         assert len(tokens) >= 2
                         currentMaterial = " ".join(tokens[1:])
-                        materials[currentMaterial] = {
-                            "color": {
-                                "diffuse": [0.5, 0.5, 0.5],
-                                "ambient": [0.5, 0.5, 0.5],
-                                "specular": [0.5, 0.5, 0.5],
-                                "emissive": [0.0, 0.0, 0.0]
-                            },
-                            "texture": {
-                                "diffuse": -1,
-                                "opacity": -1,
-                                "specular": -1,
-                                "normal": -1,
-                            },
-                            "alpha": 1.0,
-                            "specularExponent": 22.0,
-                            "offset": 0,
-                        }
+                        materials[currentMaterial] = self.makeDefaultMaterial()
                     elif tokens[0] == "Ka":
                         materials[currentMaterial]["color"]["ambient"] = self.parseFloats(tokens[1:], 3)
                     elif tokens[0] == "Ns":
@@ -221,20 +233,23 @@ class ObjModel:
                     elif tokens[0] == "Ke":
                         materials[currentMaterial]["color"]["emissive"] = self.parseFloats(tokens[1:], 3)
                     elif tokens[0] == "map_Kd":
-                        materials[currentMaterial]["texture"]["diffuse"] = ObjModel.loadTexture(" ".join(tokens[1:]),
-                                                                                                basePath, True)
+                        materials[currentMaterial]["texture"]["diffuse"] = self.requestTexture(tokens, basePath, True)
                     elif tokens[0] == "map_Ks":
-                        materials[currentMaterial]["texture"]["specular"] = ObjModel.loadTexture(" ".join(tokens[1:]),
-                                                                                                 basePath, True)
+                        materials[currentMaterial]["texture"]["specular"] = self.requestTexture(tokens, basePath, True)
                     elif tokens[0] == "map_bump" or tokens[0] == "bump":
-                        materials[currentMaterial]["texture"]["normal"] = ObjModel.loadTexture(" ".join(tokens[1:]),
-                                                                                               basePath, False)
+                        materials[currentMaterial]["texture"]["normal"] = self.requestTexture(tokens, basePath, False)
                     elif tokens[0] == "map_d":
-                        materials[currentMaterial]["texture"]["opacity"] = ObjModel.loadTexture(" ".join(tokens[1:]),
-                                                                                                basePath, False)
+                        materials[currentMaterial]["texture"]["opacity"] = self.requestTexture(tokens, basePath, False)
                     elif tokens[0] == "d":
                         materials[currentMaterial]["alpha"] = float(tokens[1])
 
+        # The textures are decoded in parallel while the file is parsed, wait for them and swap in the texture ids
+        g_textureManager.finishLoading()
+        for m in materials.values():
+            for ch, texture in m["texture"].items():
+                if isinstance(texture, TextureEntry):
+                    m["texture"][ch] = texture.textureId
+
         # check of there is a colour texture but the coour is zero and then change it to 1, Maya exporter does this to us...
         for id, m in materials.items():
             for ch in ["diffuse", "specular"]:
@@ -244,38 +259,14 @@ class ObjModel:
                     m["color"][ch] = [1, 1, 1]
         return materials
 
+    # Starts loading the texture named by the rest of a map_* line of a material file, see TextureManager.request
+    def requestTexture(self, tokens, basePath, srgb):
+        return g_textureManager.request(os.path.join(basePath, " ".join(tokens[1:])), srgb)
+
+    # Loads a texture right away and returns the texture id, or -1 if it failed. Loads are shared with any other
+    # users of the same file (see utils/texture_manager.py).
     def loadTexture(fileName, basePath, srgb):
-        fullFileName = os.path.join(basePath, fileName)
-
-        width = 0
-        height = 0
-        channels = 0
-        try:
-            im = Image.open(fullFileName)
-            texId = glGenTextures(1)
-            glActiveTexture(GL_TEXTURE0)
-            glBindTexture(GL_TEXTURE_2D, texId)
-
-            # NOTE: srgb is used to store pretty much all texture image data (except HDR images, which we don't support)
-            # Thus we use the GL_SRGB_ALPHA to ensure they are correctly converted to linear space when loaded into the shader.
-            # However: normal/bump maps/alpha masks, are typically authored in linear space, and so should not be stored as SRGB texture format.
-            data = im.tobytes("raw", "RGBX" if im.mode == 'RGB' else "RGBA", 0, -1)
-            glTexImage2D(GL_TEXTURE_2D, 0, GL_SRGB_ALPHA if srgb else GL_RGBA, im.size[0], im.size[1], 0, GL_RGBA,
-                         GL_UNSIGNED_BYTE, data)
-            # print("    Loaded texture '%s' (%d x %d)"%(fileName, im.size[0], im.size[1]));
-            glGenerateMipmap(GL_TEXTURE_2D)
-
-            glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
-            glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_REPEAT)
-            glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_REPEAT)
-            # glTexParameterf(GL_TEXTURE_2D, GL_TEXTURE_MAX_ANISOTROPY_EXT, 16);
-            glBindTexture(GL_TEXTURE_2D, 0)
-            return texId
-        except:
-            print("WARNING: FAILED to load texture '%s'" % fileName)
-
-        return -1
+        return g_textureManager.load(os.path.join(basePath, fileName), srgb)
 
     def render(self, shaderProgram=None, renderFlags=None, transforms={}):
         if not renderFlags:
@@ -284,9 +275,6 @@ class ObjModel:
         if not shaderProgram:
             shaderProgram = self.defaultShader
 
-        # Filter chunks based of render flags
-        chunks = [ch for ch in self.chunks if ch[3] & renderFlags]
-
         glBindVertexArray(self.vertexArrayObject)
         glUseProgram(shaderProgram)
 
@@ -303,10 +291,32 @@ class ObjModel:
             loc = lu.getUniformLocationDebug(shaderProgram, tfmName)
             tfm._set_open_gl_uniform(loc);
 
+        self.renderChunks(self.getChunks(renderFlags))
+
+        glUseProgram(0)
+        # deactivate texture units...
+        # for (int i = TU_Max - 1; i >= 0; --i)
+        # {
+        # glActiveTexture(GL_TEXTURE0 + i);
+        # glBindTexture(GL_TEXTURE_2D, 0);
+        # }
+
+    # Returns the chunks that match the render flags, this only needs to be filtered once for each set of flags
+    def getChunks(self, renderFlags):
+        chunks = self.chunksByRenderFlags.get(renderFlags)
+        if chunks is None:
+            chunks = [ch for ch in self.chunks if ch[3] & renderFlags]
+            self.chunksByRenderFlags[renderFlags] = chunks
+        return chunks
+
+    # Draws the chunks with the currently bound shader program and vertex array object, which must have the index
+    # buffer of this model bound (e.g., self.vertexArrayObject). If instanceCount is given each chunk is drawn that
+    # many times with a single instanced draw call.
+    def renderChunks(self, chunks, instanceCount=None):
         previousMaterial = None
         for material, chunkOffset, chunkCount, renderFlags in chunks:
-            # as an optimization we only do this if the material has changed between chunks.
-            # for more efficiency still consider sorting chunks based on material (or fusing them?)
+            # as an optimization we only do this if the material has changed between chunks. The chunks are sorted by
+            # material and fused at load time (see batchChunks), so this should only happen once per material.
             if material != previousMaterial:
                 previousMaterial = material
                 if self.overrideDiffuseTextureWithDefault:
@@ -316,25 +326,25 @@ class ObjModel:
                 bindTexture(self.TU_Opacity, material["texture"]["opacity"], self.defaultTextureOne);
                 bindTexture(self.TU_Specular, material["texture"]["specular"], self.defaultTextureOne);
                 bindTexture(self.TU_Normal, material["texture"]["normal"], self.defaultNormalTexture);
-                # TODO: can I do uniform buffers from python (yes, I need to use that struct thingo!)
-                # uint32_t matUniformSize = sizeof(MaterialProperties_Std140);
-                # glBindBufferRange(GL_UNIFORM_BUFFER, UBS_MaterialProperties, m_materialPropertiesBuffer, (uint32_t)chunk.material->offset * matUniformSize, matUniformSize);
-                # TODO: this is very slow, it should be packed into an uniform buffer as per above!
-                for k, v in material["color"].items():
-                    glUniform3fv(lu.getUniformLocationDebug(shaderProgram, "material_%s_color" % k), 1, v)
-                glUniform1f(lu.getUniformLocationDebug(shaderProgram, "material_specular_exponent"),
-                            material["specularExponent"])
-                glUniform1f(lu.getUniformLocationDebug(shaderProgram, "material_alpha"), material["alpha"])
-
-            glDrawArrays(GL_TRIANGLES, chunkOffset, chunkCount)
+                # The material properties were packed into the uniform buffer at load time, just select the right block.
+                self.materialUniforms.bindRange(material["offset"])
+                g_profiler.count("materialBinds")
+
+            indexOffset = ctypes.c_void_p(chunkOffset * self.indices.itemsize)
+            g_profiler.count("drawCalls")
+            if instanceCount is None:
+                glDrawElements(GL_TRIANGLES, chunkCount, self.indexType, indexOffset)
+            else:
+                glDrawElementsInstanced(GL_TRIANGLES, chunkCount, self.indexType, indexOffset, instanceCount)
 
-        glUseProgram(0)
-        # deactivate texture units...
-        # for (int i = TU_Max - 1; i >= 0; --i)
-        # {
-        # glActiveTexture(GL_TEXTURE0 + i);
-        # glBindTexture(GL_TEXTURE_2D, 0);
-        # }
+    # Returns the (vertex, fragment) code of the default shaders, the files are read on the first call
+    def getDefaultShaderSources():
+        if ObjModel.defaultVertexShader is None:
+            with open(DEFAULT_VERTEX_SHADER_FILE) as file:
+                ObjModel.defaultVertexShader = ''.join(file.readlines())
+            with open(DEFAULT_FRAGMENT_SHADER_FILE) as file:
+                ObjModel.defaultFragmentShader = ''.join(file.readlines())
+        return ObjModel.defaultVertexShader, ObjModel.defaultFragmentShader
 
     # useful to get the default bindings that the ObjModel will use when rendering, use to set up own shaders
     # for example an optimized shadow shader perhaps?
@@ -357,6 +367,6 @@ class ObjModel:
         glUniform1i(lu.getUniformLocationDebug(shaderProgram, "opacity_texture"), ObjModel.TU_Opacity);
         glUniform1i(lu.getUniformLocationDebug(shaderProgram, "specular_texture"), ObjModel.TU_Specular);
         glUniform1i(lu.getUniformLocationDebug(shaderProgram, "normal_texture"), ObjModel.TU_Normal);
-        # glUniformBlockBinding(shaderProgram, glGetUniformBlockIndex(shaderProgram, "MaterialProperties"), UBS_MaterialProperties);
+        # The 'MaterialProperties' block is bound to lu.UBS_MaterialProperties by lu.buildShader
 
 
@@ -0,0 +1,137 @@
+"""A small binary container format for caching processed asset data between runs.
+
+A file holds a JSON header (with any metadata the caller wants to keep alongside the data) followed by
+a number of named numpy arrays. The arrays are aligned in the file so that they can be memory-mapped
+and handed straight to OpenGL without any parsing or copying.
+
+Layout:
+    8 bytes   magic, identifies the kind of data (e.g., b'MRTERRN1')
+    8 bytes   little-endian uint64 length of the JSON header
+    n bytes   utf8 JSON header: {"meta": {...}, "arrays": {name: {"dtype", "shape", "offset"}}}
+    ...       padding up to a multiple of ARRAY_ALIGNMENT bytes, followed by the array data, where each array
+              starts at an aligned offset (relative to the start of the data) given in the header
+"""
+
+import hashlib
+import json
+import os
+import re
+import struct
+
+import numpy as np
+
+
+ARRAY_ALIGNMENT = 64
+
+_HEADER_LENGTH = struct.Struct("<Q")
+
+
+class CacheFormatError(Exception):
+    pass
+
+
+def _alignUp(offset):
+    return (offset + ARRAY_ALIGNMENT - 1) // ARRAY_ALIGNMENT * ARRAY_ALIGNMENT
+
+
+# Returns a hex digest of the content of the file, plus any extra values that should be part of the key
+# (e.g., scale parameters used when processing the data).
+def hashFileContents(fileName, *extra):
+    h = hashlib.sha1()
+    with open(fileName, "rb") as inFile:
+        for block in iter(lambda: inFile.read(1 << 20), b""):
+            h.update(block)
+    for e in extra:
+        h.update(repr(e).encode("utf8"))
+    return h.hexdigest()
+
+
+# Writes the named arrays and metadata to fileName, the file is written to a temporary name first and
+# moved into place so that a crash half-way through never leaves a truncated file behind.
+def writeArrays(fileName, magic, meta, arrays):
+    assert len(magic) == 8
+
+    arrays = {name: np.ascontiguousarray(a) for name, a in arrays.items()}
+    # Offsets are stored relative to the start of the data, which follows the (aligned) header
+    descriptors = {}
+    offset = 0
+    for name, a in arrays.items():
+        descriptors[name] = {"dtype": a.dtype.str, "shape": list(a.shape), "offset": offset}
+        offset = _alignUp(offset + a.nbytes)
+    headerBytes = json.dumps({"meta": meta, "arrays": descriptors}).encode("utf8")
+    dataStart = _alignUp(len(magic) + _HEADER_LENGTH.size + len(headerBytes))
+
+    dirName = os.path.dirname(fileName)
+    if dirName:
+        os.makedirs(dirName, exist_ok=True)
+    tmpName = "%s.%d.tmp" % (fileName, os.getpid())
+    with open(tmpName, "wb") as outFile:
+        outFile.write(magic)
+        outFile.write(_HEADER_LENGTH.pack(len(headerBytes)))
+        outFile.write(headerBytes)
+        for name, a in arrays.items():
+            outFile.seek(dataStart + descriptors[name]["offset"])
+            outFile.write(a.tobytes())
+        outFile.truncate(dataStart + offset)
+    os.replace(tmpName, fileName)
+
+
+# Reads a file written by writeArrays, returns the metadata and a dict of read-only arrays that are
+# memory-mapped from the file. Raises CacheFormatError if the file is not of the expected kind.
+def readArrays(fileName, magic):
+    data = np.memmap(fileName, dtype=np.uint8, mode="r")
+    headerStart = len(magic) + _HEADER_LENGTH.size
+    if len(data) < headerStart or bytes(data[:len(magic)]) != magic:
+        raise CacheFormatError("'%s' is not a '%s' file" % (fileName, magic.decode("ascii", "replace")))
+    headerLength, = _HEADER_LENGTH.unpack(bytes(data[len(magic):headerStart]))
+    try:
+        header = json.loads(bytes(data[headerStart:headerStart + headerLength]).decode("utf8"))
+    except ValueError as e:
+        raise CacheFormatError("'%s' has a corrupt header: %s" % (fileName, e))
+
+    dataStart = _alignUp(headerStart + headerLength)
+    arrays = {}
+    for name, d in header["arrays"].items():
+        dtype = np.dtype(d["dtype"])
+        shape = tuple(d["shape"])
+        nbytes = int(np.prod(shape, dtype=np.int64)) * dtype.itemsize
+        start = dataStart + d["offset"]
+        if start + nbytes > len(data):
+            raise CacheFormatError("'%s' is truncated" % fileName)
+        arrays[name] = data[start:start + nbytes].view(dtype).reshape(shape)
+    return header["meta"], arrays
+
+
+# Reads only the metadata of a file written by writeArrays, without mapping the file.
+def readMeta(fileName, magic):
+    headerStart = len(magic) + _HEADER_LENGTH.size
+    with open(fileName, "rb") as inFile:
+        start = inFile.read(headerStart)
+        if len(start) < headerStart or start[:len(magic)] != magic:
+            raise CacheFormatError("'%s' is not a '%s' file" % (fileName, magic.decode("ascii", "replace")))
+        headerLength, = _HEADER_LENGTH.unpack(start[len(magic):])
+        try:
+            return json.loads(inFile.read(headerLength).decode("utf8"))["meta"]
+        except (KeyError, ValueError) as e:
+            raise CacheFormatError("'%s' has a corrupt header: %s" % (fileName, e))
+
+
+# Removes the older entries for the same source file from cacheDir, which can never be hit again. These are the files
+# named '<prefix>_<first 16 hex digits of the key>.bin' whose meta["image"] is the same file as sourceName, other than
+# keepFileName. Files of other sources that happen to share the prefix are left alone, as are files that can't be
+# read or removed (e.g., when they are still mapped on Windows).
+def removeStaleFiles(cacheDir, prefix, magic, sourceName, keepFileName):
+    if not os.path.isdir(cacheDir):
+        return
+    pattern = re.compile(re.escape(prefix) + r"_[0-9a-f]{16}\.bin")
+    sourcePath = os.path.normcase(os.path.abspath(sourceName))
+    for fileName in os.listdir(cacheDir):
+        path = os.path.join(cacheDir, fileName)
+        if not pattern.fullmatch(fileName) or os.path.normcase(path) == os.path.normcase(keepFileName):
+            continue
+        try:
+            image = readMeta(path, magic).get("image")
+            if image is not None and os.path.normcase(os.path.abspath(image)) == sourcePath:
+                os.remove(path)
+        except (CacheFormatError, OSError) as e:
+            print("WARNING: failed to remove stale cache file '%s': %s" % (path, e))
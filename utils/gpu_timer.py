@@ -0,0 +1,123 @@
+"""GPU time of the passes of a frame, measured with GL_TIME_ELAPSED query objects.
+
+A pass is timed by drawing it in a scope, e.g.:
+
+    with g_gpuTimer.scope("terrain"):
+        terrain.render(view, renderingSystem)
+
+The GPU runs behind the CPU, so the results of a frame are only read when beginFrame comes round to the same set
+of queries again, numBuffers frames later. If a result is not available by then the frame is dropped rather
+than waiting for it, so the timing never stalls the pipeline. The results are added to the frame being recorded
+by the profiler (see utils/profiler.py) as sections under "gpu/", and the latest are also kept in 'results'.
+
+Timer queries cannot be nested, a scope opened while another is active is not timed.
+"""
+
+import ctypes
+
+from OpenGL.GL import *
+# The PyOpenGL wrapper of glGetQueryObjectui64v fails to create its output array, so the raw function is used
+from OpenGL.raw.GL.VERSION.GL_3_3 import glGetQueryObjectui64v
+
+from utils.profiler import g_profiler
+
+
+class _NullScope:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SCOPE = _NullScope()
+
+
+class _GpuScope:
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.query = self.timer.beginQuery(self.name)
+        return self
+
+    def __exit__(self, *args):
+        self.timer.endQuery()
+        return False
+
+
+class GpuTimer:
+    enabled = False
+    # Number of frames of queries in flight, i.e., double buffered: the queries of the previous frame are read while
+    # the others are used for this frame
+    numBuffers = 2
+    # Results longer than this (in seconds) are thrown away. Some drivers (e.g., Mesa llvmpipe) return the timestamp
+    # instead of the elapsed time for the very first query of a context.
+    maxValidTime = 10.0
+
+    def __init__(self):
+        # The (name, query) of each pass timed in each of the buffered frames
+        self.frames = [[] for _ in range(self.numBuffers)]
+        self.frameIndex = 0
+        self.freeQueries = []
+        self.activeQuery = None
+        # name -> ms of the latest frame that has results, and how many frames were dropped since the start
+        self.results = {}
+        self.numDroppedFrames = 0
+
+    def setEnabled(self, enabled):
+        if enabled != self.enabled:
+            self.enabled = enabled
+            # Any pending results are out of date once the timer is enabled again
+            for pending in self.frames:
+                self.freeQueries += [query for _, query in pending]
+                pending.clear()
+
+    def scope(self, name):
+        if not self.enabled or self.activeQuery is not None:
+            return _NULL_SCOPE
+        return _GpuScope(self, name)
+
+    # Reads the results of the frame that used the next set of queries (numBuffers frames ago), call at the start of a
+    # frame, after g_profiler.beginFrame.
+    def beginFrame(self):
+        if not self.enabled:
+            return
+        self.frameIndex = (self.frameIndex + 1) % self.numBuffers
+        pending = self.frames[self.frameIndex]
+        if not pending:
+            return
+
+        if all(glGetQueryObjectiv(query, GL_QUERY_RESULT_AVAILABLE) for _, query in pending):
+            results = {}
+            for name, query in pending:
+                elapsed = ctypes.c_uint64()
+                glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(elapsed))
+                if elapsed.value < self.maxValidTime * 1.0e9:
+                    results[name] = results.get(name, 0.0) + elapsed.value * 1.0e-6
+            self.results = results
+            for name, ms in results.items():
+                g_profiler.addTime("gpu/" + name, ms * 1.0e-3)
+        else:
+            self.numDroppedFrames += 1
+            g_profiler.count("gpuFramesDropped")
+
+        # A query can be reused even if its result never became available, beginning it again discards the old result
+        self.freeQueries += [query for _, query in pending]
+        pending.clear()
+
+    def beginQuery(self, name):
+        query = self.freeQueries.pop() if self.freeQueries else int(glGenQueries(1)[0])
+        glBeginQuery(GL_TIME_ELAPSED, query)
+        self.activeQuery = query
+        self.frames[self.frameIndex].append((name, query))
+        return query
+
+    def endQuery(self):
+        glEndQuery(GL_TIME_ELAPSED)
+        self.activeQuery = None
+
+
+# The timer used by the game, enabled along with the profiler
+g_gpuTimer = GpuTimer()
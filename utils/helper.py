@@ -1,7 +1,9 @@
 from OpenGL.GL import *
 import math
+import time
 
 import imgui
+import numpy as np
 
 # we use 'warnings' to remove this warning that ImGui[glfw] gives
 import warnings
@@ -10,15 +12,39 @@ warnings.simplefilter(action='ignore', category=FutureWarning)
 
 from utils.ObjModel import ObjModel
 from utils import lab_utils as lu
+from utils import math3d
 from utils.lab_utils import vec3
+from utils.uniform_buffer import UniformBlockLayout, UniformBuffer
+from utils.profiler import g_profiler
+from utils.gpu_timer import g_gpuTimer
+from utils.shader_cache import g_shaderCache
 
 from models.world import World
+from models.props import InstancedProps
+from models.simulation import update_world
 
 
 OBJECT_MODEL_VERTEX_SHADER_FILE = 'shaders/object_model/vertexShader.glsl'
+INSTANCED_OBJECT_MODEL_VERTEX_SHADER_FILE = 'shaders/object_model/instancedVertexShader.glsl'
 OBJECT_MODEL_FRAGMENT_SHADER_FILE = 'shaders/object_model/fragmentShader.glsl'
 COMMON_FRAGMENT_SHADER_FILE = 'shaders/object_model/commonFragmentShader.glsl'
 
+# The uniform blocks shared by all the shaders, these must match the declarations in the shaders.
+# FrameUniforms is the same for all objects drawn in a view, and is uploaded once per frame.
+FRAME_UNIFORMS_LAYOUT = UniformBlockLayout("FrameUniforms", [
+    ("mat4", "worldToViewTransform"),
+    ("mat4", "viewToClipTransform"),
+    ("vec3", "viewSpaceLightPosition"),
+    ("vec3", "globalAmbientLight"),
+    ("vec3", "sunLightColour"),
+], lu.UBS_FrameUniforms)
+# ObjectUniforms holds the transforms of the object being drawn
+OBJECT_UNIFORMS_LAYOUT = UniformBlockLayout("ObjectUniforms", [
+    ("mat4", "modelToClipTransform"),
+    ("mat4", "modelToViewTransform"),
+    ("mat3", "modelToViewNormalTransform"),
+], lu.UBS_ObjectUniforms)
+
 
 #
 # Classes
@@ -29,12 +55,73 @@ COMMON_FRAGMENT_SHADER_FILE = 'shaders/object_model/commonFragmentShader.glsl'
 # projection and world-to-view transform, as these are used in all shaders. Keeping them in one
 # object makes it easier to pass around. It is also convenient future-proofing if we want to add more
 # views (e.g., for a shadow map).
+# It also caches the transforms that only depend on the view (see updateTransforms), and the per-object transforms
+# computed in a batch by prepareObjectTransforms, so that each is only computed once per frame.
 class ViewParams:
     viewToClipTransform = lu.Mat4()
     worldToViewTransform = lu.Mat4()
     width = 0
     height = 0
 
+    # Set by updateTransforms
+    worldToClipTransform = lu.Mat4()
+    viewSpaceLightPosition = vec3(0.0)
+
+    # Counters for the current frame, shown by RenderingSystem.draw_ui
+    transformTime = 0.0
+    numObjectTransforms = 0
+    numCachedObjectTransforms = 0
+    # Object transforms that needed a matrix inverse for the normal transform (i.e., not rigid with uniform scale)
+    numInverseNormalTransforms = 0
+
+    def __init__(self):
+        # id(modelToWorldTransform) -> index into the arrays computed by prepareObjectTransforms
+        self.objectTransformIndices = {}
+        # Keeps the prepared Mat4s alive, so their ids are not reused by other objects during the frame
+        self.preparedTransforms = []
+
+    # Computes the transforms that are the same for all objects drawn in the view, after the view transforms are set.
+    def updateTransforms(self, worldLightPosition):
+        start = time.perf_counter()
+        self.worldToClipTransform = self.viewToClipTransform * self.worldToViewTransform
+        self.viewSpaceLightPosition = lu.transformPoint(self.worldToViewTransform, worldLightPosition)
+        self.transformTime += time.perf_counter() - start
+
+    # Returns the model to clip, model to view and normal transforms (see setCommonUniforms) of a Mat4 or an (N, 4, 4)
+    # stack of model to world transforms, as arrays.
+    def computeObjectTransforms(self, modelToWorldTransforms):
+        start = time.perf_counter()
+        modelToWorld = modelToWorldTransforms.matData if isinstance(modelToWorldTransforms, lu.Mat4) else modelToWorldTransforms
+        modelToClip = math3d.multiply(self.worldToClipTransform.matData, modelToWorld)
+        modelToView = math3d.multiply(self.worldToViewTransform.matData, modelToWorld)
+        # The world to view transform is rigid, so the model to view transform is rigid with uniform scale if the model
+        # to world transform is.
+        rigid = math3d.isRigidUniformScale(modelToWorld)
+        modelToViewNormal = math3d.normalTransforms(modelToView, rigid)
+
+        if modelToWorld.ndim == 2:
+            self.numObjectTransforms += 1
+            self.numInverseNormalTransforms += 0 if rigid else 1
+        else:
+            self.numObjectTransforms += len(rigid)
+            self.numInverseNormalTransforms += len(rigid) - int(np.count_nonzero(rigid))
+        self.transformTime += time.perf_counter() - start
+        return modelToClip, modelToView, modelToViewNormal
+
+    # Computes the transforms of all the objects drawn with the given (Mat4) model to world transforms in one batch,
+    # getObjectTransforms then looks them up when the same Mat4 objects are drawn.
+    def prepareObjectTransforms(self, modelToWorldTransforms):
+        self.preparedTransforms = list(modelToWorldTransforms)
+        self.objectTransformIndices = {id(m): i for i, m in enumerate(self.preparedTransforms)}
+        self.preparedObjectTransforms = self.computeObjectTransforms(np.stack([m.matData for m in self.preparedTransforms]))
+
+    def getObjectTransforms(self, modelToWorldTransform):
+        index = self.objectTransformIndices.get(id(modelToWorldTransform))
+        if index is None:
+            return self.computeObjectTransforms(modelToWorldTransform)
+        self.numCachedObjectTransforms += 1
+        return tuple(transforms[index] for transforms in self.preparedObjectTransforms)
+
 
 #
 # Really just a helper class to be able to pass around shared utilities to the different modules
@@ -42,6 +129,9 @@ class ViewParams:
 class RenderingSystem:
 
     objModelShader = None
+    instancedObjModelShader = None
+    # The view of the last frame drawn
+    view = None
 
     def __init__(self, world: World):
         self.world = world
@@ -52,30 +142,39 @@ class RenderingSystem:
         with open(COMMON_FRAGMENT_SHADER_FILE) as file:
             self.commonFragmentShaderCode = ''.join(file.readlines())
 
-    # Helper to set common uniforms, such as those used for global lights that should be implemetned the same way in all shaders.
-    # Properly, these should be put into a uniform buffer object and uploaded once and for all, this is infinitely faster and better
-    #
+        self.frameUniforms = UniformBuffer(FRAME_UNIFORMS_LAYOUT)
+        self.objectUniforms = UniformBuffer(OBJECT_UNIFORMS_LAYOUT)
+
+    # Uploads the uniforms that are the same for all objects drawn in the view, i.e., the view transforms and lighting
+    # parameters. This is done once per frame (see renderFrame), and the shaders read them from the FrameUniforms block.
+    def updateFrameUniforms(self, view):
+        self.view = view
+        self.frameUniforms.set("worldToViewTransform", view.worldToViewTransform)
+        self.frameUniforms.set("viewToClipTransform", view.viewToClipTransform)
+        self.frameUniforms.set("viewSpaceLightPosition", view.viewSpaceLightPosition)
+        self.frameUniforms.set("globalAmbientLight", self.world.global_ambient_light)
+        self.frameUniforms.set("sunLightColour", self.world.sunlight_color)
+        self.frameUniforms.upload()
+
+    # Helper to set common uniforms, i.e., the transforms of an object, these vary per object and must be set each time an
+    # object is drawn (since they have different modelToWorld transforms). They are uploaded in one go to the ObjectUniforms
+    # block, the per-view uniforms are set once per frame by updateFrameUniforms.
     def setCommonUniforms(self, shader, view, modelToWorldTransform):
-        # Concatenate the transformations to take vertices directly from model space to clip space
-        modelToClipTransform = view.viewToClipTransform * view.worldToViewTransform * modelToWorldTransform
-        # Transform to view space from model space (used for the shading)
-        modelToViewTransform = view.worldToViewTransform * modelToWorldTransform
-        # Transform to view space for normals, need to use the inverse transpose unless only rigid body & uniform scale.
-        modelToViewNormalTransform = lu.inverse(lu.transpose(lu.Mat3(modelToViewTransform)))
-
-        # Set the standard transforms, these vary per object and must be set each time an object is drawn (since they have different modelToWorld transforms)
-        lu.setUniform(shader, "modelToClipTransform", modelToClipTransform)
-        lu.setUniform(shader, "modelToViewTransform", modelToViewTransform)
-        lu.setUniform(shader, "modelToViewNormalTransform", modelToViewNormalTransform)
-
-        # These transforms are the same for the current view and could be set once for all the objects
-        lu.setUniform(shader, "worldToViewTransform", view.worldToViewTransform)
-        lu.setUniform(shader, "viewToClipTransform", view.viewToClipTransform)
-        # Lighting parameters as could these
-        viewSpaceLightPosition = lu.transformPoint(view.worldToViewTransform, self.world.sun_position)
-        lu.setUniform(shader, "viewSpaceLightPosition", viewSpaceLightPosition)
-        lu.setUniform(shader, "globalAmbientLight", self.world.global_ambient_light)
-        lu.setUniform(shader, "sunLightColour", self.world.sunlight_color)
+        # The transformations to take vertices directly from model space to clip space, to view space from model space
+        # (used for the shading) and for normals to view space (the inverse transpose, unless only rigid body & uniform
+        # scale), cached in the view if prepared for the frame.
+        modelToClipTransform, modelToViewTransform, modelToViewNormalTransform = view.getObjectTransforms(modelToWorldTransform)
+
+        self.objectUniforms.set("modelToClipTransform", modelToClipTransform)
+        self.objectUniforms.set("modelToViewTransform", modelToViewTransform)
+        self.objectUniforms.set("modelToViewNormalTransform", modelToViewNormalTransform)
+        self.objectUniforms.upload()
+
+    def draw_ui(self):
+        if self.view:
+            imgui.label_text("TransformTime", "%0.3fms" % (1000.0 * self.view.transformTime))
+            imgui.label_text("ObjectTransforms", "%d (%d cached)" % (self.view.numObjectTransforms, self.view.numCachedObjectTransforms))
+            imgui.label_text("InverseNormals", "%d" % self.view.numInverseNormalTransforms)
 
     def drawObjModel(self, model, modelToWorldTransform, view):
         # Bind the shader program such that we can set the uniforms (model.render sets it again)
@@ -92,57 +191,31 @@ class RenderingSystem:
             vertex_shader_code = ''.join(file.readlines())
         with open(OBJECT_MODEL_FRAGMENT_SHADER_FILE) as file:
             fragment_shader_code = ''.join(file.readlines())
-        self.objModelShader = lu.buildShader([vertex_shader_code],
-                                             ["#version 330\n", self.commonFragmentShaderCode, fragment_shader_code],
-                                             ObjModel.getDefaultAttributeBindings())
+        self.objModelShader = g_shaderCache.buildShader([vertex_shader_code],
+                                                        ["#version 330\n", self.commonFragmentShaderCode,
+                                                         fragment_shader_code],
+                                                        ObjModel.getDefaultAttributeBindings())
         glUseProgram(self.objModelShader)
         ObjModel.setDefaultUniformBindings(self.objModelShader)
         glUseProgram(0)
 
+        # Same fragment shader, but the transforms come from a per-instance attribute (see models/props.py)
+        with open(INSTANCED_OBJECT_MODEL_VERTEX_SHADER_FILE) as file:
+            instanced_vertex_shader_code = ''.join(file.readlines())
+        self.instancedObjModelShader = g_shaderCache.buildShader([instanced_vertex_shader_code],
+                                                                 ["#version 330\n", self.commonFragmentShaderCode,
+                                                                  fragment_shader_code],
+                                                                 InstancedProps.getAttributeBindings())
+        glUseProgram(self.instancedObjModelShader)
+        ObjModel.setDefaultUniformBindings(self.instancedObjModelShader)
+        glUseProgram(0)
+
 
 #
 # Functions and procedures
 #
-def sampleKeyFrames(t, kfs):
-    # 1. find correct interval
-    if t <= kfs[0][0]:
-        return kfs[0][1]
-
-    if t >= kfs[-1][0]:
-        return kfs[-1][1]
-
-    for i1 in range(1, len(kfs)):
-        if t < kfs[i1][0]:
-            i0 = i1 - 1
-            t0 = kfs[i0][0]
-            t1 = kfs[i1][0]
-            # linear interpolation from one to the other
-            return lu.mix(kfs[i0][1], kfs[i1][1], (t - t0) / (t1 - t0))
-
-    # we should not get here, unless the key values are malformed (i.e., not strictly increasing)
-    assert False
-    # but if we do, we return a value that is obviously no good (rahter than say zero that might pass unnoticed for much longer)
-    return None
-
-
-def update(world: World, g_renderingSystem: RenderingSystem, dt, keyStateMap, mouseDelta):
-
-    if world.should_update_sun:
-        world.sun_angle += dt * 0.25
-        world.sun_angle = world.sun_angle % (2.0 * math.pi)
-
-    world.sun_position = lu.Mat3(lu.make_rotation_x(world.sun_angle)) * world.sun_start_position
-
-    world.sunlight_color = sampleKeyFrames(lu.dot(lu.normalize(world.sun_position), vec3(0.0, 0.0, 1.0)), world.sun_keyframes)
-    world.global_ambient_light = sampleKeyFrames(lu.dot(lu.normalize(world.sun_position), vec3(0.0, 0.0, 1.0)), world.ambient_keyframes)
-
-    world.racer.update(dt, keyStateMap)
-
-    world.view_position = world.racer.position - \
-                          (world.racer.heading * world.follow_cam_offset) + \
-                          [0, 0, world.follow_cam_offset]
-    world.view_target = world.racer.position + vec3(0, 0, world.follow_cam_look_offset)
-
+# Draws the UI to tweak the world, called once per frame by the main loop (between imgui.begin and imgui.end).
+def draw_ui(world: World, rendering_system: RenderingSystem = None):
     if imgui.tree_node("Camera", imgui.TREE_NODE_DEFAULT_OPEN):
         _, world.follow_cam_offset = imgui.slider_float("FollowCamOffset ", world.follow_cam_offset, 2.0, 100.0)
         _, world.follow_cam_look_offset = imgui.slider_float("FollowCamLookOffset", world.follow_cam_look_offset, 0.0, 100.0)
@@ -152,6 +225,10 @@ def update(world: World, g_renderingSystem: RenderingSystem, dt, keyStateMap, mo
         world.racer.draw_ui()
         imgui.tree_pop()
 
+    if world.fleet and imgui.tree_node("AI Racers", imgui.TREE_NODE_DEFAULT_OPEN):
+        world.fleet.draw_ui()
+        imgui.tree_pop()
+
     if imgui.tree_node("Terrain", imgui.TREE_NODE_DEFAULT_OPEN):
         world.terrain.draw_ui()
         imgui.tree_pop()
@@ -165,6 +242,23 @@ def update(world: World, g_renderingSystem: RenderingSystem, dt, keyStateMap, mo
         _, world.should_update_sun = imgui.checkbox("UpdateSun", world.should_update_sun)
         imgui.tree_pop()
 
+    if rendering_system and imgui.tree_node("Rendering"):
+        rendering_system.draw_ui()
+        if imgui.tree_node("Models"):
+            # The fleet draws the racer model, so that is not listed again
+            for model in [world.racer.model] + [props.model for props in world.props]:
+                if model is not None:
+                    model.drawUi()
+            imgui.tree_pop()
+        imgui.tree_pop()
+
+
+# Advances the world by dt (tied to the frame rate) and draws the UI. The game uses a Simulation with a fixed timestep
+# and draw_ui instead.
+def update(world: World, g_renderingSystem: RenderingSystem, dt, keyStateMap, mouseDelta):
+    update_world(world, dt, keyStateMap)
+    draw_ui(world)
+
 
 # Called once per frame by the main loop below
 def renderFrame(game: World, rendering_system: RenderingSystem, width, height):
@@ -185,7 +279,21 @@ def renderFrame(game: World, rendering_system: RenderingSystem, width, height):
     view.worldToViewTransform = lu.make_lookAt(game.view_position, game.view_target, game.view_up)
     view.width = width
     view.height = height
+    with g_profiler.scope("transforms"):
+        view.updateTransforms(game.sun_position)
+        # The objects drawn with per-object uniforms, their transforms are computed together
+        view.prepareObjectTransforms([game.terrain.modelToWorldTransform, game.racer.get_model_to_world_transform()])
+
+    rendering_system.updateFrameUniforms(view)
 
     # Call each part of the scene to render itself
-    game.terrain.render(view, rendering_system)
-    game.racer.render(view, rendering_system)
+    with g_profiler.scope("terrain"), g_gpuTimer.scope("terrain"):
+        game.terrain.render(view, rendering_system)
+    with g_profiler.scope("racer"), g_gpuTimer.scope("racer"):
+        game.racer.render(view, rendering_system)
+    if game.fleet:
+        with g_profiler.scope("fleet"), g_gpuTimer.scope("fleet"):
+            game.fleet.render(view, rendering_system)
+    with g_profiler.scope("props"), g_gpuTimer.scope("props"):
+        for props in game.props:
+            props.render(view, rendering_system)
@@ -1,10 +1,16 @@
 import math
 import sys
-from ctypes import c_float, c_uint
 
-import imgui
 import numpy as np
-from OpenGL.GL import *
+
+from utils import math3d
+from utils.lazy_import import lazyModule
+from utils.profiler import g_profiler
+
+# Only imported when first used, so that the tools that only need the math (e.g., models/simulation.py) do not load
+# the GL and ImGui modules
+GL = lazyModule("OpenGL.GL")
+imgui = lazyModule("imgui")
 
 
 def vec2(x, y=None):
@@ -21,72 +27,119 @@ def vec3(x, y=None, z=None):
     return np.array([x, y, z], dtype=np.float32)
 
 
+# Bound once, for the inner loop of Mat4/Mat3 composition, where the global and attribute lookups are a noticeable
+# part of the cost
+_newObject = object.__new__
+_dot = np.dot
+
+
 # This is a helper class to provide the ability to use * for matrix/matrix and matrix/vector multiplication.
 # It also helps out uploading constants and a few other operations as python does not support overloading functions.
 # Note that a vector is just represented as a list on floats, and we rely on numpy to take care of the 
+# The matrix is stored as a plain float32 numpy array (matData), and the operations are implemented in utils/math3d.py,
+# which also has versions that write to preallocated arrays and work on stacks of matrices for code that needs it.
 class Mat4:
     matData = None
 
     # Construct a Mat4 from a python array
-    def __init__(self, p=[[1, 0, 0, 0],
-                          [0, 1, 0, 0],
-                          [0, 0, 1, 0],
-                          [0, 0, 0, 1]]):
-        if isinstance(p, Mat3):
-            self.matData = np.matrix(np.identity(4))
+    def __init__(self, p=None):
+        if p is None:
+            self.matData = math3d.identity(4)
+        elif isinstance(p, Mat3):
+            self.matData = math3d.identity(4)
             self.matData[:3, :3] = p.matData
         else:
-            self.matData = np.matrix(p)
+            self.matData = np.array(p, dtype=np.float32)
+
+    # Wraps a (4, 4) float32 array without copying it
+    def _wrap(data):
+        m = _newObject(Mat4)
+        m.matData = data
+        return m
 
     # overload the multiplication operator to enable sane looking transformation expressions!
     def __mul__(self, other):
-        # if it is a list, we let numpy attempt to convert the data
-        # we then return it as a list also (the typical use case is 
+        # Composing two transforms is by far the most common use, so it is checked first and done inline, which makes
+        # chains like P * V * M as cheap as with np.matrix
+        if other.__class__ is Mat4:
+            m = _newObject(Mat4)
+            m.matData = _dot(self.matData, other.matData)
+            return m
+        # if it is a list (or array), we let numpy attempt to convert the data
+        # we then return it as a flat array also (the typical use case is
         # for transforming a vector). Could be made more robust...
-        if isinstance(other, list):
-            return np.array(self.matData.dot(other).flat, dtype=np.float32)
+        if isinstance(other, (list, np.ndarray)):
+            return self.matData.dot(np.asarray(other, dtype=np.float32))
         # Otherwise we assume it is another Mat4 or something compatible, and just multiply the matrices
         # and return the result as a new Mat4
-        return Mat4(self.matData.dot(other.matData))
+        return Mat4._wrap(math3d.multiply(self.matData, other.matData))
 
-    # Helper to get data as a contiguous array for upload to OpenGL
+    # In-place composition, i.e., M *= T, writes the product into the array of this matrix. The array may be a view
+    # (see _wrap), which numpy does not accept as the output of the multiplication, so that goes through a temporary.
+    def __imul__(self, other):
+        if self.matData.flags.c_contiguous:
+            math3d.multiply(self.matData, other.matData, out=self.matData)
+        else:
+            self.matData[...] = math3d.multiply(self.matData, other.matData)
+        return self
+
+    # Helper to get data as a contiguous array for upload to OpenGL (only copies if it is not already)
     def getData(self):
         return np.ascontiguousarray(self.matData, dtype=np.float32)
 
     # note: returns an inverted copy, does not change the object (for clarity use the global function instead)
     #       only implemented as a member to make it easy to overload based on matrix class (i.e. 3x3 or 4x4)
     def _inverse(self):
-        return Mat4(np.linalg.inv(self.matData))
+        return Mat4._wrap(math3d.inverse(self.matData))
 
     def _transpose(self):
-        return Mat4(self.matData.T)
+        return Mat4._wrap(math3d.transpose(self.matData))
 
     def _set_open_gl_uniform(self, loc):
-        glUniformMatrix4fv(loc, 1, GL_TRUE, self.getData())
+        GL.glUniformMatrix4fv(loc, 1, GL.GL_TRUE, self.getData())
 
 
 class Mat3:
     matData = None
 
-    # Construct a Mat4 from a python array
-    def __init__(self, p=[[1, 0, 0],
-                          [0, 1, 0],
-                          [0, 0, 1]]):
-        if isinstance(p, Mat4):
-            self.matData = p.matData[:3, :3]
+    # Construct a Mat3 from a python array, or from (a copy of) the upper 3x3 part of a Mat4
+    def __init__(self, p=None):
+        if p is None:
+            self.matData = math3d.identity(3)
+        elif isinstance(p, Mat4):
+            self.matData = np.array(p.matData[:3, :3], dtype=np.float32)
         else:
-            self.matData = np.matrix(p)
+            self.matData = np.array(p, dtype=np.float32)
+
+    # Wraps a (3, 3) float32 array without copying it
+    def _wrap(data):
+        m = _newObject(Mat3)
+        m.matData = data
+        return m
 
     # overload the multiplication operator to enable sane looking transformation expressions!
     def __mul__(self, other):
+        # See Mat4.__mul__
+        if other.__class__ is Mat3:
+            m = _newObject(Mat3)
+            m.matData = _dot(self.matData, other.matData)
+            return m
         # if it is a list, we let numpy attempt to convert the data
         # we then return it as a list also (the typical use case is 
         # for transforming a vector). Could be made more robust...
-        if isinstance(other, list) or isinstance(other, np.ndarray):
-            return np.array(self.matData.dot(other).flat, dtype=np.float32)
+        if isinstance(other, (list, np.ndarray)):
+            return self.matData.dot(np.asarray(other, dtype=np.float32))
         # Otherwise we assume it is another Mat3 or something compatible, and just multiply the matrices
         # and return the result as a new Mat3
-        return Mat3(self.matData.dot(other.matData))
+        return Mat3._wrap(math3d.multiply(self.matData, other.matData))
+
+    # In-place composition, see Mat4.__imul__
+    def __imul__(self, other):
+        if self.matData.flags.c_contiguous:
+            math3d.multiply(self.matData, other.matData, out=self.matData)
+        else:
+            self.matData[...] = math3d.multiply(self.matData, other.matData)
+        return self
 
     # Helper to get data as a contiguous array for upload to OpenGL
     def getData(self):
@@ -95,13 +148,13 @@ class Mat3:
     # note: returns an inverted copy, does not change the object (for clarity use the global function instead)
     #       only implemented as a member to make it easy to overload based on matrix class (i.e. 3x3 or 4x4)
     def _inverse(self):
-        return Mat3(np.linalg.inv(self.matData))
+        return Mat3._wrap(math3d.inverse(self.matData))
 
     def _transpose(self):
-        return Mat3(self.matData.T)
+        return Mat3._wrap(math3d.transpose(self.matData))
 
     def _set_open_gl_uniform(self, loc):
-        glUniformMatrix3fv(loc, 1, GL_TRUE, self.getData())
+        GL.glUniformMatrix3fv(loc, 1, GL.GL_TRUE, self.getData())
 
 
 #
@@ -109,38 +162,23 @@ class Mat3:
 #
 
 def make_translation(x, y, z):
-    return Mat4([[1, 0, 0, x],
-                 [0, 1, 0, y],
-                 [0, 0, 1, z],
-                 [0, 0, 0, 1]])
+    return Mat4._wrap(math3d.makeTranslation(x, y, z))
 
 
 def make_scale(x, y, z):
-    return Mat4([[x, 0, 0, 0],
-                 [0, y, 0, 0],
-                 [0, 0, z, 0],
-                 [0, 0, 0, 1]])
+    return Mat4._wrap(math3d.makeScale(x, y, z))
 
 
 def make_rotation_y(angle):
-    return Mat4([[math.cos(angle), 0, math.sin(angle), 0],
-                 [0, 1, 0, 0],
-                 [-math.sin(angle), 0, math.cos(angle), 0],
-                 [0, 0, 0, 1]])
+    return Mat4._wrap(math3d.makeRotationY(angle))
 
 
 def make_rotation_x(angle):
-    return Mat4([[1, 0, 0, 0],
-                 [0, math.cos(angle), -math.sin(angle), 0],
-                 [0, math.sin(angle), math.cos(angle), 0],
-                 [0, 0, 0, 1]])
+    return Mat4._wrap(math3d.makeRotationX(angle))
 
 
 def make_rotation_z(angle):
-    return Mat4([[math.cos(angle), -math.sin(angle), 0, 0],
-                 [math.sin(angle), math.cos(angle), 0, 0],
-                 [0, 0, 1, 0],
-                 [0, 0, 0, 1]])
+    return Mat4._wrap(math3d.makeRotationZ(angle))
 
 
 #
@@ -151,18 +189,7 @@ def make_rotation_z(angle):
 # The 'translation' becomes the translation of the resulting matrix.
 # (For some reason glm seems to lack this highly useful functionality)
 def make_mat4_from_zAxis(translation, zAxis, yAxis):
-    # 1. the z axis is as given.
-    z = normalize(zAxis)
-    # 2. the x axis is the cross product of the z axis and rough y azis, it is therefore perpendicular to both of these directions.
-    x = normalize(cross(yAxis, z))
-    # the y axis must be perpendicular to the other two axes, which is constructed using the cross product, (unless they are co-linear).
-    y = cross(z, x)
-
-    # There's bound to be a nice and pythonic way to do this...
-    return Mat4([[x[0], y[0], z[0], translation[0]],
-                 [x[1], y[1], z[1], translation[1]],
-                 [x[2], y[2], z[2], translation[2]],
-                 [0, 0, 0, 1]])
+    return Mat4._wrap(math3d.makeFromZAxis(translation, zAxis, yAxis))
 
 
 # 
@@ -207,34 +234,17 @@ def dot(a, b):
 # The reason we need a 'look from', and don't just use lookAt(pos, pos+dir, up) is because if pos is large (i.e., far from the origin) and 'dir' is a unit vector (common case)
 # then the precision loss in the addition followed by subtraction in lookAt to get the direction back is _significant_, and leads to jerky camera movements.
 def make_lookFrom(eye, direction, up):
-    f = normalize(direction)
-    U = np.array(up[:3])
-    s = normalize(np.cross(f, U))
-    u = np.cross(s, f)
-    M = np.matrix(np.identity(4))
-    M[:3, :3] = np.vstack([s, u, -f])
-    T = make_translation(-eye[0], -eye[1], -eye[2])
-    return Mat4(M) * T
+    return Mat4._wrap(math3d.makeLookFrom(eye, direction, up))
 
 
 # make_lookAt defines a view transform, i.e., from world to view space, using intuitive parameters. location of camera, point to aim, and rough up direction.
 # this is basically the same as what we saw in Lexcture #2 for placing the car in the world, except the inverse! (and also view-space 'forwards' is the negative z-axis)
 def make_lookAt(eye, target, up):
-    return make_lookFrom(eye, np.array(target[:3]) - np.array(eye[:3]), up)
+    return Mat4._wrap(math3d.makeLookAt(eye, target, up))
 
 
 def make_perspective(yFovDeg, aspect, n, f):
-    radFovY = math.radians(yFovDeg)
-    tanHalfFovY = math.tan(radFovY / 2.0)
-    sx = 1.0 / (tanHalfFovY * aspect)
-    sy = 1.0 / tanHalfFovY
-    zz = -(f + n) / (f - n)
-    zw = -(2.0 * f * n) / (f - n)
-
-    return Mat4([[sx, 0, 0, 0],
-                 [0, sy, 0, 0],
-                 [0, 0, zz, zw],
-                 [0, 0, -1, 0]])
+    return Mat4._wrap(math3d.makePerspective(yFovDeg, aspect, n, f))
 
 
 # Turns a multidimensional array (up to 3d?) into a 1D array
@@ -242,64 +252,80 @@ def flatten(*lll):
     return [u for ll in lll for l in ll for u in l]
 
 
+# Returns the data as a contiguous numpy array of the given type. Numpy arrays that already are contiguous
+# and of the right type are returned as is, and raw buffers (bytes, memoryview etc.) are wrapped without
+# copying. Anything else, e.g., nested lists of vectors, is converted once.
+def asContiguousArray(data, dtype):
+    if isinstance(data, (memoryview, bytes, bytearray)):
+        return np.frombuffer(data, dtype=dtype)
+    return np.ascontiguousarray(data, dtype=dtype)
+
+
+# Uploads the data to the buffer object, the contiguous array is passed straight to glBufferData so no
+# intermediate python objects or copies are made for numpy arrays and buffers. The usage defaults to GL_STATIC_DRAW.
+def uploadBufferData(target, bufferObject, data, dtype=np.float32, usage=None):
+    array = asContiguousArray(data, dtype)
+    if usage is None:
+        usage = GL.GL_STATIC_DRAW
+    GL.glBindBuffer(target, bufferObject)
+    GL.glBufferData(target, array.nbytes, array, usage)
+    return array
+
+
 def uploadFloatData(bufferObject, floatData):
-    flatData = flatten(floatData)
-    data_buffer = (c_float * len(flatData))(*flatData)
     # Upload data to the currently bound GL_ARRAY_BUFFER, note that this is
     # completely anonymous binary data, no type information is retained (we'll
     # supply that later in glVertexAttribPointer)
-    glBindBuffer(GL_ARRAY_BUFFER, bufferObject)
-    glBufferData(GL_ARRAY_BUFFER, data_buffer, GL_STATIC_DRAW)
+    uploadBufferData(GL.GL_ARRAY_BUFFER, bufferObject, floatData, np.float32)
 
 
 def createAndAddVertexArrayData(vertexArrayObject, data, attributeIndex):
     # Binds to the VAO to store vertex attribute configurations
-    glBindVertexArray(vertexArrayObject)
+    GL.glBindVertexArray(vertexArrayObject)
 
-    buffer = glGenBuffers(1)
+    buffer = GL.glGenBuffers(1)
+    data = asContiguousArray(data, np.float32)
     uploadFloatData(buffer, data)
 
     # This binds the buffer object to GL_ARRAY_BUFFER, which is where the data will be passed onto
     # the next glVertexAttribPointer() call
-    glBindBuffer(GL_ARRAY_BUFFER, buffer)
+    GL.glBindBuffer(GL.GL_ARRAY_BUFFER, buffer)
 
     # attributeIndex is essentially the order (starting at 0) in the vertex shader where the attribute was defined.
-    glVertexAttribPointer(attributeIndex, len(data[0]), GL_FLOAT, GL_FALSE, 0, None)
+    GL.glVertexAttribPointer(attributeIndex, data.shape[-1] if data.ndim > 1 else 1, GL.GL_FLOAT, GL.GL_FALSE, 0, None)
     # This next call is necessary as vertex attributes are disabled by default
-    glEnableVertexAttribArray(attributeIndex)
+    GL.glEnableVertexAttribArray(attributeIndex)
 
     # Unbind the buffers again to avoid unintentianal GL state corruption (this is something that can be rather inconventient to debug)
-    glBindBuffer(GL_ARRAY_BUFFER, 0)
+    GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
 
     # Unbind to the VAO
-    glBindVertexArray(0)
+    GL.glBindVertexArray(0)
 
     return buffer
 
 
 def createAndAddIndexArray(vertexArrayObject, indexData):
-    glBindVertexArray(vertexArrayObject)
-    indexBuffer = glGenBuffers(1)
-    glBindBuffer(GL_ARRAY_BUFFER, indexBuffer)
+    GL.glBindVertexArray(vertexArrayObject)
+    indexBuffer = GL.glGenBuffers(1)
 
-    data_buffer = (c_uint * len(indexData))(*indexData)
-    glBufferData(GL_ARRAY_BUFFER, data_buffer, GL_STATIC_DRAW)
+    uploadBufferData(GL.GL_ARRAY_BUFFER, indexBuffer, indexData, np.uint32)
 
     # Bind the index buffer as the element array buffer of the VAO - this causes it to stay bound to this VAO - fairly unobvious.
-    glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, indexBuffer)
+    GL.glBindBuffer(GL.GL_ELEMENT_ARRAY_BUFFER, indexBuffer)
 
     # Unbind the buffers again to avoid unintentianal GL state corruption (this is something that can be rather inconventient to debug)
-    glBindBuffer(GL_ARRAY_BUFFER, 0)
-    glBindVertexArray(0)
+    GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+    GL.glBindVertexArray(0)
 
     return indexBuffer
 
 
 def getShaderInfoLog(obj):
-    logLength = glGetShaderiv(obj, GL_INFO_LOG_LENGTH)
+    logLength = GL.glGetShaderiv(obj, GL.GL_INFO_LOG_LENGTH)
 
     if logLength > 0:
-        return glGetShaderInfoLog(obj).decode()
+        return GL.glGetShaderInfoLog(obj).decode()
 
     return ""
 
@@ -312,23 +338,23 @@ def getShaderInfoLog(obj):
 #
 def compileAndAttachShader(shaderProgram, shaderType, sources):
     # Create the opengl shader object
-    shader = glCreateShader(shaderType)
+    shader = GL.glCreateShader(shaderType)
     # upload the source code for the shader
     # Note the function takes an array of source strings and lengths.
-    glShaderSource(shader, sources)
-    glCompileShader(shader)
+    GL.glShaderSource(shader, sources)
+    GL.glCompileShader(shader)
 
     # If there is a syntax or other compiler error during shader compilation,
     # we'd like to know
-    compileOk = glGetShaderiv(shader, GL_COMPILE_STATUS)
+    compileOk = GL.glGetShaderiv(shader, GL.GL_COMPILE_STATUS)
 
     if not compileOk:
         err = getShaderInfoLog(shader)
         print("SHADER COMPILE ERROR: '%s'" % err)
         return False
 
-    glAttachShader(shaderProgram, shader)
-    glDeleteShader(shader)
+    GL.glAttachShader(shaderProgram, shader)
+    GL.glDeleteShader(shader)
     return True
 
 
@@ -336,43 +362,107 @@ def compileAndAttachShader(shaderProgram, shaderType, sources):
 # to the shader and the also any number of output shader variables
 # The fragDataLocs can be left out for programs that don't use multiple render targets as 
 # the default for any output variable is zero.
-def buildShader(vertexShaderSources, fragmentShaderSources, attribLocs, fragDataLocs={}):
-    shader_program = glCreateProgram()
-
-    if compileAndAttachShader(shader_program, GL_VERTEX_SHADER, vertexShaderSources) and \
-            compileAndAttachShader(shader_program, GL_FRAGMENT_SHADER, fragmentShaderSources):
+# Set retrievable to be able to get the linked program binary (see utils/shader_cache.py).
+def buildShader(vertexShaderSources, fragmentShaderSources, attribLocs, fragDataLocs={}, retrievable=False):
+    shader_program = GL.glCreateProgram()
+    if retrievable:
+        GL.glProgramParameteri(shader_program, GL.GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL.GL_TRUE)
+
+    if compileAndAttachShader(shader_program, GL.GL_VERTEX_SHADER, vertexShaderSources) and \
+            compileAndAttachShader(shader_program, GL.GL_FRAGMENT_SHADER, fragmentShaderSources):
         # Link the attribute names we used in the vertex shader to the integer index
         for name, loc in attribLocs.items():
-            glBindAttribLocation(shader_program, loc, name)
+            GL.glBindAttribLocation(shader_program, loc, name)
 
             # If we have multiple images bound as render targets, we need to specify which
             # 'out' variable in the fragment shader goes where in this case it is totally redundant
         # as we only have one (the default render target, or frame buffer) and the default binding is always zero.
         for name, loc in fragDataLocs.items():
-            glBindFragDataLocation(shader_program, loc, name)
+            GL.glBindFragDataLocation(shader_program, loc, name)
 
         # once the bindings are done we can link the program stages to get a complete shader pipeline.
         # this can yield errors, for example if the vertex and fragment shaders don't have compatible out and in 
         # variables (e.g., the fragment shader expects some data that the vertex shader is not outputting).
-        glLinkProgram(shader_program)
+        GL.glLinkProgram(shader_program)
         # Now check if the linking was successful
-        success = glGetProgramiv(shader_program, GL_LINK_STATUS)
+        success = GL.glGetProgramiv(shader_program, GL.GL_LINK_STATUS)
         if not success:
-            err = glGetProgramInfoLog(shader_program)
+            err = GL.glGetProgramInfoLog(shader_program)
             print("SHADER LINKER ERROR: '%s'" % err)
             sys.exit(1)
-    return shader_program
+    return ShaderProgram(shader_program)
+
+
+# Uniform buffer binding points, for the blocks that are shared between the shaders.
+UBS_FrameUniforms = 0
+UBS_ObjectUniforms = 1
+UBS_MaterialProperties = 2
+
+# Maps uniform block names to the binding point they are bound to in every program that uses them, filled in
+# by the uniform block layouts (see utils/uniform_buffer.py).
+g_uniformBlockBindings = {}
+
+
+# Set to True to print a message (once per name and program) whenever a uniform is set that is not active in
+# the shader program, i.e., it is either not declared or it is unused and removed by the shader compiler.
+g_debugUniforms = False
+
+
+# A shader program object (it is an int, so it can be passed to any of the GL functions as is), that also keeps
+# a table of the locations and types of all the active uniforms. The table is built once by introspecting the
+# program after it is linked (see buildShader), so looking up a uniform location does not involve the driver.
+class ShaderProgram(int):
+    def __new__(cls, programId):
+        self = int.__new__(cls, programId)
+        # uniform name -> (location, type, array size)
+        self.uniforms = {}
+        self.reportedInactiveUniforms = set()
+        self.introspectUniforms()
+        self.bindUniformBlocks()
+        return self
+
+    def bindUniformBlocks(self):
+        for name, bindingPoint in g_uniformBlockBindings.items():
+            blockIndex = GL.glGetUniformBlockIndex(self, name)
+            if blockIndex != GL.GL_INVALID_INDEX:
+                GL.glUniformBlockBinding(self, blockIndex, bindingPoint)
+
+    def introspectUniforms(self):
+        self.uniforms = {}
+        if not GL.glGetProgramiv(self, GL.GL_LINK_STATUS):
+            return
+        for index in range(GL.glGetProgramiv(self, GL.GL_ACTIVE_UNIFORMS)):
+            name, size, uniformType = GL.glGetActiveUniform(self, index)
+            name = name.decode() if isinstance(name, bytes) else name
+            location = int(GL.glGetUniformLocation(self, name))
+            # uniforms in uniform blocks don't have a location
+            if location == -1:
+                continue
+            self.uniforms[name] = (location, int(uniformType), int(size))
+            # arrays are reported as 'name[0]' but may be referred to by just 'name' also
+            if name.endswith("[0]"):
+                self.uniforms[name[:-3]] = self.uniforms[name]
+
+    def getUniformLocation(self, name):
+        uniform = self.uniforms.get(name)
+        if uniform is not None:
+            return uniform[0]
+        if g_debugUniforms and name not in self.reportedInactiveUniforms:
+            self.reportedInactiveUniforms.add(name)
+            print("Uniform '%s' is set but not active in shader program %d" % (name, self))
+        return -1
 
 
 # Helper for debugging, if uniforms appear to not be set properly, you can set a breakpoint here,
-# or uncomment the printing code. If the 'loc' returned is -1, then the variable is either not 
+# or set g_debugUniforms to True. If the 'loc' returned is -1, then the variable is either not
 # declared at all in the shader or it is not used  and therefore removed by the optimizing shader compiler.
+# For programs created by buildShader this is a dictionary lookup in the table of active uniforms.
 def getUniformLocationDebug(shaderProgram, name):
-    loc = glGetUniformLocation(shaderProgram, name)
-    # Useful point for debugging, replace with silencable logging 
-    # TODO: should perhaps replace this with the standard python logging facilities
-    # if loc == -1:
-    #    print("Uniforn '%s' was not found"%name)
+    if isinstance(shaderProgram, ShaderProgram):
+        return shaderProgram.getUniformLocation(name)
+    loc = GL.glGetUniformLocation(shaderProgram, name)
+    if g_debugUniforms and loc == -1:
+        print("Uniform '%s' was not found" % name)
     return loc
 
 
@@ -381,18 +471,19 @@ def getUniformLocationDebug(shaderProgram, name):
 # makes no claim of completeness. The last case is for Mat3/Mat4 (above), and if you get an exception 
 # on that line, it is likely because the function was cal
 def setUniform(shaderProgram, uniformName, value):
+    g_profiler.count("uniformUploads")
     loc = getUniformLocationDebug(shaderProgram, uniformName)
     if isinstance(value, float):
-        glUniform1f(loc, value)
+        GL.glUniform1f(loc, value)
     elif isinstance(value, int):
-        glUniform1i(loc, value)
+        GL.glUniform1i(loc, value)
     elif isinstance(value, (np.ndarray, list)):
         if len(value) == 2:
-            glUniform2fv(loc, 1, value)
+            GL.glUniform2fv(loc, 1, value)
         if len(value) == 3:
-            glUniform3fv(loc, 1, value)
+            GL.glUniform3fv(loc, 1, value)
         if len(value) == 4:
-            glUniform4fv(loc, 1, value)
+            GL.glUniform4fv(loc, 1, value)
     elif isinstance(value, (Mat3, Mat4)):
         value._set_open_gl_uniform(loc)
     else:
@@ -404,8 +495,31 @@ def setUniform(shaderProgram, uniformName, value):
 # but this covers the correct implementation).
 # Note that it does not work for vectors! For vectors we're usually better off just using the 3x3 part of the matrix.
 def transformPoint(mat4x4, point):
-    x, y, z, w = mat4x4 * [point[0], point[1], point[2], 1.0]
-    return vec3(x, y, z) / w
+    return math3d.transformPoints(mat4x4.matData, point[:3])
+
+
+# Extracts the six planes (left, right, bottom, top, near, far) of the view frustum from a world (or model) to clip
+# space transform, e.g., viewToClipTransform * worldToViewTransform. Returns a (6, 4) array of planes (nx, ny, nz, d)
+# with the normals pointing into the frustum, such that a point p is on the inside of a plane if dot(n, p) + d >= 0.
+# (See Gribb & Hartmann, "Fast Extraction of Viewing Frustum Planes from the World-View-Projection Matrix")
+def extractFrustumPlanes(toClipTransform):
+    m = np.asarray(toClipTransform.matData if isinstance(toClipTransform, Mat4) else toClipTransform, dtype=np.float64)
+    planes = np.array([m[3] + m[0], m[3] - m[0],
+                       m[3] + m[1], m[3] - m[1],
+                       m[3] + m[2], m[3] - m[2]])
+    return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+
+
+# Tests N axis aligned boxes, given by (N, 3) arrays of min and max corners, against the frustum planes, returns
+# a bool array that is False for the boxes that are entirely outside at least one of the planes. The test is
+# conservative, i.e., some boxes near the corners of the frustum are kept even though they are outside.
+def aabbsInFrustum(planes, boxMin, boxMax):
+    inside = np.ones(len(boxMin), dtype=bool)
+    for n in planes:
+        # The corner of each box that is furthest along the plane normal
+        p = np.where(n[:3] >= 0.0, boxMax, boxMin)
+        inside &= p @ n[:3] + n[3] >= 0.0
+    return inside
 
 
 # just a wrapper to convert the returned tuple to a list...
@@ -460,5 +574,5 @@ g_numSphereVerts = 0
 
 
 def bindTexture(texUnit, textureId, defaultTexture=None):
-    glActiveTexture(GL_TEXTURE0 + texUnit)
-    glBindTexture(GL_TEXTURE_2D, textureId if textureId != -1 else defaultTexture)
+    GL.glActiveTexture(GL.GL_TEXTURE0 + texUnit)
+    GL.glBindTexture(GL.GL_TEXTURE_2D, textureId if textureId != -1 else defaultTexture)
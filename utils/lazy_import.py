@@ -0,0 +1,49 @@
+"""Modules that are imported the first time they are used rather than when the importing module is loaded.
+
+Importing OpenGL.GL, imgui and PIL takes a good part of a second, which the tools that only use the terrain
+queries or the math (e.g., the headless simulation, see models/simulation.py) should not have to pay for. The
+modules on their import path bind these lazily instead:
+
+    GL = lazyModule("OpenGL.GL")
+    ...
+    GL.glBindVertexArray(self.vertexArrayObject)
+
+The first attribute access imports the module, and the attributes that are used are then copied onto the proxy so
+later lookups cost the same as on the module itself. The time taken by each of these imports is kept in
+LazyModule.loadTimes, for the startup profile (see main.py --profile-startup).
+"""
+
+import importlib
+import time
+
+
+class LazyModule:
+    # module name -> seconds taken to import it, in the order they were imported
+    loadTimes = {}
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            start = time.perf_counter()
+            self._module = importlib.import_module(self._name)
+            LazyModule.loadTimes.setdefault(self._name, time.perf_counter() - start)
+        return self._module
+
+    # Only called for attributes that are not already on the proxy
+    def __getattr__(self, name):
+        if name.startswith("__") or name in ("_name", "_module"):
+            raise AttributeError(name)
+        value = getattr(self._load(), name)
+        setattr(self, name, value)
+        return value
+
+    def __repr__(self):
+        return "<lazy module '%s'%s>" % (self._name, "" if self._module is None else " (loaded)")
+
+
+# Returns a proxy for the module that imports it on first use
+def lazyModule(name):
+    return LazyModule(name)
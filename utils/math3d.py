@@ -0,0 +1,284 @@
+"""Transform and vector math on plain float32 numpy arrays.
+
+Matrices are (4, 4) or (3, 3) arrays in the usual mathematical (row major) layout, i.e., they transform column
+vectors: p' = M p, and compose right to left, just like lab_utils.Mat4. All functions accept stacks of matrices
+((N, 4, 4) arrays) or of parameters (e.g., an array of N angles) and then do the whole batch in one go.
+
+Every function that produces a matrix or vector takes an optional 'out' array to write the result into, so
+that per-frame code can reuse preallocated arrays instead of allocating new ones. The result is returned either
+way. lab_utils.Mat4 and Mat3 are thin wrappers over these arrays.
+"""
+
+import math
+
+import numpy as np
+
+
+def _output(out, shape):
+    return np.empty(shape, dtype=np.float32) if out is None else out
+
+
+_IDENTITY = {3: np.identity(3, dtype=np.float32), 4: np.identity(4, dtype=np.float32)}
+
+
+# Identity matrix, or fills a stack of matrices with identities
+def identity(size=4, out=None):
+    out = _output(out, (size, size))
+    out[...] = _IDENTITY[size]
+    return out
+
+
+# a * b for single matrices or (N, ...) stacks, out may be one of the inputs (in-place composition).
+# np.dot is used for single matrices since it has a lot less call overhead than np.matmul.
+def multiply(a, b, out=None):
+    if a.ndim == 2 and b.ndim == 2:
+        return np.dot(a, b, out=out)
+    return np.matmul(a, b, out=out)
+
+
+def transpose(m, out=None):
+    t = np.swapaxes(m, -1, -2)
+    if out is None:
+        return np.array(t, dtype=np.float32)
+    out[...] = t
+    return out
+
+
+# Inverts in double precision, projection matrices are badly conditioned enough for float32 to lose digits
+def inverse(m, out=None):
+    inv = np.linalg.inv(np.asarray(m, dtype=np.float64))
+    if out is None:
+        return inv.astype(np.float32, copy=False)
+    out[...] = inv
+    return out
+
+
+#
+# Construction, the parameters may be scalars or arrays of N values (giving (N, 4, 4) results)
+#
+
+def makeTranslation(x, y, z, out=None):
+    shape = np.broadcast(x, y, z).shape
+    out = identity(4, _output(out, shape + (4, 4)))
+    out[..., 0, 3] = x
+    out[..., 1, 3] = y
+    out[..., 2, 3] = z
+    return out
+
+
+def makeScale(x, y, z, out=None):
+    shape = np.broadcast(x, y, z).shape
+    out = identity(4, _output(out, shape + (4, 4)))
+    out[..., 0, 0] = x
+    out[..., 1, 1] = y
+    out[..., 2, 2] = z
+    return out
+
+
+# Rotation by 'angle' radians about the axis (0 = x, 1 = y or 2 = z), counter-clockwise looking down the axis
+def _makeRotation(angle, axis, out):
+    if np.ndim(angle) == 0:
+        c = math.cos(angle)
+        s = math.sin(angle)
+    else:
+        c = np.cos(angle)
+        s = np.sin(angle)
+    out = identity(4, _output(out, np.shape(angle) + (4, 4)))
+    i, j = [(1, 2), (2, 0), (0, 1)][axis]
+    out[..., i, i] = c
+    out[..., i, j] = -s
+    out[..., j, i] = s
+    out[..., j, j] = c
+    return out
+
+
+def makeRotationX(angle, out=None):
+    return _makeRotation(angle, 0, out)
+
+
+def makeRotationY(angle, out=None):
+    return _makeRotation(angle, 1, out)
+
+
+def makeRotationZ(angle, out=None):
+    return _makeRotation(angle, 2, out)
+
+
+# Single 3-vectors as tuples of python floats, which is much quicker than numpy for the matrices built once per
+# frame or object.
+def _normalize3(v):
+    x, y, z = float(v[0]), float(v[1]), float(v[2])
+    scale = 1.0 / math.sqrt(x * x + y * y + z * z)
+    return x * scale, y * scale, z * scale
+
+
+def _cross3(a, b):
+    return a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0]
+
+
+# See lab_utils.make_mat4_from_zAxis, works on (N, 3) arrays of translations and axes too.
+def makeFromZAxis(translation, zAxis, yAxis, out=None):
+    if np.ndim(zAxis) == 1 and np.ndim(translation) == 1:
+        z = _normalize3(zAxis)
+        x = _normalize3(_cross3(yAxis, z))
+        y = _cross3(z, x)
+        out = _output(out, (4, 4))
+        out[:3, 0] = x
+        out[:3, 1] = y
+        out[:3, 2] = z
+        out[:3, 3] = translation[:3]
+        out[3] = (0.0, 0.0, 0.0, 1.0)
+        return out
+    z = normalize(np.asarray(zAxis, dtype=np.float32)[..., :3])
+    x = normalize(cross(np.asarray(yAxis, dtype=np.float32)[..., :3], z))
+    y = cross(z, x)
+    out = _output(out, np.broadcast(z, np.asarray(translation)[..., :3]).shape[:-1] + (4, 4))
+    out[..., :3, 0] = x
+    out[..., :3, 1] = y
+    out[..., :3, 2] = z
+    out[..., :3, 3] = np.asarray(translation)[..., :3]
+    out[..., 3, :3] = 0.0
+    out[..., 3, 3] = 1.0
+    return out
+
+
+# See lab_utils.make_lookFrom, the basis and translation are worked out in double precision (python floats) as the eye
+# may be far from the origin.
+def makeLookFrom(eye, direction, up, out=None):
+    f = _normalize3(direction)
+    s = _normalize3(_cross3(f, up))
+    u = _cross3(s, f)
+    ex, ey, ez = float(eye[0]), float(eye[1]), float(eye[2])
+    out = _output(out, (4, 4))
+    out[0] = (s[0], s[1], s[2], -(s[0] * ex + s[1] * ey + s[2] * ez))
+    out[1] = (u[0], u[1], u[2], -(u[0] * ex + u[1] * ey + u[2] * ez))
+    out[2] = (-f[0], -f[1], -f[2], f[0] * ex + f[1] * ey + f[2] * ez)
+    out[3] = (0.0, 0.0, 0.0, 1.0)
+    return out
+
+
+def makeLookAt(eye, target, up, out=None):
+    return makeLookFrom(eye, [float(target[i]) - float(eye[i]) for i in range(3)], up, out)
+
+
+def makePerspective(yFovDeg, aspect, n, f, out=None):
+    tanHalfFovY = math.tan(math.radians(yFovDeg) / 2.0)
+    out = _output(out, (4, 4))
+    out[...] = 0.0
+    out[0, 0] = 1.0 / (tanHalfFovY * aspect)
+    out[1, 1] = 1.0 / tanHalfFovY
+    out[2, 2] = -(f + n) / (f - n)
+    out[2, 3] = -(2.0 * f * n) / (f - n)
+    out[3, 2] = -1.0
+    return out
+
+
+# True for the matrices (or each matrix in a stack) whose upper 3x3 part is a rotation with uniform scale, i.e., where
+# the columns are orthogonal and have the same length. The translation does not matter.
+def isRigidUniformScale(m, tolerance=1.0e-4):
+    if m.ndim == 2:
+        # The dot products of the columns, in python floats
+        c = m[:3, :3].T.tolist()
+        lengths2 = [c[i][0] * c[i][0] + c[i][1] * c[i][1] + c[i][2] * c[i][2] for i in range(3)]
+        scale2 = sum(lengths2) / 3.0
+        dots = [c[i][0] * c[j][0] + c[i][1] * c[j][1] + c[i][2] * c[j][2] for i, j in ((0, 1), (0, 2), (1, 2))]
+        return max(abs(l - scale2) for l in lengths2 + [scale2 + d for d in dots]) <= tolerance * scale2
+    m3 = m[..., :3, :3]
+    gram = np.matmul(np.swapaxes(m3, -1, -2), m3)
+    scale2 = np.trace(gram, axis1=-2, axis2=-1) / 3.0
+    deviation = np.abs(gram - scale2[..., None, None] * _IDENTITY[3]).max(axis=(-2, -1))
+    return deviation <= tolerance * scale2
+
+
+# The transforms for normals, the inverse transpose of the upper 3x3 part of the matrix (or of each matrix in a stack).
+# For a rotation R with uniform scale s this is simply s R / s^2, so no inverse is needed for the matrices where
+# rigid (see isRigidUniformScale) is True. Returns (N, 3, 3) for a stack.
+def normalTransforms(m, rigid=None, out=None):
+    m3 = m[..., :3, :3]
+    if rigid is None:
+        rigid = isRigidUniformScale(m)
+    out = _output(out, m3.shape)
+    if m.ndim == 2:
+        if rigid:
+            scale2 = sum(x * x for row in m3.tolist() for x in row) / 3.0
+            np.multiply(m3, 1.0 / scale2, out=out)
+        else:
+            out[...] = np.linalg.inv(np.asarray(m3, dtype=np.float64)).T
+        return out
+    scale2 = np.einsum("nij,nij->n", m3, m3) / 3.0
+    np.divide(m3, scale2[:, None, None], out=out)
+    general = ~rigid
+    if general.any():
+        out[general] = np.swapaxes(np.linalg.inv(np.asarray(m3[general], dtype=np.float64)), -1, -2)
+    return out
+
+
+#
+# Applying transforms
+#
+
+# Transforms (N, 3) points (or a single point) by a 4x4 matrix, including the division by w
+def transformPoints(m, points, out=None):
+    if np.ndim(points) == 1:
+        x, y, z = float(points[0]), float(points[1]), float(points[2])
+        p = m.dot((x, y, z, 1.0))
+        out = _output(out, (3,))
+        np.divide(p[:3], p[3], out=out)
+        return out
+    points = np.asarray(points, dtype=np.float32)[..., :3]
+    out = np.dot(points, m[:3, :3].T, out=_output(out, points.shape[:-1] + (3,)))
+    out += m[:3, 3]
+    out /= (np.dot(points, m[3, :3]) + m[3, 3])[..., None]
+    return out
+
+
+# Transforms (N, 3) directions (or a single direction) by the upper 3x3 part of a matrix, i.e., without translation
+def transformVectors(m, vectors, out=None):
+    vectors = np.asarray(vectors, dtype=np.float32)[..., :3]
+    return np.dot(vectors, m[:3, :3].T, out=_output(out, vectors.shape[:-1] + (3,)))
+
+
+# Rotates (N, 3) vectors about the z axis by (N, ) angles (or one angle for all), out may be the vectors
+def rotateZ(vectors, angles, out=None):
+    out = _output(out, np.shape(vectors))
+    if np.ndim(vectors) == 1:
+        # A single vector, plain floats are a lot quicker than 0-d arrays
+        c = math.cos(angles)
+        s = math.sin(angles)
+        x, y, z = float(vectors[0]), float(vectors[1]), float(vectors[2])
+        out[0] = c * x - s * y
+        out[1] = s * x + c * y
+        out[2] = z
+        return out
+    c = np.cos(angles)
+    s = np.sin(angles)
+    x = vectors[:, 0] * c - vectors[:, 1] * s
+    out[:, 1] = vectors[:, 0] * s + vectors[:, 1] * c
+    out[:, 0] = x
+    if out is not vectors:
+        out[:, 2] = vectors[:, 2]
+    return out
+
+
+#
+# Vectors, (N, 3) arrays work along the last axis
+#
+
+# np.cross has a lot of overhead for 3-vectors, this does the same along the last axis (in double precision if either
+# input is)
+def cross(a, b, out=None):
+    a = np.asarray(a)
+    b = np.asarray(b)
+    if out is None:
+        out = np.empty(np.broadcast(a, b).shape, dtype=np.result_type(a, b, np.float32))
+    ax, ay, az = a[..., 0], a[..., 1], a[..., 2]
+    bx, by, bz = b[..., 0], b[..., 1], b[..., 2]
+    out[..., 0] = ay * bz - az * by
+    out[..., 1] = az * bx - ax * bz
+    out[..., 2] = ax * by - ay * bx
+    return out
+
+
+def normalize(v, out=None):
+    v = np.asarray(v, dtype=np.float32)
+    return np.divide(v, np.linalg.norm(v, axis=-1, keepdims=True), out=out)
@@ -0,0 +1,227 @@
+"""Fast loading of OBJ meshes into contiguous float32 arrays, and a compiled binary mesh format.
+
+parseObj streams through the lines of an OBJ file once, only sorting the lines by type, and then converts
+all vertex data and face indices with a handful of whole-array numpy operations. The result is an
+ObjMeshData which ObjModel uploads directly.
+
+compileObj writes the parsed mesh to a binary file (see utils/binary_cache.py) next to the source, and
+loadMesh will then memory-map that instead of parsing the OBJ, as long as it is newer than the source.
+Compile the models offline with:
+
+    python -m utils.obj_loader data/racer_02.obj [more.obj ...]
+"""
+
+import os
+import sys
+
+import numpy as np
+
+from utils import binary_cache
+
+
+COMPILED_MESH_EXTENSION = '.mrmesh'
+COMPILED_MESH_MAGIC = b'MRMESH02'
+
+
+# The mesh data produced from an OBJ file. Positions, normals and uvs are float32 arrays with one row per
+# unique vertex (normals and uvs are None if the file has none), and indices holds three (uint16 or uint32) vertex indices per triangle. The chunks are
+# [materialName, offset, count] ranges of indices that share a material, in file order.
+# materialLibraries lists the 'mtllib' files, relative to the OBJ file.
+class ObjMeshData:
+    positions = None
+    normals = None
+    uvs = None
+    indices = None
+    chunks = []
+    materialLibraries = []
+    # The number of vertices the mesh would have without sharing any vertices between triangle corners
+    numCornerVertices = 0
+
+
+def _parseFloats(lines, numComponents, kind):
+    if not lines:
+        return np.zeros((0, numComponents), dtype=np.float32)
+    values = np.fromstring(" ".join(lines), dtype=np.float32, sep=" ")
+    if len(values) != numComponents * len(lines):
+        # Some lines have extra (or too few) values, e.g., vertex colours, fall back to line by line.
+        # Only the first numComponents values of each line are used.
+        rows = [l.split()[:numComponents] for l in lines]
+        assert all(len(r) == numComponents for r in rows), "bad '%s' line in OBJ file" % kind
+        values = np.array(rows, dtype=np.float32)
+    return values.reshape(-1, numComponents)
+
+
+# Returns the indices as uint16 if they all fit, otherwise uint32
+def _compactIndices(indices, numVertices):
+    return indices.astype(np.uint16 if numVertices <= 0xFFFF + 1 else np.uint32)
+
+
+# Parses the lines of an OBJ file (any iterable of strings, e.g., an open file) and returns an ObjMeshData.
+# Polygons are triangulated as fans around the first corner. Unless deduplicate is False, corners that
+# share the same position, uv and normal are merged into a single vertex.
+def parseObj(objLines, deduplicate=True):
+    positionLines = []
+    normalLines = []
+    uvLines = []
+    faceCorners = []
+    faceCornerCounts = []
+    materialLibraries = []
+    # [materialName, number of faces], the chunk changes whenever a 'usemtl' names a different material
+    materialChunks = []
+
+    for l in objLines:
+        tokens = l.split(None, 1)
+        if not tokens or tokens[0][:1] == "#":
+            continue
+        kind = tokens[0]
+        rest = tokens[1] if len(tokens) > 1 else ""
+        if kind == "v":
+            positionLines.append(rest)
+        elif kind == "vt":
+            uvLines.append(rest)
+        elif kind == "vn":
+            normalLines.append(rest)
+        elif kind == "f":
+            corners = rest.split()
+            assert len(corners) >= 3
+            faceCorners += corners
+            faceCornerCounts.append(len(corners))
+            if not materialChunks:
+                materialChunks.append([None, 0])
+            materialChunks[-1][1] += 1
+        elif kind == "usemtl":
+            materialName = " ".join(rest.split())
+            if not materialChunks or materialChunks[-1][0] != materialName:
+                materialChunks.append([materialName, 0])
+        elif kind == "mtllib":
+            materialLibraries.append(" ".join(rest.split()))
+
+    positions = _parseFloats(positionLines, 3, "v")
+    normals = _parseFloats(normalLines, 3, "vn")
+    # Only the first two texture coordinates are used
+    uvs = _parseFloats(uvLines, 2, "vt")
+
+    # Face corners are 'p/t/n' index triplets (1-based), where 't' and 'n' may be empty (e.g., 'p//n' or 'p/t/').
+    # Turn them all into one long string of integers where a missing index becomes 0 (i.e., -1 once adjusted)
+    cornerText = (" ".join(faceCorners) + " ").replace("//", "/0/").replace("/ ", "/0 ").replace("/", " ")
+    cornerIndices = np.fromstring(cornerText, dtype=np.int64, sep=" ")
+    assert len(cornerIndices) == 3 * len(faceCorners), "OBJ face corners must be of the form 'p/t/n', 'p//n' or 'p/t/'"
+    cornerIndices = cornerIndices.reshape(-1, 3) - 1
+
+    # Triangulate each face as a fan: (0, 1, 2), (0, 2, 3), ...
+    counts = np.array(faceCornerCounts, dtype=np.int64)
+    faceStarts = np.cumsum(counts) - counts
+    trianglesPerFace = counts - 2
+    triangleFace = np.repeat(np.arange(len(counts)), trianglesPerFace)
+    triangleInFace = np.arange(len(triangleFace)) - np.repeat(np.cumsum(trianglesPerFace) - trianglesPerFace,
+                                                              trianglesPerFace)
+    first = faceStarts[triangleFace]
+    triangleCorners = np.stack([first, first + triangleInFace + 1, first + triangleInFace + 2], axis=1).ravel()
+    corners = cornerIndices[triangleCorners]
+
+    mesh = ObjMeshData()
+    mesh.materialLibraries = materialLibraries
+    mesh.numCornerVertices = len(corners)
+
+    if deduplicate and len(corners):
+        # Pack each (position, uv, normal) triplet into one integer key, shifted by one since missing
+        # indices are -1, and find the unique ones. The vertices are kept in the order they are first
+        # used to preserve the locality of the original mesh.
+        keys = ((corners[:, 0] + 1) * (len(uvs) + 1) + (corners[:, 1] + 1)) * (len(normals) + 1) + (corners[:, 2] + 1)
+        _, firstUse, cornerVertex = np.unique(keys, return_index=True, return_inverse=True)
+        order = np.argsort(firstUse)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        vertexCorners = corners[firstUse[order]]
+        indices = rank[cornerVertex.ravel()]
+    else:
+        vertexCorners = corners
+        indices = np.arange(len(corners))
+
+    mesh.positions = positions[vertexCorners[:, 0]]
+    # Attributes that no corner refers to are left out (None), missing normals on some corners pick the
+    # last normal, as the original loader did.
+    if len(normals):
+        mesh.normals = normals[vertexCorners[:, 2]]
+    hasUv = vertexCorners[:, 1] >= 0
+    if hasUv.any():
+        mesh.uvs = np.zeros((len(vertexCorners), 2), dtype=np.float32)
+        mesh.uvs[hasUv] = uvs[vertexCorners[hasUv, 1]]
+    mesh.indices = _compactIndices(indices, len(vertexCorners))
+
+    # Convert the per-chunk face counts into ranges of corners
+    mesh.chunks = []
+    faceOffset = 0
+    cornerOffset = 0
+    for materialName, numFaces in materialChunks:
+        numCorners = 3 * int(trianglesPerFace[faceOffset:faceOffset + numFaces].sum())
+        mesh.chunks.append([materialName, cornerOffset, numCorners])
+        faceOffset += numFaces
+        cornerOffset += numCorners
+    return mesh
+
+
+def getCompiledMeshFileName(objFileName):
+    return os.path.splitext(objFileName)[0] + COMPILED_MESH_EXTENSION
+
+
+# Parses the OBJ file and writes the compiled binary mesh file, returns the name of the written file.
+def compileObj(objFileName, compiledFileName=None):
+    if not compiledFileName:
+        compiledFileName = getCompiledMeshFileName(objFileName)
+    with open(objFileName, "r") as inFile:
+        mesh = parseObj(inFile)
+    meta = {
+        "source": os.path.basename(objFileName),
+        "numCornerVertices": mesh.numCornerVertices,
+        "chunks": mesh.chunks,
+        "materialLibraries": mesh.materialLibraries,
+    }
+    arrays = {
+        "positions": mesh.positions,
+        "normals": mesh.normals,
+        "uvs": mesh.uvs,
+        "indices": mesh.indices,
+    }
+    binary_cache.writeArrays(compiledFileName, COMPILED_MESH_MAGIC, meta,
+                             {name: a for name, a in arrays.items() if a is not None})
+    return compiledFileName
+
+
+# Memory-maps a mesh written by compileObj, the arrays are read-only.
+def loadCompiledMesh(compiledFileName):
+    meta, arrays = binary_cache.readArrays(compiledFileName, COMPILED_MESH_MAGIC)
+    mesh = ObjMeshData()
+    mesh.positions = arrays["positions"]
+    mesh.normals = arrays.get("normals")
+    mesh.uvs = arrays.get("uvs")
+    mesh.indices = arrays["indices"]
+    mesh.numCornerVertices = meta["numCornerVertices"]
+    mesh.chunks = meta["chunks"]
+    mesh.materialLibraries = meta["materialLibraries"]
+    return mesh
+
+
+# Loads either an OBJ or a compiled mesh file. For an OBJ file, a compiled version next to it is used
+# instead if it is at least as new as the OBJ.
+def loadMesh(fileName):
+    if fileName.endswith(COMPILED_MESH_EXTENSION):
+        return loadCompiledMesh(fileName)
+
+    compiledFileName = getCompiledMeshFileName(fileName)
+    if os.path.exists(compiledFileName) and os.path.getmtime(compiledFileName) >= os.path.getmtime(fileName):
+        try:
+            return loadCompiledMesh(compiledFileName)
+        except (binary_cache.CacheFormatError, KeyError, OSError, ValueError) as e:
+            print("WARNING: ignoring bad compiled mesh '%s': %s" % (compiledFileName, e))
+
+    with open(fileName, "r") as inFile:
+        return parseObj(inFile)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python -m utils.obj_loader <file.obj> [<file.obj> ...]")
+        sys.exit(1)
+    for objFileName in sys.argv[1:]:
+        print("Compiled '%s' -> '%s'" % (objFileName, compileObj(objFileName)))
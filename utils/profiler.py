@@ -0,0 +1,238 @@
+"""A lightweight hierarchical CPU profiler for the game loop, with an ImGui panel to show the results.
+
+Sections of the frame are timed with scoped timers, which nest, so that a scope opened inside another is recorded
+under the path of both (e.g., "renderFrame/terrain"):
+
+    with profiler.scope("renderFrame"):
+        ...
+
+and events are counted with count (e.g., profiler.count("drawCalls")). The times and counts of the last
+historyLength frames are kept, for the graphs and percentiles in drawUi, and can be exported with exportCsv
+or exportJson for offline analysis.
+
+When the profiler is disabled (the default), scope returns a shared do-nothing object and count returns right
+away, so the instrumentation can be left in place at the cost of a function call.
+"""
+
+import csv
+import json
+import time
+
+from utils.lazy_import import lazyModule
+
+# Not needed to record the times, only to show and summarize them
+imgui = lazyModule("imgui")
+np = lazyModule("numpy")
+
+
+class _NullScope:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_SCOPE = _NullScope()
+
+
+class _Scope:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        stack = self.profiler.scopeStack
+        self.path = stack[-1] + "/" + self.name if stack else self.name
+        stack.append(self.path)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        elapsed = time.perf_counter() - self.start
+        self.profiler.scopeStack.pop()
+        times = self.profiler.frameTimes
+        times[self.path] = times.get(self.path, 0.0) + elapsed
+        return False
+
+
+class Profiler:
+    enabled = False
+    # The state passed to setEnabled, which takes effect between frames
+    requestedEnabled = False
+    # Number of frames to keep the times and counts of
+    historyLength = 300
+
+    def __init__(self):
+        self.scopeStack = []
+        # Seconds spent in each section (path) and counts of the frame in progress
+        self.frameTimes = {}
+        self.frameCounters = {}
+        self.frameStart = None
+        self.reset()
+
+    # Forgets all recorded frames
+    def reset(self):
+        self.numFrames = 0
+        # Frame number of each recorded frame, the frame time and the section times in ms and counters as lists in the
+        # order of the frames, at most historyLength long. Sections and counters that did not appear in a frame are 0.
+        self.frameNumbers = []
+        self.frameDurations = []
+        self.sectionHistory = {}
+        self.counterHistory = {}
+
+    # Enables or disables the profiler. Inside a frame or an open scope (e.g., from the checkbox in drawUi, which is
+    # drawn inside the "ui" scope) the change is deferred to the end of the frame, so the open scopes still close.
+    def setEnabled(self, enabled):
+        self.requestedEnabled = enabled
+        if not self.scopeStack and self.frameStart is None:
+            self._applyRequestedEnabled()
+
+    def _applyRequestedEnabled(self):
+        if self.requestedEnabled != self.enabled:
+            self.enabled = self.requestedEnabled
+            self.scopeStack = []
+            self.frameTimes = {}
+            self.frameCounters = {}
+            self.frameStart = None
+
+    def scope(self, name):
+        if not self.enabled:
+            return _NULL_SCOPE
+        return _Scope(self, name)
+
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        self.frameCounters[name] = self.frameCounters.get(name, 0) + amount
+
+    # Adds time measured elsewhere to a section of the current frame, e.g., GPU times (see utils/gpu_timer.py)
+    def addTime(self, path, seconds):
+        if not self.enabled:
+            return
+        self.frameTimes[path] = self.frameTimes.get(path, 0.0) + seconds
+
+    # Marks the start of a frame, the frame time is the time from one beginFrame to the next endFrame
+    def beginFrame(self):
+        if not self.scopeStack:
+            self._applyRequestedEnabled()
+        if not self.enabled:
+            return
+        self.frameTimes = {}
+        self.frameCounters = {}
+        self.frameStart = time.perf_counter()
+
+    def endFrame(self):
+        if self.enabled and self.frameStart is not None:
+            self._recordFrame()
+        if not self.scopeStack:
+            self._applyRequestedEnabled()
+
+    def _recordFrame(self):
+        frameDuration = time.perf_counter() - self.frameStart
+        self.frameStart = None
+
+        self.frameNumbers.append(self.numFrames)
+        self.frameDurations.append(1000.0 * frameDuration)
+        self._appendHistory(self.sectionHistory, {path: 1000.0 * t for path, t in self.frameTimes.items()})
+        self._appendHistory(self.counterHistory, self.frameCounters)
+        self.numFrames += 1
+
+        if len(self.frameNumbers) > self.historyLength:
+            del self.frameNumbers[0]
+            del self.frameDurations[0]
+            for values in list(self.sectionHistory.values()) + list(self.counterHistory.values()):
+                del values[0]
+
+    # Appends the values of this frame to the history lists, padding new names with zeros for the earlier frames
+    def _appendHistory(self, history, values):
+        numRecorded = len(self.frameNumbers) - 1
+        for name in values:
+            if name not in history:
+                history[name] = [0] * numRecorded
+        for name, valueList in history.items():
+            valueList.append(values.get(name, 0))
+
+    # Returns (mean, 50th, 95th, 99th percentile) of a list of values
+    def getStatistics(self, values):
+        if not values:
+            return 0.0, 0.0, 0.0, 0.0
+        p50, p95, p99 = np.percentile(values, [50.0, 95.0, 99.0])
+        return float(np.mean(values)), float(p50), float(p95), float(p99)
+
+    # One row per recorded frame, with the frame time and the time of each section in ms, followed by the counters
+    def exportCsv(self, fileName):
+        sections = sorted(self.sectionHistory)
+        counters = sorted(self.counterHistory)
+        with open(fileName, "w", newline="") as outFile:
+            writer = csv.writer(outFile)
+            writer.writerow(["frame", "frameTime"] + sections + counters)
+            for i, frameNumber in enumerate(self.frameNumbers):
+                writer.writerow([frameNumber, "%0.4f" % self.frameDurations[i]]
+                                + ["%0.4f" % self.sectionHistory[s][i] for s in sections]
+                                + [self.counterHistory[c][i] for c in counters])
+
+    # The recorded frames along with the statistics of each section
+    def exportJson(self, fileName):
+        statistics = {name: dict(zip(["mean", "p50", "p95", "p99"], self.getStatistics(values)))
+                      for name, values in [("frameTime", self.frameDurations)] + sorted(self.sectionHistory.items())}
+        with open(fileName, "w") as outFile:
+            json.dump({
+                "frames": self.frameNumbers,
+                "frameTime": self.frameDurations,
+                "sections": self.sectionHistory,
+                "counters": self.counterHistory,
+                "statistics": statistics,
+            }, outFile)
+
+    # Prints the section times of the last recorded frame, indented under their parents like in drawUi, e.g., for the
+    # startup profile where the whole startup is one frame
+    def printLastFrame(self, title):
+        if not self.frameDurations:
+            return
+        print("%-40s %9s" % (title, "ms"))
+        print("%-40s %9.1f" % ("total", self.frameDurations[-1]))
+        for name, values in sorted(self.sectionHistory.items()):
+            parent, _, leaf = name.rpartition("/")
+            label = "  " * name.count("/") + leaf if parent in self.sectionHistory else name
+            print("%-40s %9.1f" % ("  " + label, values[-1]))
+
+    def drawUi(self):
+        changed, enabled = imgui.checkbox("Enabled", self.requestedEnabled)
+        if changed:
+            self.setEnabled(enabled)
+        if not self.frameDurations:
+            return
+
+        frameTimes = np.array(self.frameDurations, dtype=np.float32)
+        imgui.plot_lines("FrameTime", frameTimes, overlay_text="%0.2fms" % frameTimes[-1],
+                         scale_min=0.0, graph_size=(0.0, 60.0))
+
+        imgui.text("%-32s %7s %7s %7s %7s" % ("ms", "mean", "p50", "p95", "p99"))
+        for name, values in [("frame", self.frameDurations)] + sorted(self.sectionHistory.items()):
+            # Indented under the parent section, or the full path if the parent is not timed (e.g., "gpu/terrain")
+            parent, _, leaf = name.rpartition("/")
+            label = "  " * name.count("/") + leaf if parent in self.sectionHistory else name
+            imgui.text("%-32s %7.2f %7.2f %7.2f %7.2f" % ((label,) + self.getStatistics(values)))
+
+        for name, values in sorted(self.sectionHistory.items()):
+            if "/" not in name:
+                imgui.plot_lines(name, np.array(values, dtype=np.float32), scale_min=0.0, graph_size=(0.0, 30.0))
+
+        for name, values in sorted(self.counterHistory.items()):
+            imgui.label_text(name, "%d" % values[-1])
+
+        if imgui.button("Export CSV"):
+            self.exportCsv("profile.csv")
+        imgui.same_line()
+        if imgui.button("Export JSON"):
+            self.exportJson("profile.json")
+        imgui.same_line()
+        if imgui.button("Reset"):
+            self.reset()
+
+
+# The profiler used by the game, e.g., 'from utils.profiler import g_profiler'
+g_profiler = Profiler()
+# Times the phases of starting the game as a single frame, enabled by main.py --profile-startup
+g_startupProfiler = Profiler()
@@ -0,0 +1,150 @@
+"""Shares shader programs built from the same sources, and keeps the linked program binaries between runs.
+
+Programs are keyed by a hash of the source strings of both stages and the attribute and fragment output bindings,
+so building the same program again (e.g., the default shader of every ObjModel) returns the program that was
+already built:
+
+    shader = g_shaderCache.buildShader([vertexShader], [fragmentShader], {"positionIn": 0})
+
+The arguments are the same as for lab_utils.buildShader. When the GL supports program binaries, the binary of
+each program is also saved to cacheDir (in a utils/binary_cache.py file) after it is linked, and loaded with
+glProgramBinary instead of compiling on the next run. The binary is only valid for the same driver, so the file
+records the GL vendor, renderer and version, and if those differ or the driver rejects the binary anyway the
+program is compiled from source and the file replaced.
+
+The programs are shared, so a uniform set on one (e.g., a sampler unit) is seen by all the users of the same
+sources.
+"""
+
+import ctypes
+import hashlib
+import os
+import time
+
+import imgui
+import numpy as np
+from OpenGL.GL import *
+# The PyOpenGL wrappers of these expect the output arrays in a form that is awkward to provide, the raw ones are used
+from OpenGL.raw.GL.VERSION.GL_4_1 import glGetProgramBinary, glProgramBinary
+
+from utils import binary_cache
+from utils import lab_utils as lu
+
+
+SHADER_CACHE_DIR = 'cache/shaders'
+SHADER_CACHE_MAGIC = b'MRSHADR1'
+
+
+# Returns a hex digest of everything that goes into a program, the sources and the bindings
+def getProgramKey(vertexShaderSources, fragmentShaderSources, attribLocs, fragDataLocs):
+    h = hashlib.sha1()
+    for sources in (vertexShaderSources, fragmentShaderSources):
+        # Like glShaderSource, a single string is accepted as well as a list of them
+        for source in [sources] if isinstance(sources, str) else sources:
+            h.update(source.encode("utf8"))
+            h.update(b"\0")
+        h.update(b"\1")
+    h.update(repr(sorted(attribLocs.items())).encode("utf8"))
+    h.update(repr(sorted(fragDataLocs.items())).encode("utf8"))
+    return h.hexdigest()
+
+
+class ShaderCache:
+    # Where to keep the program binaries, None to not keep them
+    cacheDir = SHADER_CACHE_DIR
+
+    def __init__(self):
+        # key -> ShaderProgram
+        self.programs = {}
+        # The GL vendor, renderer and version, which the binaries are only valid for, and whether binaries are
+        # supported at all. Queried on first use (there must be a context).
+        self.driver = None
+        self.binariesSupported = False
+        # How many programs were compiled from source, loaded from a binary, had a binary that was rejected and
+        # were already built (so shared)
+        self.numCompiled = 0
+        self.numBinariesLoaded = 0
+        self.numBinariesRejected = 0
+        self.numShared = 0
+        self.buildTime = 0.0
+
+    def buildShader(self, vertexShaderSources, fragmentShaderSources, attribLocs, fragDataLocs={}):
+        key = getProgramKey(vertexShaderSources, fragmentShaderSources, attribLocs, fragDataLocs)
+        program = self.programs.get(key)
+        if program is not None:
+            self.numShared += 1
+            return program
+
+        if self.driver is None:
+            self.driver = {"vendor": glGetString(GL_VENDOR).decode(), "renderer": glGetString(GL_RENDERER).decode(),
+                           "version": glGetString(GL_VERSION).decode()}
+            self.binariesSupported = glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS) > 0
+
+        start = time.perf_counter()
+        useBinary = self.cacheDir is not None and self.binariesSupported
+        program = self.loadBinary(key) if useBinary else None
+        if program is None:
+            program = lu.buildShader(vertexShaderSources, fragmentShaderSources, attribLocs, fragDataLocs,
+                                     retrievable=useBinary)
+            self.numCompiled += 1
+            if useBinary and glGetProgramiv(program, GL_LINK_STATUS):
+                self.saveBinary(key, program)
+        self.buildTime += time.perf_counter() - start
+
+        self.programs[key] = program
+        return program
+
+    def getFileName(self, key):
+        return os.path.join(self.cacheDir, "%s.bin" % key[:16])
+
+    # Returns the program created from the binary saved for the key, or None if there is none or it can't be used
+    def loadBinary(self, key):
+        fileName = self.getFileName(key)
+        if not os.path.exists(fileName):
+            return None
+        try:
+            meta, arrays = binary_cache.readArrays(fileName, SHADER_CACHE_MAGIC)
+            if meta.get("key") != key or meta.get("driver") != self.driver:
+                return None
+            binary = np.ascontiguousarray(arrays["binary"])
+            binaryFormat = meta["binaryFormat"]
+        except (binary_cache.CacheFormatError, KeyError, OSError, ValueError) as e:
+            print("WARNING: ignoring bad shader cache file '%s': %s" % (fileName, e))
+            return None
+
+        programId = glCreateProgram()
+        glProgramBinary(programId, binaryFormat, binary.ctypes.data_as(ctypes.c_void_p), binary.nbytes)
+        if not glGetProgramiv(programId, GL_LINK_STATUS):
+            # The driver may reject a binary at any time, e.g., after an update that kept the version string
+            glDeleteProgram(programId)
+            self.numBinariesRejected += 1
+            return None
+        self.numBinariesLoaded += 1
+        return lu.ShaderProgram(programId)
+
+    def saveBinary(self, key, program):
+        length = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+        if length <= 0:
+            return
+        binary = np.empty(length, dtype=np.uint8)
+        written = GLsizei(0)
+        binaryFormat = GLenum(0)
+        glGetProgramBinary(program, length, ctypes.byref(written), ctypes.byref(binaryFormat),
+                           binary.ctypes.data_as(ctypes.c_void_p))
+        meta = {"key": key, "driver": self.driver, "binaryFormat": binaryFormat.value}
+        try:
+            binary_cache.writeArrays(self.getFileName(key), SHADER_CACHE_MAGIC, meta, {"binary": binary[:written.value]})
+        except OSError as e:
+            print("WARNING: failed to write shader cache file '%s': %s" % (self.getFileName(key), e))
+
+    def drawUi(self):
+        imgui.label_text("Programs", "%d" % len(self.programs))
+        imgui.label_text("Compiled", "%d" % self.numCompiled)
+        imgui.label_text("BinariesLoaded", "%d" % self.numBinariesLoaded)
+        imgui.label_text("BinariesRejected", "%d" % self.numBinariesRejected)
+        imgui.label_text("Shared", "%d" % self.numShared)
+        imgui.label_text("BuildTime", "%0.1fms" % (1000.0 * self.buildTime))
+
+
+# The shader cache used by the game, for all the programs built from the shader files
+g_shaderCache = ShaderCache()
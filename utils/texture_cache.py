@@ -0,0 +1,279 @@
+"""Baked textures: the full mip chain of a texture computed offline and stored in a binary cache file (see
+utils/binary_cache.py), so that loading the texture is a memory map and an upload, without decoding the image or
+generating mipmaps on the GPU.
+
+A baked file holds every mip level as raw RGBA8 and, unless baked with compress=False, also block compressed:
+BC1 (DXT1) for opaque textures and BC3 (DXT5) for textures with alpha, i.e., 8:1 and 4:1 smaller than RGBA8. The
+compressed levels are used when the GL supports S3TC (see TextureManager.getCompressedFormat), the raw levels are
+the fallback. All levels are stored bottom-up, the layout glTexImage2D expects.
+
+Files are named after the image, and keyed by its content and the srgb flag (which changes how the mips are
+filtered), so a changed image is not picked up until it is baked again. Bake textures with:
+
+    python -m utils.texture_cache [--linear] [--no-compress] "data/grass2.png" "data/rock 2.png" ...
+
+The texture manager (utils/texture_manager.py) uses the baked file of a texture if there is an up to date one in
+TEXTURE_CACHE_DIR, and otherwise decodes the image as usual.
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from utils import binary_cache
+
+
+TEXTURE_CACHE_DIR = 'cache/textures'
+# Bump to invalidate all baked textures when the mip filtering or compression changes
+TEXTURE_CACHE_VERSION = 1
+TEXTURE_CACHE_MAGIC = b'MRTEXTR1'
+
+_SRGB_TO_LINEAR = np.where(np.arange(256) <= 10, np.arange(256) / (255.0 * 12.92),
+                           ((np.arange(256) / 255.0 + 0.055) / 1.055) ** 2.4).astype(np.float32)
+
+
+# The pixels of a texture, either decoded from an image file or read from a baked file. 'levels' holds the RGBA8
+# data of each mip level, there is only the first level unless it was baked. compressedLevels are the block
+# compressed levels ('bc1' or 'bc3', given by compression) of a baked texture, if any.
+class TextureImage:
+    compression = None
+    compressedLevels = None
+
+    def __init__(self, width, height, levels):
+        self.width = width
+        self.height = height
+        self.levels = levels
+
+
+# Decodes the image to bottom-up RGBA (or RGBX) bytes, the layout glTexImage2D expects. Returns a TextureImage
+# with a single level.
+def decodeImage(fileName):
+    with Image.open(fileName) as im:
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA")
+        data = im.tobytes("raw", "RGBX" if im.mode == 'RGB' else "RGBA", 0, -1)
+        return TextureImage(im.size[0], im.size[1], [data])
+
+
+# Returns the size of each level of the mip chain of a width x height texture, down to 1x1
+def getMipSizes(width, height):
+    sizes = [(width, height)]
+    while width > 1 or height > 1:
+        width, height = max(width // 2, 1), max(height // 2, 1)
+        sizes.append((width, height))
+    return sizes
+
+
+# Computes the full mip chain of an RGBA8 image (an array of shape (height, width, 4)) with a 2x2 box filter.
+# If srgb is set the colour channels are averaged in linear space, as glGenerateMipmap should for sRGB textures.
+# Odd sizes are rounded down like GL does, which drops the last row or column. Returns a list of RGBA8 arrays.
+def buildMipChain(pixels, srgb):
+    if srgb:
+        level = np.empty(pixels.shape, dtype=np.float32)
+        level[..., :3] = _SRGB_TO_LINEAR[pixels[..., :3]]
+        level[..., 3] = pixels[..., 3] * np.float32(1.0 / 255.0)
+    else:
+        level = pixels.astype(np.float32) * np.float32(1.0 / 255.0)
+
+    levels = [np.ascontiguousarray(pixels)]
+    for width, height in getMipSizes(pixels.shape[1], pixels.shape[0])[1:]:
+        # Axes of length 1 are not halved any more, the pair is just the same texel twice
+        rows = level[:2 * height] if level.shape[0] > 1 else np.concatenate([level, level])
+        cols = rows[:, :2 * width] if rows.shape[1] > 1 else np.concatenate([rows, rows], axis=1)
+        level = 0.25 * (cols[0::2, 0::2] + cols[1::2, 0::2] + cols[0::2, 1::2] + cols[1::2, 1::2])
+
+        out = np.empty(level.shape, dtype=np.float32)
+        if srgb:
+            linear = level[..., :3]
+            out[..., :3] = np.where(linear <= 0.0031308, 12.92 * linear,
+                                    1.055 * np.power(linear, 1.0 / 2.4) - 0.055)
+            out[..., 3] = level[..., 3]
+        else:
+            out[:] = level
+        levels.append(np.clip(np.rint(out * 255.0), 0, 255).astype(np.uint8))
+    return levels
+
+
+# Splits an RGBA8 image into 4x4 blocks, padding it up to a multiple of 4 texels by repeating the edges (the
+# smallest mips are less than a block). Returns an (numBlocks, 16, 4) float32 array, with the blocks row by row.
+def _getBlocks(pixels):
+    height, width = pixels.shape[:2]
+    padded = np.pad(pixels, ((0, -height % 4), (0, -width % 4), (0, 0)), mode='edge')
+    numRows, numCols = padded.shape[0] // 4, padded.shape[1] // 4
+    blocks = padded.reshape(numRows, 4, numCols, 4, 4).transpose(0, 2, 1, 3, 4)
+    return blocks.reshape(numRows * numCols, 16, 4).astype(np.float32)
+
+
+def _to565(colors):
+    r = np.rint(colors[:, 0] * (31.0 / 255.0)).astype(np.uint64)
+    g = np.rint(colors[:, 1] * (63.0 / 255.0)).astype(np.uint64)
+    b = np.rint(colors[:, 2] * (31.0 / 255.0)).astype(np.uint64)
+    return (r << np.uint64(11)) | (g << np.uint64(5)) | b
+
+
+def _from565(packed):
+    r = (packed >> np.uint64(11)) & np.uint64(31)
+    g = (packed >> np.uint64(5)) & np.uint64(63)
+    b = packed & np.uint64(31)
+    return np.stack([(r << np.uint64(3)) | (r >> np.uint64(2)),
+                     (g << np.uint64(2)) | (g >> np.uint64(4)),
+                     (b << np.uint64(3)) | (b >> np.uint64(2))], axis=-1).astype(np.float32)
+
+
+# Quantizes the end points of each block to 565 and picks the closest of the four palette colours for each texel.
+# Returns (color0, color1, indices, squaredError) per block.
+def _encodeColorBlocks(colors, end0, end1):
+    # The first end point must be the larger for the four colour mode (if they are equal all indices are 0 anyway)
+    color0, color1 = _to565(end0), _to565(end1)
+    swap = color0 < color1
+    color0[swap], color1[swap] = color1[swap], color0[swap]
+    end0, end1 = _from565(color0), _from565(color1)
+    palette = np.stack([end0, end1, (2.0 * end0 + end1) / 3.0, (end0 + 2.0 * end1) / 3.0], axis=1)
+
+    distances = ((colors[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=-1)
+    indices = np.argmin(distances, axis=2)
+    return color0, color1, indices, np.take_along_axis(distances, indices[..., None], axis=2).sum(axis=(1, 2))
+
+
+# Encodes the colour of each block (an (n, 16, 3) array) as a BC1 colour block in the four colour mode. The end
+# points start on the principal axis of the colours of the block, and are then refined with a least squares fit
+# given the palette entries picked for the texels. Returns an array of n uint64 blocks.
+def _compressColorBlocks(colors):
+    mean = colors.mean(axis=1, keepdims=True)
+    centered = colors - mean
+    covariance = np.einsum('nki,nkj->nij', centered, centered)
+    # A few steps of power iteration, starting from the channel with the largest variance
+    axis = covariance[np.arange(len(colors)), np.argmax(np.diagonal(covariance, axis1=1, axis2=2), axis=1)]
+    for _ in range(4):
+        axis = np.einsum('nij,nj->ni', covariance, axis)
+        axis /= np.maximum(np.linalg.norm(axis, axis=1, keepdims=True), 1.0e-12)
+    projected = np.einsum('nki,ni->nk', centered, axis)
+    high = np.clip(mean[:, 0] + projected.max(axis=1)[:, None] * axis, 0.0, 255.0)
+    low = np.clip(mean[:, 0] + projected.min(axis=1)[:, None] * axis, 0.0, 255.0)
+    color0, color1, indices, error = _encodeColorBlocks(colors, high, low)
+
+    # Each texel is w * end0 + (1 - w) * end1, solve the 2x2 normal equations for the end points
+    w0 = np.array([1.0, 0.0, 2.0 / 3.0, 1.0 / 3.0], dtype=np.float32)[indices]
+    w1 = 1.0 - w0
+    a, b, c = (w0 * w0).sum(axis=1), (w0 * w1).sum(axis=1), (w1 * w1).sum(axis=1)
+    r0, r1 = np.einsum('nk,nki->ni', w0, colors), np.einsum('nk,nki->ni', w1, colors)
+    det = a * c - b * b
+    solvable = np.abs(det) > 1.0e-6
+    det = np.where(solvable, det, 1.0)[:, None]
+    end0 = np.clip((c[:, None] * r0 - b[:, None] * r1) / det, 0.0, 255.0)
+    end1 = np.clip((a[:, None] * r1 - b[:, None] * r0) / det, 0.0, 255.0)
+    refined0, refined1, refinedIndices, refinedError = _encodeColorBlocks(colors, end0, end1)
+
+    better = solvable & (refinedError < error)
+    color0[better], color1[better], indices[better] = refined0[better], refined1[better], refinedIndices[better]
+    indices = indices.astype(np.uint64)
+    bits = (indices << (np.uint64(2) * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+    return color0 | (color1 << np.uint64(16)) | (bits << np.uint64(32))
+
+
+# Encodes the alpha of each block (an (n, 16) array) as a BC3 alpha block, in the eight alpha mode between the
+# smallest and largest alpha of the block. Returns an array of n uint64 blocks.
+def _compressAlphaBlocks(alphas):
+    alpha0 = np.rint(alphas.max(axis=1))
+    alpha1 = np.rint(alphas.min(axis=1))
+    weights = np.array([0.0, 7.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0], dtype=np.float32) / 7.0
+    palette = (1.0 - weights) * alpha0[:, None] + weights * alpha1[:, None]
+
+    indices = np.argmin(np.abs(alphas[:, :, None] - palette[:, None, :]), axis=2).astype(np.uint64)
+    bits = (indices << (np.uint64(3) * np.arange(16, dtype=np.uint64))).sum(axis=1, dtype=np.uint64)
+    return alpha0.astype(np.uint64) | (alpha1.astype(np.uint64) << np.uint64(8)) | (bits << np.uint64(16))
+
+
+# Block compresses an RGBA8 image (an array of shape (height, width, 4)) to 'bc1' or 'bc3', returns the bytes as a
+# uint8 array.
+def compressImage(pixels, compression):
+    blocks = _getBlocks(pixels)
+    colorBlocks = _compressColorBlocks(blocks[:, :, :3])
+    if compression == 'bc1':
+        return colorBlocks.astype('<u8').view(np.uint8)
+    alphaBlocks = _compressAlphaBlocks(blocks[:, :, 3])
+    return np.stack([alphaBlocks, colorBlocks], axis=1).astype('<u8').view(np.uint8).ravel()
+
+
+def getCacheKey(fileName, srgb):
+    return binary_cache.hashFileContents(fileName, bool(srgb), TEXTURE_CACHE_VERSION)
+
+
+def getCacheFileName(fileName, srgb, key, cacheDir):
+    baseName = os.path.splitext(os.path.basename(fileName))[0]
+    return os.path.join(cacheDir, "%s_%s_%s.bin" % (baseName, "srgb" if srgb else "linear", key[:16]))
+
+
+# Bakes the image to a file in cacheDir, replacing any older bake of the same image. Returns the file name and
+# the TextureImage that was written.
+def bakeTexture(fileName, srgb, compress=True, cacheDir=TEXTURE_CACHE_DIR):
+    key = getCacheKey(fileName, srgb)
+    decoded = decodeImage(fileName)
+    pixels = np.frombuffer(decoded.levels[0], dtype=np.uint8).reshape(decoded.height, decoded.width, 4)
+
+    image = TextureImage(decoded.width, decoded.height, buildMipChain(pixels, srgb))
+    arrays = {"level%d" % i: level for i, level in enumerate(image.levels)}
+    if compress:
+        image.compression = 'bc3' if np.any(pixels[..., 3] != 255) else 'bc1'
+        image.compressedLevels = [compressImage(level, image.compression) for level in image.levels]
+        arrays.update({"compressed%d" % i: level for i, level in enumerate(image.compressedLevels)})
+
+    cacheFileName = getCacheFileName(fileName, srgb, key, cacheDir)
+    prefix = os.path.basename(cacheFileName)[:-len("_%s.bin" % key[:16])]
+    binary_cache.removeStaleFiles(cacheDir, prefix, TEXTURE_CACHE_MAGIC, fileName, cacheFileName)
+
+    meta = {"key": key, "image": fileName, "srgb": bool(srgb), "width": image.width, "height": image.height,
+            "numLevels": len(image.levels), "compression": image.compression}
+    binary_cache.writeArrays(cacheFileName, TEXTURE_CACHE_MAGIC, meta, arrays)
+    return cacheFileName, image
+
+
+# Returns the TextureImage of the baked file of the image, with the levels memory-mapped from the file, or None if
+# there is no baked file or it is out of date.
+def loadBakedTexture(fileName, srgb, cacheDir=TEXTURE_CACHE_DIR):
+    if not os.path.isdir(cacheDir):
+        return None
+    key = getCacheKey(fileName, srgb)
+    cacheFileName = getCacheFileName(fileName, srgb, key, cacheDir)
+    if not os.path.exists(cacheFileName):
+        return None
+    try:
+        meta, arrays = binary_cache.readArrays(cacheFileName, TEXTURE_CACHE_MAGIC)
+        if meta.get("key") != key:
+            return None
+        numLevels = meta["numLevels"]
+        image = TextureImage(meta["width"], meta["height"], [arrays["level%d" % i] for i in range(numLevels)])
+        if meta["compression"]:
+            image.compression = meta["compression"]
+            image.compressedLevels = [arrays["compressed%d" % i] for i in range(numLevels)]
+        return image
+    except (binary_cache.CacheFormatError, KeyError, OSError, ValueError) as e:
+        print("WARNING: ignoring bad texture cache file '%s': %s" % (cacheFileName, e))
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--linear", action="store_true",
+                        help="the images are linear data (e.g., normal maps) rather than sRGB colours")
+    parser.add_argument("--no-compress", action="store_true", help="only store the raw RGBA8 mip levels")
+    parser.add_argument("--cache-dir", default=TEXTURE_CACHE_DIR)
+    args = parser.parse_args()
+
+    print("%-32s %11s %6s %10s %10s %8s" % ("image", "size", "format", "RGBA8 KB", "baked KB", "seconds"))
+    for fileName in args.files:
+        start = time.perf_counter()
+        cacheFileName, image = bakeTexture(fileName, not args.linear, not args.no_compress, args.cache_dir)
+        rawSize = sum(level.nbytes for level in image.levels)
+        bakedSize = sum(level.nbytes for level in image.compressedLevels) if image.compressedLevels else rawSize
+        print("%-32s %5dx%-5d %6s %10.0f %10.0f %8.2f" % (fileName, image.width, image.height,
+                                                         image.compression or "rgba8", rawSize / 1024.0,
+                                                         bakedSize / 1024.0, time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
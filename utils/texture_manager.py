@@ -0,0 +1,272 @@
+"""Loads textures with the image files decoded concurrently, and shares them between the users of the same file.
+
+Decoding (PIL) happens on a pool of worker threads, PIL releases the GIL while it decompresses so several images
+are decoded at once. Only the GL calls are made on the thread that owns the context, in finishLoading. The usual
+pattern is to request all the textures that are needed, which returns right away, and then finish them together:
+
+    grass = g_textureManager.request("data/grass2.png", srgb=True)
+    rock = g_textureManager.request("data/rock 2.png", srgb=True)
+    g_textureManager.finishLoading()
+    grassTextureId = grass.textureId
+
+Textures are shared by (normalized path, srgb), each request adds a reference and release removes one, deleting the
+texture when the last reference goes. The time to decode and to upload each texture is recorded, see drawUi.
+
+Textures that have been baked (see utils/texture_cache.py) are read from the baked file instead, which holds the
+mip levels, block compressed if the GL supports it, so nothing is decoded or generated.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import imgui
+from OpenGL.GL import *
+from OpenGL.GL.EXT.texture_compression_s3tc import GL_COMPRESSED_RGB_S3TC_DXT1_EXT, GL_COMPRESSED_RGBA_S3TC_DXT5_EXT
+from OpenGL.GL.EXT.texture_sRGB import GL_COMPRESSED_SRGB_S3TC_DXT1_EXT, GL_COMPRESSED_SRGB_ALPHA_S3TC_DXT5_EXT
+
+from utils import texture_cache
+
+
+# Reads the texture from its baked file (see utils/texture_cache.py) if there is an up to date one in cacheDir, or
+# otherwise decodes the image. Runs on a worker thread. Returns (TextureImage, seconds).
+def loadImage(fileName, srgb, cacheDir):
+    start = time.perf_counter()
+    image = texture_cache.loadBakedTexture(fileName, srgb, cacheDir) if cacheDir else None
+    if image is None:
+        image = texture_cache.decodeImage(fileName)
+    return image, time.perf_counter() - start
+
+
+class TextureEntry:
+    # The GL texture name, or -1 until it is loaded (and if loading failed)
+    textureId = -1
+    # GL_TEXTURE_2D, or GL_TEXTURE_2D_ARRAY for the textures made by requestArray
+    target = GL_TEXTURE_2D
+    width = 0
+    height = 0
+    numLayers = 1
+    decodeTime = 0.0
+    uploadTime = 0.0
+    failed = False
+    # How the texture is stored ('rgba8', 'bc1' or 'bc3'), the number of mip levels that were uploaded (rather than
+    # generated) and the estimated size in video memory
+    format = ""
+    numLevels = 0
+    memorySize = 0
+
+    def __init__(self, fileName, srgb):
+        self.fileName = fileName
+        self.srgb = srgb
+        self.refCount = 0
+        # The pending decodes (one per layer), set until finishLoading uploads the results
+        self.futures = []
+
+
+class TextureManager:
+    # Number of decoding threads, None lets the executor choose based on the number of CPUs
+    maxWorkers = None
+    # Where to look for baked textures, None to always decode the images
+    cacheDir = texture_cache.TEXTURE_CACHE_DIR
+    # Use the block compressed levels of baked textures, if the GL supports them
+    useCompression = True
+
+    # The GL internal formats of the block compressions for (compression, srgb)
+    COMPRESSED_FORMATS = {
+        ('bc1', False): GL_COMPRESSED_RGB_S3TC_DXT1_EXT,
+        ('bc1', True): GL_COMPRESSED_SRGB_S3TC_DXT1_EXT,
+        ('bc3', False): GL_COMPRESSED_RGBA_S3TC_DXT5_EXT,
+        ('bc3', True): GL_COMPRESSED_SRGB_ALPHA_S3TC_DXT5_EXT,
+    }
+
+    def __init__(self):
+        self.executor = None
+        # The names of the GL extensions, queried on first use (there must be a context)
+        self.extensions = None
+        # (normalized file name, srgb) -> TextureEntry
+        self.entries = {}
+        self.pending = []
+
+    @staticmethod
+    def getKey(fileName, srgb):
+        return os.path.normcase(os.path.normpath(fileName)), bool(srgb)
+
+    # Starts loading the texture (unless it is already loaded or on its way) and returns its TextureEntry, which
+    # has a valid textureId after finishLoading.
+    def request(self, fileName, srgb):
+        key = TextureManager.getKey(fileName, srgb)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = TextureEntry(fileName, srgb)
+            self.startLoading(entry, [fileName])
+            self.entries[key] = entry
+        entry.refCount += 1
+        return entry
+
+    # Like request, for a GL_TEXTURE_2D_ARRAY with the images as the layers, which must all be the same size. The
+    # layers are decoded in parallel too, and the array is shared by the list of file names.
+    def requestArray(self, fileNames, srgb):
+        key = tuple(TextureManager.getKey(fileName, srgb) for fileName in fileNames)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = TextureEntry(", ".join(fileNames), srgb)
+            entry.target = GL_TEXTURE_2D_ARRAY
+            entry.numLayers = len(fileNames)
+            self.startLoading(entry, fileNames)
+            self.entries[key] = entry
+        entry.refCount += 1
+        return entry
+
+    def startLoading(self, entry, fileNames):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.maxWorkers, thread_name_prefix="texture-decode")
+        entry.futures = [self.executor.submit(loadImage, fileName, entry.srgb, self.cacheDir) for fileName in fileNames]
+        self.pending.append(entry)
+
+    # Adds a texture from pixels that are already decoded (bottom-up RGBA bytes), e.g., the terrain map which is also
+    # read for the height map. It is shared under the file name like any other texture, and uploaded right away.
+    def addImage(self, fileName, width, height, data, srgb):
+        key = TextureManager.getKey(fileName, srgb)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = TextureEntry(fileName, srgb)
+            self.entries[key] = entry
+            self.upload(entry, [texture_cache.TextureImage(width, height, [data])])
+        entry.refCount += 1
+        return entry
+
+    # Loads a single texture and returns the texture id, or -1 if it failed
+    def load(self, fileName, srgb):
+        entry = self.request(fileName, srgb)
+        self.finishLoading()
+        return entry.textureId
+
+    # Waits for all the requested textures to be decoded and uploads them, in the order they finish decoding.
+    # Must be called on the thread that has the GL context.
+    def finishLoading(self):
+        pending, self.pending = self.pending, []
+        owners = {future: entry for entry in pending for future in entry.futures}
+        numPending = {id(entry): len(entry.futures) for entry in pending}
+        for future in as_completed(owners):
+            entry = owners[future]
+            numPending[id(entry)] -= 1
+            if numPending[id(entry)]:
+                continue
+            futures, entry.futures = entry.futures, []
+            try:
+                results = [f.result() for f in futures]
+            except Exception as e:
+                entry.failed = True
+                print("WARNING: FAILED to load texture '%s': %s" % (entry.fileName, e))
+                continue
+            entry.decodeTime = sum(seconds for _, seconds in results)
+            self.upload(entry, [image for image, _ in results])
+
+    # Returns the GL internal format to use for the block compressed levels of the images (the layers of a texture),
+    # or None if they do not all have them or they are not supported.
+    def getCompressedFormat(self, images, srgb):
+        compression = images[0].compression
+        if not self.useCompression or any(image.compressedLevels is None or image.compression != compression
+                                          for image in images):
+            return None
+        if self.extensions is None:
+            self.extensions = {glGetStringi(GL_EXTENSIONS, i).decode() for i in range(glGetIntegerv(GL_NUM_EXTENSIONS))}
+        if "GL_EXT_texture_compression_s3tc" not in self.extensions:
+            return None
+        if srgb and "GL_EXT_texture_sRGB" not in self.extensions:
+            return None
+        return self.COMPRESSED_FORMATS[(compression, srgb)]
+
+    # Uploads the images, a single one for a GL_TEXTURE_2D or the layers of a GL_TEXTURE_2D_ARRAY
+    def upload(self, entry, images):
+        start = time.perf_counter()
+        width, height = images[0].width, images[0].height
+        if any(image.width != width or image.height != height for image in images):
+            entry.failed = True
+            print("WARNING: FAILED to load texture '%s': the layers are not all the same size" % entry.fileName)
+            return
+        entry.width = width
+        entry.height = height
+        entry.textureId = glGenTextures(1)
+        glActiveTexture(GL_TEXTURE0)
+        glBindTexture(entry.target, entry.textureId)
+
+        # NOTE: srgb is used to store pretty much all texture image data (except HDR images, which we don't support)
+        # Thus we use the GL_SRGB_ALPHA to ensure they are correctly converted to linear space when loaded into the shader.
+        # However: normal/bump maps/alpha masks, are typically authored in linear space, and so should not be stored as SRGB texture format.
+        compressedFormat = self.getCompressedFormat(images, entry.srgb)
+        sizes = texture_cache.getMipSizes(width, height)
+        if compressedFormat is not None:
+            entry.numLevels = len(sizes)
+            entry.format = images[0].compression
+            entry.memorySize = 0
+            for level, (levelWidth, levelHeight) in enumerate(sizes):
+                data = TextureManager.joinLayers([image.compressedLevels[level] for image in images])
+                if entry.target == GL_TEXTURE_2D_ARRAY:
+                    glCompressedTexImage3D(entry.target, level, compressedFormat, levelWidth, levelHeight, len(images),
+                                           0, data)
+                else:
+                    glCompressedTexImage2D(entry.target, level, compressedFormat, levelWidth, levelHeight, 0, data)
+                entry.memorySize += len(data)
+        else:
+            # Decoded images only have the first level, the rest of the chain is generated
+            entry.numLevels = min(len(image.levels) for image in images)
+            entry.format = 'rgba8'
+            entry.memorySize = 4 * width * height * len(images) * 4 // 3
+            internalFormat = GL_SRGB_ALPHA if entry.srgb else GL_RGBA
+            for level, (levelWidth, levelHeight) in enumerate(sizes[:entry.numLevels]):
+                data = TextureManager.joinLayers([image.levels[level] for image in images])
+                if entry.target == GL_TEXTURE_2D_ARRAY:
+                    glTexImage3D(entry.target, level, internalFormat, levelWidth, levelHeight, len(images), 0, GL_RGBA,
+                                 GL_UNSIGNED_BYTE, data)
+                else:
+                    glTexImage2D(entry.target, level, internalFormat, levelWidth, levelHeight, 0, GL_RGBA,
+                                 GL_UNSIGNED_BYTE, data)
+            if entry.numLevels == 1:
+                glGenerateMipmap(entry.target)
+        glTexParameteri(entry.target, GL_TEXTURE_MAX_LEVEL, len(sizes) - 1)
+
+        glTexParameterf(entry.target, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameterf(entry.target, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(entry.target, GL_TEXTURE_WRAP_S, GL_REPEAT)
+        glTexParameteri(entry.target, GL_TEXTURE_WRAP_T, GL_REPEAT)
+        glBindTexture(entry.target, 0)
+        entry.uploadTime = time.perf_counter() - start
+
+    # The data of one mip level of all the layers, one after the other as glTexImage3D expects
+    @staticmethod
+    def joinLayers(layers):
+        return layers[0] if len(layers) == 1 else b"".join(layers)
+
+    # Removes a reference to the texture (given by TextureEntry or texture id), and deletes it when there are no more.
+    # The id -1 of a texture that failed to load does not identify one, so releasing it does nothing.
+    def release(self, texture):
+        if not isinstance(texture, TextureEntry) and texture == -1:
+            return
+        for key, entry in self.entries.items():
+            if entry is texture or entry.textureId == texture:
+                entry.refCount -= 1
+                if entry.refCount <= 0:
+                    if entry.futures:
+                        self.finishLoading()
+                    if entry.textureId != -1:
+                        glDeleteTextures([entry.textureId])
+                    del self.entries[key]
+                return
+
+    def drawUi(self):
+        entries = list(self.entries.values())
+        imgui.label_text("Textures", "%d" % len(entries))
+        imgui.label_text("DecodeTime", "%0.1fms" % (1000.0 * sum(e.decodeTime for e in entries)))
+        imgui.label_text("UploadTime", "%0.1fms" % (1000.0 * sum(e.uploadTime for e in entries)))
+        imgui.label_text("Memory", "%0.1fMB" % (sum(e.memorySize for e in entries) / (1024.0 * 1024.0)))
+        imgui.text("%-24s %9s %4s %-5s %4s %8s %8s" % ("file", "size", "refs", "fmt", "mips", "decode", "upload"))
+        for e in entries:
+            name = os.path.basename(e.fileName) if e.target == GL_TEXTURE_2D else "array of %d" % e.numLayers
+            imgui.text("%-24s %4dx%-4d %4d %-5s %4d %6.1fms %6.1fms" % (
+                name[:24], e.width, e.height, e.refCount, e.format, e.numLevels,
+                1000.0 * e.decodeTime, 1000.0 * e.uploadTime))
+
+
+# The texture manager used by ObjModel and the terrain
+g_textureManager = TextureManager()
@@ -0,0 +1,105 @@
+"""Uniform buffer objects using the std140 layout.
+
+A UniformBlockLayout describes a uniform block, i.e., the list of (type, name) members as declared in the
+shaders, and computes the std140 offset of each member. The layout registers the binding point of the block
+so that every ShaderProgram that uses the block is bound to it at link time (see lab_utils.ShaderProgram).
+
+A UniformBuffer keeps a CPU side copy of the block data, which is updated with set() and uploaded to the
+GL buffer with a single glBufferSubData call in upload(). Shaders then read the data from the buffer,
+instead of having each uniform uploaded separately for each shader program.
+"""
+
+import numpy as np
+from OpenGL.GL import *
+
+from utils import lab_utils as lu
+from utils.profiler import g_profiler
+
+
+# (base alignment, size) in bytes of the types we support, according to the std140 rules.
+# Note that a vec3 is aligned as a vec4, and that matrices are stored as arrays of vec4 columns.
+_STD140_TYPES = {
+    "float": (4, 4),
+    "int": (4, 4),
+    "vec2": (8, 8),
+    "vec3": (16, 12),
+    "vec4": (16, 16),
+    "mat3": (16, 48),
+    "mat4": (16, 64),
+}
+
+
+class UniformBlockLayout:
+    def __init__(self, name, members, bindingPoint):
+        self.name = name
+        self.bindingPoint = bindingPoint
+        # member name -> (type, offset)
+        self.members = {}
+        offset = 0
+        for memberType, memberName in members:
+            alignment, size = _STD140_TYPES[memberType]
+            offset = (offset + alignment - 1) // alignment * alignment
+            self.members[memberName] = (memberType, offset)
+            offset += size
+        # the size of a block is rounded up to the alignment of a vec4
+        self.size = (offset + 15) // 16 * 16
+        lu.g_uniformBlockBindings[name] = bindingPoint
+
+    # Writes the value into the float32 view of the block data at the location of the member
+    def write(self, floatData, name, value):
+        memberType, offset = self.members[name]
+        first = offset // 4
+        if memberType == "mat4":
+            # Mat4 data is row major, but GLSL expects column major (by default)
+            floatData[first:first + 16] = _matrixData(value).T.ravel()
+        elif memberType == "mat3":
+            columns = floatData[first:first + 12].reshape(3, 4)
+            columns[:, :3] = _matrixData(value).T
+        elif memberType == "int":
+            floatData[first:first + 1].view(np.int32)[0] = value
+        else:
+            numComponents = _STD140_TYPES[memberType][1] // 4
+            floatData[first:first + numComponents] = value
+
+
+def _matrixData(value):
+    return np.asarray(value.matData if isinstance(value, (lu.Mat3, lu.Mat4)) else value, dtype=np.float32)
+
+
+# A buffer holding one or more instances of a uniform block. With more than one block (e.g., one per material)
+# each is placed at an offset that satisfies GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT, and bindRange selects which
+# one the shaders read.
+class UniformBuffer:
+    def __init__(self, layout, usage=GL_DYNAMIC_DRAW, numBlocks=1):
+        self.layout = layout
+        self.numBlocks = numBlocks
+        self.stride = layout.size
+        if numBlocks > 1:
+            alignment = int(glGetIntegerv(GL_UNIFORM_BUFFER_OFFSET_ALIGNMENT))
+            self.stride = (layout.size + alignment - 1) // alignment * alignment
+        self.data = np.zeros((numBlocks, self.stride // 4), dtype=np.float32)
+        self.buffer = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer)
+        glBufferData(GL_UNIFORM_BUFFER, self.data.nbytes, None, usage)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        self.bind()
+
+    def set(self, name, value, blockIndex=0):
+        self.layout.write(self.data[blockIndex], name, value)
+
+    # Uploads all the blocks in one go
+    def upload(self):
+        g_profiler.count("uniformBufferUploads")
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, self.data.nbytes, self.data)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    # Binds the buffer to the binding point of the block, this stays in effect for all programs until
+    # something else is bound to the same binding point.
+    def bind(self):
+        glBindBufferBase(GL_UNIFORM_BUFFER, self.layout.bindingPoint, self.buffer)
+
+    # Binds just one of the blocks in the buffer to the binding point of the block
+    def bindRange(self, blockIndex):
+        glBindBufferRange(GL_UNIFORM_BUFFER, self.layout.bindingPoint, self.buffer,
+                          blockIndex * self.stride, self.layout.size)
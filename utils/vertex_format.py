@@ -0,0 +1,80 @@
+"""Interleaved vertex layouts, where all the attributes of a vertex are packed next to each other in a
+single vertex buffer.
+
+A VertexFormat describes the attributes (name, attribute location and number of float components) and
+computes the byte offset of each attribute and the stride between vertices. It packs numpy arrays
+(one per attribute) into one interleaved array, and sets up the attribute pointers of a VAO to read it.
+
+Attributes that a mesh does not have are simply left out of the format (see VertexFormat.forArrays),
+the shader then reads the current generic attribute value (0, 0, 0, 1) for them.
+"""
+
+import ctypes
+
+import numpy as np
+
+from utils import lab_utils as lu
+from utils.lazy_import import lazyModule
+
+GL = lazyModule("OpenGL.GL")
+
+
+class VertexAttribute:
+    def __init__(self, name, location, numComponents):
+        self.name = name
+        self.location = location
+        self.numComponents = numComponents
+        # byte offset from the start of the vertex, set by the VertexFormat
+        self.offset = 0
+
+
+class VertexFormat:
+    # All attributes are stored as 32-bit floats
+    componentSize = 4
+
+    def __init__(self, attributes):
+        self.attributes = attributes
+        offset = 0
+        for a in attributes:
+            a.offset = offset
+            offset += a.numComponents * self.componentSize
+        self.stride = offset
+        self.numComponents = offset // self.componentSize
+
+    # Creates a format with an attribute for each (name, location, array) where the array is not None, the
+    # number of components is taken from the array shape.
+    def forArrays(attributeArrays):
+        return VertexFormat([VertexAttribute(name, location, np.shape(data)[1])
+                             for name, location, data in attributeArrays if data is not None])
+
+    # Packs the arrays (a dict from attribute name to an (N, numComponents) array) into a single
+    # contiguous (N, format.numComponents) float32 array in the layout of the format.
+    def pack(self, arrays):
+        numVertices = len(arrays[self.attributes[0].name])
+        packed = np.empty((numVertices, self.numComponents), dtype=np.float32)
+        for a in self.attributes:
+            first = a.offset // self.componentSize
+            packed[:, first:first + a.numComponents] = arrays[a.name]
+        return packed
+
+    # Sets up the attribute pointers for the buffer bound to GL_ARRAY_BUFFER in the currently bound VAO
+    def setAttribPointers(self):
+        for a in self.attributes:
+            GL.glVertexAttribPointer(a.location, a.numComponents, GL.GL_FLOAT, GL.GL_FALSE, self.stride,
+                                  ctypes.c_void_p(a.offset))
+            GL.glEnableVertexAttribArray(a.location)
+
+    # Packs the arrays and uploads them into a new vertex buffer, which is attached to the VAO according
+    # to the format. Returns the buffer.
+    def createVertexBuffer(self, vertexArrayObject, arrays):
+        packed = self.pack(arrays)
+
+        GL.glBindVertexArray(vertexArrayObject)
+        buffer = GL.glGenBuffers(1)
+        lu.uploadBufferData(GL.GL_ARRAY_BUFFER, buffer, packed)
+        self.setAttribPointers()
+
+        # Unbind the buffers again to avoid unintentianal GL state corruption
+        GL.glBindBuffer(GL.GL_ARRAY_BUFFER, 0)
+        GL.glBindVertexArray(0)
+        return buffer